@@ -7,31 +7,61 @@ _           _
 \_( o.O )_/
 =====================================
 """
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g, Response, stream_with_context
 import utils
 import constant
-from config import APP_SECRET_KEY, SQL_CONNECTION
+from config import APP_SECRET_KEY, SQL_CONNECTION, MULTI_PROCESS, SYNTHETIC_DATA
 import json
 # create an instance of the Flask object
 from data_manager import DataManager
+from synthetic_data import SyntheticDataSource
+from response_cache import ResponseCache
 from apscheduler.schedulers.background import BackgroundScheduler
 import atexit
+import collections
+import os
+import datetime
+import time
 
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = APP_SECRET_KEY
 
-# initialise data manager for getting and regularly updating the datasets required for the flask webapp
-dm = DataManager()
+# initialise data manager for getting and regularly updating the datasets required for the flask webapp (from
+# synthetic data instead of the sql table if config.SYNTHETIC_DATA is set)
+dm = DataManager(SyntheticDataSource(SYNTHETIC_DATA['ROWS'], SYNTHETIC_DATA['SEED'])
+                 if SYNTHETIC_DATA['ROWS'] else None)
+
+
+# cache of the plot responses, the entries are dropped when a new data snapshot is published
+response_cache = ResponseCache(max_entries=constant.RESPONSE_CACHE_MAX_ENTRIES,
+                               max_bytes=constant.RESPONSE_CACHE_MAX_BYTES)
+
+
+# durations (ms) of the most recent searches, for the latency stats of /stats
+search_latencies = collections.deque(maxlen=constant.SEARCH_LATENCY_WINDOW)
 
 
 # runs a function in the background on a seperate thread every hour to update the database
 scheduler = BackgroundScheduler()
 scheduler.add_job(func=dm.update, trigger="interval", seconds=3600)
+# when served by several processes, the processes not refreshing the data pick up the snapshots cached by the one that
+# is (dm.update only refreshes the data in that process)
+if dm.multi_process:
+    scheduler.add_job(func=dm.sync_shared_snapshot, trigger="interval", seconds=MULTI_PROCESS['POLL_SECONDS'])
 scheduler.start()
 
-# Shut down the scheduler when exiting the app
+# Shut down the scheduler and close the sql connections when exiting the app
 atexit.register(lambda: scheduler.shutdown())
+atexit.register(lambda: dm.pool.close_all())
+
+
+@app.before_request
+def pin_snapshot():
+    """ pins the current data snapshot for the lifetime of the request, so that a refresh published by the background
+    job while the request is being served does not mix data from two versions
+    """
+    g.snapshot = dm.snapshot
 
 
 # ** Define routes **
@@ -39,8 +69,28 @@ atexit.register(lambda: scheduler.shutdown())
 # route for home page
 @app.route("/")
 def landing_page():
-    return render_template("landing_page.html", top_docs_stats=dm.top_docs_stats,
-                           reviewed_stats=utils.get_backlog_stats(dm.final_output_df))
+    snapshot = g.snapshot
+    # the backlog counts are precomputed with the snapshot and updated when statuses are saved
+    return render_template("landing_page.html", top_docs_stats=snapshot.top_docs_stats[:constant.TOP_DOCS_STATS_N],
+                           reviewed_stats=snapshot.backlog_stats.get_counts())
+
+
+# route for the stats of the most recent documents (shown on the landing page)
+@app.route('/top_docs')
+def top_docs():
+    """ returns the number of relevant/maybe relevant/not relevant changes of the k most recently revised documents,
+    precomputed when the data is loaded (k defaults to the number shown on the landing page)
+
+    :return: (json) - list of document stats, most recent revision first
+    """
+    k = request.args.get("k", constant.TOP_DOCS_STATS_N, type=int)
+    if k < 0:
+        return jsonify({'error': "k must be positive"}), 400
+    if k > constant.MAX_TOP_DOCS:
+        return jsonify({'error': f"k must be at most {constant.MAX_TOP_DOCS}"}), 400
+
+    return jsonify({'top_docs': [{**stats, 'rev_date': stats['rev_date'].strftime(constant.DT_FORMAT)}
+                                 for stats in g.snapshot.top_docs_stats[:k]]})
 
 
 # route for detect changes page
@@ -56,7 +106,7 @@ def doc_select():
     doc_type = request.args.get("doc_typ")
     
     # if gov is selected return gov doc names else non_gov doc names
-    docs = dm.gov_docs if doc_type.lower() == 'legislation' else dm.nongov_docs
+    docs = g.snapshot.gov_docs if doc_type.lower() == 'legislation' else g.snapshot.nongov_docs
     return jsonify({'docs': docs})
 
 
@@ -83,7 +133,7 @@ def sec_select():
     recency = request.args.get("recency")
     
     # get sections for the selected doc_type, document and recency
-    secs = utils.get_section_options(doc_type, docs, recency, dm.final_output_df)
+    secs = utils.get_section_options(recency, g.snapshot.get_doc_df(doc_type, docs))
     return jsonify({'secs': secs})
 
 
@@ -102,6 +152,9 @@ def relevance_select():
 def doc_change():
     """ returns values to be displayed on table, pdf viewer and change viewer, when the user selects relevancy
 
+    The detailed table can be requested a page at a time with the offset and limit args, or with the cursor arg set
+    to the next_cursor of the previous page, and sorted by another column with the sort and order (asc/desc) args.
+
     :return: (json) - detect changes page details (key metrics, change table, pdf viewer)
     """
     # get selected doc type, document name, recency, section and relevance
@@ -110,18 +163,70 @@ def doc_change():
     recency = request.args.get("recency")
     sec = request.args.get("sec")
     rel_type = request.args.get("rel_type")
-    
-    # get the page details for the selected doc_type, document, recency, section and relevance
-    page_details = utils.get_doc_changes(doc_type, docs, recency, sec, rel_type, dm.final_output_df)
-    
+    if not doc_type:
+        return jsonify({'error': "doc_typ is required"}), 400
+    # rows of the selected document
+    doc_df = g.snapshot.get_doc_df(doc_type, docs)
+    if doc_df.empty:
+        return jsonify({'error': f"Unknown {doc_type} document {docs}"}), 404
+
+    # optional page of the detailed table (all the rows sorted by currentRevision and ID by default)
+    try:
+        offset = request.args.get("offset", 0, type=int)
+        limit = request.args.get("limit", type=int)
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError("offset and limit must be positive")
+        if limit is not None:
+            limit = min(limit, constant.MAX_DETAIL_PAGE_SIZE)
+
+        # get the page details for the selected doc_type, document, recency, section and relevance
+        page_details = utils.get_doc_changes(doc_type, docs, recency, sec, rel_type, doc_df, g.snapshot.status_overlay,
+                                             offset=offset, limit=limit, cursor=request.args.get("cursor"),
+                                             sort=request.args.get("sort"), order=request.args.get("order", "desc"),
+                                             doc_revision=g.snapshot.get_doc_revision(doc_type, docs))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     return jsonify(page_details)
 
 
+# route for exporting the changes of the current snapshot
+@app.route('/export_changes')
+def export_changes():
+    """ streams the changes selected with the same filters as the Detect Changes tab (doc type, document, recency,
+    section, relevance) and optional statuses (comma separated), as ndjson or csv, the rows are read from the data
+    snapshot (not from the sql db) and formatted a chunk at a time
+
+    :return: (ndjson/csv) - exported changes
+    """
+    export_format = request.args.get("format", "ndjson").lower()
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': f"Invalid export format: {export_format}"}), 400
+    doc_type = request.args.get("doc_typ")
+    if not doc_type:
+        return jsonify({'error': "doc_typ is required"}), 400
+    statuses = request.args.get("status")
+    statuses = [status.strip().lower() for status in statuses.split(',')] if statuses else None
+
+    snapshot = g.snapshot
+    # all the documents of the doc type if no document is selected
+    positions = snapshot.get_doc_positions(doc_type, request.args.get("docs"))
+    positions = utils.get_export_positions(snapshot.final_output_df, positions,
+                                           request.args.get("recency", "Historical"), request.args.get("sec", "All"),
+                                           request.args.get("rel_type", "all"), statuses, snapshot.status_overlay)
+
+    chunks = utils.iter_export_chunks(snapshot.final_output_df, positions, export_format, snapshot.status_overlay)
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f"attachment; filename=changes.{export_format}",
+                             'X-Export-Rows': str(len(positions))})
+
+
 # route when the submit button is clicked
 @app.route('/save_changes', methods=['POST'])
 def save_changes():
     """ Triggered by the Submit button, gets the updated data from the 'Status' dropdown (value) and unique row ids (id)
-    and updates the db and the final_output_df
+    and updates the db and the status overlay of the data snapshot
 
     :return: (json) - success (boolean variable) 
                       text message (which is displayed on the UI when the db update succeeds or fails)
@@ -131,15 +236,16 @@ def save_changes():
     # parse the string back into a dictionary
     results = json.loads(results_tmp)
 
+    # get the current values of the submitted rows (including status changes already saved)
+    change_rows_df = g.snapshot.get_change_rows([int(row['id']) for row in results])
     # for each row in results, create a list of tuples (row id, col name, value to be filled in the col)
     # for rows to be updated in the sql table and the dataframe
-    db_updates, df_updates = utils.update_status_on_submit(results, dm.final_output_df)
+    db_updates, df_updates = utils.update_status_on_submit(results, change_rows_df)
 
-    # update[0] - mask on ID col, update[1] - col to be updated, update[2] - value to be filled in the col
-    for update in df_updates:
-        dm.final_output_df.loc[update[0], update[1]] = update[2]
     # update the sql db
     response = dm.update_sql(SQL_CONNECTION['TABLE_NAME'], db_updates)
+    # publish a new snapshot with the status changes in its overlay, the shared dataframes are not modified
+    dm.save_status_updates(df_updates)
     # format a message to be returned to the UI
     success, txt_msg = utils.format_response_msg_on_submit(response)
     
@@ -165,24 +271,31 @@ def plot_treemap():
     """
     # get document type selected by the user
     doc_type = request.args.get("document_type")
-
-    # get the copy of gov or non-gov dataframe depending on the doc_type
-    plot_doc_df = utils.get_gov_or_nongov_df_copy(doc_type, dm.gov_viz_df, dm.nongov_viz_df)
     # get doc name
     docs = request.args.get("docs")
-    # filter the dataframe on the document name
-    plot_doc_df = plot_doc_df.loc[plot_doc_df.documentName == docs]
     # get link relevancy selected by the user
     link_rel_type = request.args.get("maybe_link")
-    # filter the dataframe accordingly
-    plot_doc_df = utils.get_relevant_link_rows_for_viz(link_rel_type, plot_doc_df)
     # get recency selected by the user
     recency = request.args.get("recency_date")
+
+    # return the cached plot if the same one has already been built from this snapshot
+    cache_key = get_plot_cache_key('treemap', doc_type, docs, link_rel_type, recency)
+    graph_json = response_cache.get(g.snapshot.version, cache_key)
+    if graph_json is not None:
+        return graph_json
+
+    # get the rows of the document from the gov or non-gov dataframe depending on the doc_type
+    plot_doc_df = g.snapshot.get_viz_doc_df(doc_type, docs)
+    # filter the dataframe accordingly
+    plot_doc_df = utils.get_relevant_link_rows_for_viz(link_rel_type, plot_doc_df)
     # filter dataframe based on the recency period selected
     plot_doc_df = utils.get_recent_rows_for_viz(recency, plot_doc_df)
+    # add the change text of the rows, which is only held in final_output_df
+    plot_doc_df = plot_doc_df.assign(changeText=g.snapshot.get_change_texts(plot_doc_df['ID']))
     # plot treemap with the filtered df
-    graph_json = utils.plot_treemap(plot_doc_df)
+    graph_json = serialize_plot(utils.plot_treemap(plot_doc_df))
 
+    response_cache.put(g.snapshot.version, cache_key, graph_json)
     return graph_json
 
 
@@ -224,27 +337,158 @@ def plot_sankey():
     """
     # get document type selected by the user
     doc_type = request.args.get("document_type")
-    # get the gov or non-gov dataframe depending on the doc_type
-    plot_doc_df = utils.get_gov_or_nongov_df_copy(doc_type, dm.gov_viz_df, dm.nongov_viz_df)
     # get link relevancy selected by the user
     link_rel_type = request.args.get("maybe_link")
-    # filter the dataframe accordingly
-    plot_doc_df = utils.get_relevant_link_rows_for_viz(link_rel_type, plot_doc_df)
     # get recency selected by the user
     recency = request.args.get("recency_date")
-    # filter dataframe based on the recency period selected
-    plot_doc_df = utils.get_recent_rows_for_viz(recency, plot_doc_df)
-    # format the dataframe as needed for a sankey plot with source id, target id, etc
-    sankey_df = utils.format_data_for_sankey(plot_doc_df)
+
+    # return the cached plot if the same one has already been built from this snapshot
+    cache_key = get_plot_cache_key('sankey', doc_type, None, link_rel_type, recency)
+    graph_json = response_cache.get(g.snapshot.version, cache_key)
+    if graph_json is not None:
+        return graph_json
+
+    # get the number of changes per link (source id, target id, etc) for the link relevancy and recency period
+    # selected, from the link counts precomputed when the snapshot was built
+    sankey_df = g.snapshot.get_sankey_df(doc_type, link_rel_type, recency)
     # get the list of labels for a sankey from the sankey dataframe
     labels = utils.create_labels(sankey_df)
     # generate colours for links and nodes
     sankey_df, sankey_cmaps = utils.gen_colour(sankey_df)
     # plot the sankey diagram
-    graph_json = utils.sankey_plot(sankey_df, labels, sankey_cmaps)
-    
+    graph_json = serialize_plot(utils.sankey_plot(sankey_df, labels, sankey_cmaps))
+
+    response_cache.put(g.snapshot.version, cache_key, graph_json)
+    return graph_json
+
+
+# route for the changes linked to an SL document (reverse lookup of the golden thread)
+@app.route('/sl_doc_changes')
+def sl_doc_changes():
+    """ returns the changes of all the legislation and guidance documents linked to an SL document, most recent
+    revision first, read from the reverse index precomputed with the snapshot
+
+    The changes can be filtered with the rel_type (Strong/Soft/all), recency (1 month, 1 year, Historical, etc) and
+    doc_typ (Legislation/Guidance) args, and requested a page at a time with the offset and limit args.
+
+    :return: (json) - total number of changes and the page of changes
+    """
+    sl_document = request.args.get("sl_doc")
+    rel_type = request.args.get("rel_type", "all")
+    recency = request.args.get("recency", "Historical")
+    doc_type = request.args.get("doc_typ")
+    offset = request.args.get("offset", 0, type=int)
+    limit = request.args.get("limit", constant.SL_DOC_CHANGES_PAGE_SIZE, type=int)
+    if sl_document not in g.snapshot.sl_doc_index.sl_docs:
+        return jsonify({'error': f"no changes are linked to the SL document {sl_document}"}), 404
+    if rel_type.lower() != 'all' and rel_type not in ('Strong', 'Soft'):
+        return jsonify({'error': "rel_type must be Strong, Soft or all"}), 400
+    if recency not in constant.RECENCY_PERIODS:
+        return jsonify({'error': f"recency must be one of {constant.RECENCY_PERIODS}"}), 400
+    if offset < 0 or limit < 0:
+        return jsonify({'error': "offset and limit must be positive"}), 400
+    limit = min(limit, constant.MAX_DETAIL_PAGE_SIZE)
+
+    changes_df, num_changes = g.snapshot.get_sl_doc_changes(sl_document, rel_type, recency, doc_type, offset=offset,
+                                                             limit=limit)
+
+    return jsonify({'sl_document': sl_document, 'num_changes': num_changes, 'offset': offset, 'limit': limit,
+                    'changes': utils.format_sl_doc_changes(changes_df)})
+
+
+# route for the full-text search of the changes
+@app.route('/search')
+def search():
+    """ returns the changes of all the documents matching a full-text search of their change text, previous and next
+    paragraphs and section title, best match first (BM25 ranking, see search_index.py)
+
+    Words between quotes in the query are matched as a phrase. The results can be filtered with the same doc_typ,
+    docs, recency and rel_type args as the Detect Changes tab, and requested a page at a time with the offset and
+    limit args.
+
+    :return: (json) - total number of results, the page of results and the time the search took
+    """
+    query = request.args.get("q", "")
+    doc_type = request.args.get("doc_typ")
+    docs = request.args.get("docs")
+    recency = request.args.get("recency", "Historical")
+    rel_type = request.args.get("rel_type", "all")
+    offset = request.args.get("offset", 0, type=int)
+    limit = request.args.get("limit", constant.SEARCH_PAGE_SIZE, type=int)
+    if not query.strip():
+        return jsonify({'error': "q must not be empty"}), 400
+    if doc_type is not None and doc_type not in constant.DOC_TYPES:
+        return jsonify({'error': f"doc_typ must be one of {constant.DOC_TYPES}"}), 400
+    if rel_type.lower() not in constant.REL_TYPES:
+        return jsonify({'error': f"rel_type must be one of {constant.REL_TYPES}"}), 400
+    if recency not in constant.RECENCY_PERIODS:
+        return jsonify({'error': f"recency must be one of {constant.RECENCY_PERIODS}"}), 400
+    if offset < 0 or limit < 0:
+        return jsonify({'error': "offset and limit must be positive"}), 400
+    limit = min(limit, constant.MAX_DETAIL_PAGE_SIZE)
+
+    started_at = time.perf_counter()
+    rows_df, scores, num_results = g.snapshot.search(query, doc_type, docs, recency, rel_type, offset=offset,
+                                                     limit=limit)
+    took_ms = (time.perf_counter() - started_at) * 1000
+    search_latencies.append(took_ms)
+
+    return jsonify({'query': query, 'num_results': num_results, 'offset': offset, 'limit': limit,
+                    'took_ms': round(took_ms, 2), 'results': utils.format_search_results(rows_df, scores)})
+
+
+def serialize_plot(fig):
+    """ converts a plot to json, the time taken and the size of the json are added to the response headers
+
+    :return: (bytes) - plot converted to json format, encoded in utf-8
+    """
+    start = time.perf_counter()
+    graph_json = utils.fig_to_json(fig).encode()
+    g.plot_serialization = (time.perf_counter() - start, len(graph_json))
     return graph_json
 
 
+@app.after_request
+def add_plot_serialization_headers(response):
+    """ reports the serialization time (Server-Timing header, shown in the browser dev tools) and size of the plot
+    built by the request
+    """
+    if 'plot_serialization' in g:
+        seconds, n_bytes = g.plot_serialization
+        response.headers['Server-Timing'] = f"serialize;dur={seconds * 1000:.2f}"
+        response.headers['X-Plot-Json-Bytes'] = str(n_bytes)
+    return response
+
+
+def get_plot_cache_key(plot, doc_type, docs, link_rel_type, recency):
+    """ returns the key of a plot in the response cache
+
+    The recency periods are relative to the current date and the revision dates are days, so the rows selected by a
+    recency period only change from one day to the next - the current date is part of the key.
+
+    :return: (tuple) - cache key
+    """
+    return plot, doc_type, docs, link_rel_type, recency, datetime.date.today()
+
+
+# route for monitoring the data snapshot, the sql connection pool and the response cache
+@app.route('/stats')
+def stats():
+    """ returns the version of the data snapshot being served, the counters of the sql connection pool, of the plot
+    response cache and of the change context cache, and the size and latency of the search index
+
+    :return: (json) - snapshot and connection pool stats
+    """
+    return jsonify({'snapshot': {'version': g.snapshot.version, 'created_at': g.snapshot.created_at.isoformat()},
+                    'process': {'pid': os.getpid(), 'multi_process': dm.multi_process, 'refresher': dm.is_refresher},
+                    'sql_pool': dm.pool.stats(),
+                    'memory_mb': dm.memory_report,
+                    'search': {'index': g.snapshot.search_index.stats(),
+                               'latency_ms': utils.get_latency_stats(list(search_latencies))},
+                    'response_cache': response_cache.stats(),
+                    'pdf_url_cache': utils.pdf_url_cache.stats(),
+                    'change_context_cache': utils.create_context.cache_info()._asdict()})
+
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0', debug=True)
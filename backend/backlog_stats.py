@@ -0,0 +1,81 @@
+import constant
+import copy
+import numpy as np
+from datetime import datetime
+
+
+class BacklogStats:
+    """Number of changes of the backlog (revised since constant.START_DT_FOR_BACKLOG_STATS) per status, shown on the
+    landing page
+
+    The counts are computed once from the rows of a snapshot, then kept up to date with the status changes saved by
+    the users (see with_status_changes) so that the landing page never reads the dataframe. Like the snapshot, a
+    BacklogStats is never modified, the status changes return a new one sharing the per-row arrays.
+    """
+
+    def __init__(self, final_output_df, id_index):
+        """
+        Args:
+            final_output_df: (dataframe) - the dataframe with all change and SL link details, without status overlay
+            id_index: (Index) - index of the row ids of final_output_df (see DataSnapshot.id_index)
+        """
+        start_dt_for_backlog_stats = datetime.strptime(constant.START_DT_FOR_BACKLOG_STATS, '%d/%m/%Y')
+
+        self._id_index = id_index
+        # per row: whether it is part of the backlog and its status in the dataframe (lower case)
+        self._in_backlog = (final_output_df['currentRevision'] >= start_dt_for_backlog_stats).to_numpy(dtype=bool)
+        self._statuses = final_output_df['status'].astype(str).str.lower().to_numpy()
+
+        statuses, counts = np.unique(self._statuses[self._in_backlog], return_counts=True)
+        self._base_counts = {status: int(count) for status, count in zip(statuses, counts)}
+        self._counts = self._base_counts
+
+    def get_counts(self):
+        """ returns the count of not started/reviewed/addressed changes of the backlog, with the status overlay
+        applied
+
+        Returns: dict
+        """
+        return {status: self._counts.get(status, 0) for status in ('not started', 'reviewed', 'addressed')}
+
+    def with_status_overlay(self, status_overlay):
+        """ returns the stats of the rows with a status overlay applied, counted from the rows changed by the overlay
+
+        Args:
+            status_overlay: (dict) - {ID: {col_name: value}} status changes saved since the data was read
+
+        Returns: BacklogStats
+        """
+        counts = dict(self._base_counts)
+        for row_id, cols in status_overlay.items():
+            if 'status' in cols:
+                self.__move_rows(counts, row_id, None, cols['status'])
+        return self.__copy_with_counts(counts)
+
+    def with_status_changes(self, status_overlay, status_changes):
+        """ returns the stats after saving status changes, only the changed rows are moved between the counts
+
+        Args:
+            status_overlay: (dict) - status overlay the current counts include
+            status_changes: (dict) - {ID: new status} saved by a user
+
+        Returns: BacklogStats
+        """
+        counts = dict(self._counts)
+        for row_id, status in status_changes.items():
+            self.__move_rows(counts, row_id, status_overlay.get(row_id, {}).get('status'), status)
+        return self.__copy_with_counts(counts)
+
+    def __move_rows(self, counts, row_id, old_status, new_status):
+        # moves the rows of an id from their current status (the dataframe status if old_status is None) to new_status
+        for position in self._id_index.get_indexer_for([row_id]):
+            if position < 0 or not self._in_backlog[position]:
+                continue
+            current_status = self._statuses[position] if old_status is None else str(old_status).lower()
+            counts[current_status] = counts.get(current_status, 0) - 1
+            counts[str(new_status).lower()] = counts.get(str(new_status).lower(), 0) + 1
+
+    def __copy_with_counts(self, counts):
+        stats = copy.copy(self)
+        stats._counts = counts
+        return stats
@@ -0,0 +1,329 @@
+"""
+=====================================
+Benchmark of the data refresh pipeline and of the flask routes on synthetic data (see synthetic_data.py)
+
+Each size runs in a fresh process serving synthetic data instead of the sql table (config.SYNTHETIC_DATA). The stages
+of the first load of the data (DataManager.update) are timed, then each route is called through the flask test
+client, once cold and --repeat more times, then a delta refresh is timed. Last the snapshot is written to the on-disk
+cache and read back (see snapshot_cache.py), with the search index build that reading the index saves. The results are
+appended to benchmarks/results/bench_app.jsonl (not versioned, runs on a working tree with changes are marked with a +
+after the git commit) and compared with the last stored run of the same size.
+
+Usage (from the backend folder):  python benchmarks/bench_app.py [n_rows ...] [--repeat N] [--no-store]
+(e.g. python benchmarks/bench_app.py 10000 100000, the peak memory grows about linearly with the number of rows, about
+2GB at 300k rows, a size that does not fit in memory is reported as failed and the next sizes are still run)
+=====================================
+"""
+import datetime
+import functools
+import inspect
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import warnings
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND_DIR)
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 5_000_000]
+DEFAULT_REPEAT = 20
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'bench_app.jsonl')
+
+
+def get_stages():
+    """ returns the timed stages of the first load of the data, (name, object, attribute of the timed function)
+
+    The stages indented by two spaces run within the stage above them.
+    """
+    import data_manager
+    import snapshot
+    import synthetic_data
+    import utils
+
+    return [('generate synthetic data', synthetic_data, 'make_dependency_mapper_output'),
+            ('read', data_manager.DataManager, '_DataManager__get_sql_data'),
+            ('transform', data_manager.DataManager, 'transform'),
+            ('  clean_documentnames', utils, 'clean_documentnames'),
+            ('  get_status', utils, 'get_status'),
+            ('  get_long_tbl_sl_links_df', utils, 'get_long_tbl_sl_links_df'),
+            ('  get_rel_sl_links', utils, 'get_rel_sl_links'),
+            ('  get_final_df_for_viz', utils, 'get_final_df_for_viz'),
+            ('  compact_datasets', utils, 'compact_datasets'),
+            ('  apply_schema', utils, 'apply_schema'),
+            ('build_datasets', data_manager.DataManager, 'build_datasets'),
+            ('  get_recent_changes_stats', utils, 'get_recent_changes_stats'),
+            ('search_index', data_manager, 'SearchIndex'),
+            ('snapshot', data_manager, 'DataSnapshot'),
+            ('  get_doc_partitions', utils, 'get_doc_partitions'),
+            ('  get_doc_revisions', utils, 'get_doc_revisions'),
+            ('  sankey_aggregates', snapshot, 'SankeyAggregates'),
+            ('  sl_doc_index', snapshot, 'SlDocIndex'),
+            ('  backlog_stats', snapshot, 'BacklogStats'),
+            ('warm_pdf_urls', utils.pdf_url_cache, 'warm')]
+
+
+def get_cache_stages():
+    """ returns the timed stages of writing a snapshot to the on-disk cache and reading it back (as the processes
+    following the refresher load it, see snapshot_cache.py), (name, object, attribute of the timed function)
+    """
+    import snapshot_cache
+
+    return [('save_snapshot', snapshot_cache, 'save_snapshot'),
+            ('load_snapshot', snapshot_cache, 'load_snapshot'),
+            ('  load search_index', snapshot_cache.SearchIndex, 'load'),
+            ('  snapshot', snapshot_cache, 'DataSnapshot')]
+
+
+def time_stages(timings):
+    """ wraps the functions of the stages so that their run time is added to the dict timings['current'] ({stage
+    name: seconds}), the stages are not timed while timings['current'] is None
+
+    Args:
+        timings: (dict) - {'current': dict the stage times are added to or None}
+    """
+    def timed(func, stage):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stage_seconds = timings['current']
+                if stage_seconds is not None:
+                    stage_seconds[stage] = stage_seconds.get(stage, 0) + time.perf_counter() - start
+        return wrapper
+
+    for stage, owner, attr in get_stages() + get_cache_stages():
+        func = getattr(owner, attr)
+        wrapper = timed(func, stage)
+        # static methods stay static methods, class methods are already bound to their class
+        if inspect.isclass(owner) and isinstance(inspect.getattr_static(owner, attr), (staticmethod, classmethod)):
+            wrapper = staticmethod(wrapper)
+        setattr(owner, attr, wrapper)
+
+
+def sort_stages(stage_seconds, stages):
+    """ returns the times of the stages in the order of the stages (a stage finishes after the stages within it),
+    rounded to the ms
+
+    Args:
+        stage_seconds: (dict) - {stage name: seconds}
+        stages: (list) - stages as returned by get_stages, the times of other stages are dropped
+    """
+    return {stage: round(stage_seconds[stage], 3) for stage, _, _ in stages if stage in stage_seconds}
+
+
+def get_routes(snapshot):
+    """ returns the routes called, (name, method, url, form data), for the largest gov document of a snapshot
+
+    Args:
+        snapshot: (DataSnapshot) - snapshot served by the app
+
+    Returns: list of tuples, /save_changes is last as it publishes a new snapshot (which drops the cached plots)
+    """
+    (_, docs), positions = max(((key, positions) for key, positions in snapshot.doc_partitions.items()
+                                if key[0] == 'gov'), key=lambda item: len(item[1]))
+    section = snapshot.final_output_df['sectionTitle'].iloc[positions].astype(str).mode()[0]
+    sl_document = snapshot.gov_viz_df['sl_document'].astype(str).mode()[0]
+    ids = snapshot.final_output_df['ID'].iloc[positions[:20]].tolist()
+
+    def url(path, **args):
+        return f"{path}?{urllib.parse.urlencode(args)}"
+
+    return [('/', 'GET', '/', None),
+            ('/top_docs', 'GET', url('/top_docs', k=10), None),
+            ('/sec_select', 'GET', url('/sec_select', doc_typ='Legislation', docs=docs, recency='Historical'), None),
+            ('/doc_change (page of 100)', 'GET', url('/doc_change', doc_typ='Legislation', docs=docs,
+                                                     recency='Historical', sec='All', rel_type='all', limit=100), None),
+            ('/doc_change (all rows)', 'GET', url('/doc_change', doc_typ='Legislation', docs=docs,
+                                                  recency='Historical', sec='All', rel_type='all'), None),
+            ('/doc_change (section)', 'GET', url('/doc_change', doc_typ='Legislation', docs=docs, recency='1 year',
+                                                 sec=section, rel_type='relevant'), None),
+            ('/plot_treemap', 'GET', url('/plot_treemap', document_type='Legislation', docs=docs, maybe_link='Strong',
+                                         recency_date='Historical'), None),
+            ('/plot_sankey', 'GET', url('/plot_sankey', document_type='Legislation', maybe_link='Strong',
+                                        recency_date='Historical'), None),
+            ('/sl_doc_changes', 'GET', url('/sl_doc_changes', sl_doc=sl_document, rel_type='all', recency='1 year'),
+             None),
+            ('/search', 'GET', url('/search', q='radiation "dose limit"', limit=20), None),
+            ('/save_changes', 'POST', '/save_changes', ids)]
+
+
+def call_route(client, method, url, data, call_number):
+    """ calls a route and returns its response time in ms """
+    if method == 'POST':
+        # the rows are set to reviewed and back to not started on every other call, so every call saves a change
+        value = 'Reviewed' if call_number % 2 == 0 else 'Not Started'
+        data = {'results': json.dumps([{'id': str(row_id), 'value': value} for row_id in data])}
+    start = time.perf_counter()
+    response = client.open(url, method=method, data=data)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if response.status_code != 200:
+        raise RuntimeError(f"{method} {url} returned {response.status_code}")
+    return elapsed_ms
+
+
+def run(n_rows, repeat, output_path):
+    """ loads n_rows of synthetic data in the app, calls the routes and writes the results as json to output_path """
+    os.environ['SLCOMPLY_SYNTHETIC_ROWS'] = str(n_rows)
+    os.chdir(BACKEND_DIR)
+    # the warnings of the pipeline would be printed on every call
+    warnings.simplefilter('ignore', pd.errors.SettingWithCopyWarning)
+    stage_seconds = {}
+    timings = {'current': stage_seconds}
+    time_stages(timings)
+
+    start = time.perf_counter()
+    import app
+    startup_seconds = time.perf_counter() - start
+    timings['current'] = None
+
+    client = app.app.test_client()
+    routes = {}
+    for name, method, url, data in get_routes(app.dm.snapshot):
+        first_ms = call_route(client, method, url, data, 0)
+        times_ms = [call_route(client, method, url, data, call_number) for call_number in range(1, repeat + 1)]
+        routes[name] = {'first_ms': round(first_ms, 2), 'median_ms': round(float(np.median(times_ms)), 2),
+                        'p95_ms': round(float(np.percentile(times_ms, 95)), 2)}
+
+    # a delta refresh reading back the status changes saved by /save_changes
+    delta_stage_seconds = {}
+    timings['current'] = delta_stage_seconds
+    start = time.perf_counter()
+    app.dm.update()
+    delta_refresh_seconds = time.perf_counter() - start
+    timings['current'] = None
+
+    import snapshot_cache
+    import utils
+    # the cache stages hold a second copy of the snapshot, the peak memory is that of serving one snapshot
+    peak_memory_mb = utils.get_peak_memory_mb()
+    cache_stage_seconds = {}
+    if snapshot_cache.feather is not None:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            timings['current'] = cache_stage_seconds
+            snapshot_cache.save_snapshot(app.dm.snapshot, cache_dir)
+            cached_snapshot = snapshot_cache.load_snapshot(cache_dir)
+            timings['current'] = None
+            cache_stage_seconds = sort_stages(cache_stage_seconds, get_cache_stages())
+            # the search index build that reading the index from the cache saves
+            start = time.perf_counter()
+            snapshot_cache.SearchIndex(cached_snapshot.final_output_df)
+            cache_stage_seconds['search_index rebuild'] = round(time.perf_counter() - start, 3)
+            del cached_snapshot
+
+    result = {'n_rows': n_rows, 'repeat': repeat, 'startup_seconds': round(startup_seconds, 3),
+              'stages_seconds': sort_stages(stage_seconds, get_stages()),
+              'delta_refresh_seconds': round(delta_refresh_seconds, 3),
+              'delta_stages_seconds': sort_stages(delta_stage_seconds, get_stages()),
+              'cache_stages_seconds': cache_stage_seconds,
+              'routes': routes,
+              'memory_mb': app.dm.memory_report, 'search_index': app.dm.snapshot.search_index.stats(),
+              'peak_memory_mb': peak_memory_mb}
+    with open(output_path, 'w') as f:
+        json.dump(result, f)
+
+
+def get_git_commit():
+    """ returns the commit the benchmark runs on (with a + if the working tree has changes), None if unknown """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BACKEND_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('+' if dirty else '')
+
+
+def load_last_result(n_rows):
+    """ returns the last stored result of a size, None if there is none """
+    if not os.path.exists(RESULTS_PATH):
+        return None
+    last_result = None
+    with open(RESULTS_PATH) as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                if result['n_rows'] == n_rows:
+                    last_result = result
+    return last_result
+
+
+def format_change(value, previous_value):
+    """ returns the change of a value in % of the previous value, '' without a previous value """
+    if not previous_value:
+        return ''
+    return f"{(value - previous_value) / previous_value * 100:+.0f}%"
+
+
+def print_result(result, previous_result):
+    """ prints the stage and route times of a run, and their change since the previous run of the same size """
+    previous_result = previous_result or {'stages_seconds': {}, 'cache_stages_seconds': {}, 'routes': {},
+                                          'git_commit': None}
+    print(f"\n{result['n_rows']:,} rows (git {result['git_commit']}, "
+          f"compared with git {previous_result['git_commit']})")
+    print(f"startup {result['startup_seconds']:.2f}s, delta refresh {result['delta_refresh_seconds']:.2f}s, "
+          f"peak memory {result['peak_memory_mb']:.0f}MB, datasets {result['memory_mb']['total']}MB, "
+          f"search index {result['search_index']['memory_mb']}MB")
+
+    print(f"{'stage':<30}{'time (s)':>10}{'change':>9}")
+    for stage, seconds in result['stages_seconds'].items():
+        print(f"{stage:<30}{seconds:>10.3f}{format_change(seconds, previous_result['stages_seconds'].get(stage)):>9}")
+
+    # not in the results stored before the snapshot cache was benchmarked
+    if result['cache_stages_seconds']:
+        previous_cache_stages = previous_result.get('cache_stages_seconds', {})
+        print(f"{'snapshot cache stage':<30}{'time (s)':>10}{'change':>9}")
+        for stage, seconds in result['cache_stages_seconds'].items():
+            print(f"{stage:<30}{seconds:>10.3f}{format_change(seconds, previous_cache_stages.get(stage)):>9}")
+
+    print(f"{'route':<30}{'first (ms)':>11}{'median (ms)':>13}{'p95 (ms)':>10}{'change':>9}")
+    for route, times in result['routes'].items():
+        previous_median = previous_result['routes'].get(route, {}).get('median_ms')
+        print(f"{route:<30}{times['first_ms']:>11.1f}{times['median_ms']:>13.1f}{times['p95_ms']:>10.1f}"
+              f"{format_change(times['median_ms'], previous_median):>9}")
+
+
+def main(sizes, repeat, store):
+    for n_rows in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_path = os.path.join(tmp_dir, 'result.json')
+            returncode = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', str(n_rows), str(repeat),
+                                         output_path], stdout=subprocess.DEVNULL).returncode
+            # e.g. killed (-9) when the size does not fit in memory, the other sizes are still run
+            if returncode != 0:
+                print(f"\n{n_rows:,} rows: the run failed with exit code {returncode}")
+                continue
+            with open(output_path) as f:
+                result = json.load(f)
+
+        result = {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'), 'git_commit': get_git_commit(),
+                  'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__, **result}
+        print_result(result, load_last_result(n_rows))
+
+        if store:
+            os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+            with open(RESULTS_PATH, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+
+    if store:
+        print(f"\nResults appended to {os.path.relpath(RESULTS_PATH)}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--run':
+        run(int(sys.argv[2]), int(sys.argv[3]), sys.argv[4])
+    else:
+        args = sys.argv[1:]
+        repeat = int(args[args.index('--repeat') + 1]) if '--repeat' in args else DEFAULT_REPEAT
+        sizes = [int(arg) for i, arg in enumerate(args)
+                 if arg.isdigit() and (i == 0 or args[i - 1] != '--repeat')] or DEFAULT_SIZES
+        main(sizes, repeat, '--no-store' not in args)
@@ -0,0 +1,96 @@
+"""
+=====================================
+Benchmark of the peak memory of reading the sql table with fetchall() into a list of dicts vs streaming the rows in
+chunks with utils.read_sql_chunks
+
+A local sqlite3 database with the same columns as the sql table stands in for the sql server. Each loader runs in a
+fresh process, so that the peak resident memory measured is the one of that loader only.
+
+Usage (from the backend folder):  python benchmarks/bench_sql_fetch.py [n_rows] [chunk_size]
+=====================================
+"""
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import utils  # noqa: E402
+
+DEFAULT_N_ROWS = 200_000
+DEFAULT_CHUNK_SIZE = 10_000
+LOADERS = ['fetchall_dicts', 'read_sql_chunks']
+
+
+def make_table(path, n_rows, n_sl_cols=200, seed=0):
+    """ writes a sqlite table with the columns of the sql table (text columns and the wide set of SL link columns)
+
+    Args:
+        path: (str) path of the sqlite database
+        n_rows: (int) number of rows
+        n_sl_cols: (int) number of SL link columns
+        seed: (int) random seed
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'ID': np.arange(1, n_rows + 1),
+        'documentName': [f"Document {i % 300} Rev1 2021-01-01" for i in range(n_rows)],
+        'documentType': np.where(rng.random(n_rows) < 0.5, 'gov', 'non-gov'),
+        'currentRevision': '2022-03-01',
+        'sectionTitle': [f"Section {i % 40}" for i in range(n_rows)],
+        'changeText': [f"change text {i} " * 8 for i in range(n_rows)],
+        'rel_model_pred': rng.choice([0.0, 0.5, 1.0], n_rows),
+    })
+    sl_values = rng.choice([0.0, 0.5, 1.0, np.nan], (n_rows, n_sl_cols), p=[0.9, 0.03, 0.03, 0.04])
+    sl_df = pd.DataFrame(sl_values, columns=[f"SLM_1_{i // 10:02d}_{i % 10:02d}" for i in range(n_sl_cols)])
+
+    with sqlite3.connect(path) as conn:
+        pd.concat([df, sl_df], axis=1).to_sql('production', conn, index=False, if_exists='replace')
+
+
+def run_loader(path, loader, chunk_size):
+    """ reads the table with one of the loaders and prints the time taken and the peak memory in MB """
+    conn = sqlite3.connect(path)
+    peak_memory_before = utils.get_peak_memory_mb()
+    start = time.perf_counter()
+
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM production")
+    if loader == 'fetchall_dicts':
+        # previous loader - the whole table as a list of dicts (pymssql as_dict=True cursor), then copied to a df
+        columns = [col[0] for col in cur.description]
+        data = [dict(zip(columns, row)) for row in cur.fetchall()]
+        df = pd.DataFrame(data)
+    else:
+        df = utils.read_sql_chunks(cur, chunk_size)
+
+    elapsed = time.perf_counter() - start
+    print(f"{loader},{len(df)},{elapsed:.2f},{peak_memory_before:.0f},{utils.get_peak_memory_mb():.0f},"
+          f"{df.memory_usage(deep=True).sum() / 1024 ** 2:.0f}")
+
+
+def main(n_rows, chunk_size):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'bench.db')
+        # the peak memory is kept across exec, so the table is written by a separate process as well
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--make', path, str(n_rows)], check=True)
+        print(f"{n_rows} rows, chunk size {chunk_size}")
+        print(f"{'loader':<18}{'time (s)':>10}{'peak before (MB)':>18}{'peak after (MB)':>17}{'df (MB)':>9}")
+        for loader in LOADERS:
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', path, loader, str(chunk_size)],
+                                 capture_output=True, text=True, check=True).stdout.strip().split(',')
+            print(f"{out[0]:<18}{out[2]:>10}{out[3]:>18}{out[4]:>17}{out[5]:>9}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--make':
+        make_table(sys.argv[2], int(sys.argv[3]))
+    elif len(sys.argv) > 1 and sys.argv[1] == '--run':
+        run_loader(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_N_ROWS,
+             int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_CHUNK_SIZE)
@@ -0,0 +1,89 @@
+"""
+=====================================
+Benchmark of the row-wise vs vectorized stages of DataManager.transform
+
+Usage (from the backend folder):  python benchmarks/bench_transform_stages.py [n_rows ...]
+=====================================
+"""
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import utils  # noqa: E402
+
+DEFAULT_SIZES = [100_000, 1_000_000]
+
+
+def make_frame(n_rows, n_docs=300, seed=0):
+    """ returns a dataframe with the columns used by the benchmarked stages
+
+    Args:
+        n_rows: (int) number of rows
+        n_docs: (int) number of unique raw document names
+        seed: (int) random seed
+
+    Returns: dataframe
+    """
+    rng = np.random.default_rng(seed)
+    raw_names = np.array([f"Document {i} Rev{i % 7} 2021-0{1 + i % 9}-1{i % 10}" for i in range(n_docs)],
+                         dtype=object)
+
+    return pd.DataFrame({
+        'documentName': raw_names[rng.integers(0, n_docs, n_rows)],
+        'rel_model_pred': rng.choice([0.0, 0.5, 1.0], n_rows),
+        'strongLinks': np.where(rng.random(n_rows) < 0.3, 'SLM 1.05.03<br>SLM 1.06.01', ''),
+        'softLinks': np.where(rng.random(n_rows) < 0.3, 'SLP 2.01.01', ''),
+    })
+
+
+# stages as they were implemented with DataFrame.apply(..., axis=1)
+ROW_WISE_STAGES = {
+    'clean_documentname': lambda df: df.apply(lambda x: utils.clean_documentname(x['documentName']), axis=1),
+    'strongLinks': lambda df: df[['rel_model_pred', 'strongLinks']].apply(
+        lambda x: "" if x['rel_model_pred'] < 0.5 else x['strongLinks'], axis=1),
+    'softLinks': lambda df: df[['rel_model_pred', 'softLinks']].apply(
+        lambda x: "" if x['rel_model_pred'] < 0.5 else x['softLinks'], axis=1),
+}
+
+# stages as implemented in DataManager.transform
+VECTORIZED_STAGES = {
+    'clean_documentname': lambda df: utils.clean_documentnames(df['documentName']),
+    'strongLinks': lambda df: df['strongLinks'].mask(df['rel_model_pred'] < 0.5, ""),
+    'softLinks': lambda df: df['softLinks'].mask(df['rel_model_pred'] < 0.5, ""),
+}
+
+
+def time_stage(stage_func, df):
+    """ returns the output of a stage and its run time in seconds """
+    start = time.perf_counter()
+    output = stage_func(df)
+    return output, time.perf_counter() - start
+
+
+def run(n_rows):
+    """ times the row-wise and vectorized version of each stage and checks that they give the same output """
+    df = make_frame(n_rows)
+    print(f"\n{n_rows:,} rows")
+    print(f"{'stage':<20}{'row-wise (s)':>14}{'vectorized (s)':>16}{'speed-up':>10}")
+
+    total_row_wise = total_vectorized = 0
+    for stage, row_wise_func in ROW_WISE_STAGES.items():
+        row_wise_output, row_wise_time = time_stage(row_wise_func, df)
+        vectorized_output, vectorized_time = time_stage(VECTORIZED_STAGES[stage], df)
+        # the vectorized stages must give exactly the same output
+        pd.testing.assert_series_equal(row_wise_output, vectorized_output, check_names=False)
+
+        total_row_wise += row_wise_time
+        total_vectorized += vectorized_time
+        print(f"{stage:<20}{row_wise_time:>14.3f}{vectorized_time:>16.3f}{row_wise_time / vectorized_time:>9.1f}x")
+
+    print(f"{'total':<20}{total_row_wise:>14.3f}{total_vectorized:>16.3f}{total_row_wise / total_vectorized:>9.1f}x")
+
+
+if __name__ == "__main__":
+    sizes = [int(size) for size in sys.argv[1:]] or DEFAULT_SIZES
+    for size in sizes:
+        run(size)
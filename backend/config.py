@@ -1,3 +1,5 @@
+import os
+
 APP_SECRET_KEY = 'mysecretkey'
 
 SQL_CONNECTION = {'SERVER': "sl-nlp-sqlserver.database.windows.net",
@@ -14,3 +16,27 @@ BLOB_CONNECTION = {
     "ACCOUNT_NAME": "sellafieldcomplyai",
     "ACCOUNT_KEY": "TKdxjIZtb4z0xGS7201wJ7dt8s8Yl30dxtBaSW+NNwkdkYTcoVU30+ol+Wo1GPNnAc4Iw77pZIWhzOmjy1AxSA==",
     "CONTAINER_NAME": "azureml-blobstore-67e232ce-c478-482a-9334-fd1d04853a3c"}
+
+# pool of sql connections shared by the data manager reads and writes
+SQL_POOL = {'SIZE': 4,
+            'MAX_IDLE_SECONDS': 300,
+            'CHECKOUT_TIMEOUT_SECONDS': 30
+            }
+
+# on-disk cache of the last data snapshot, read on start up (folder relative to the backend folder)
+SNAPSHOT_CACHE = {'ENABLED': True,
+                  'DIR': "snapshot_cache"
+                  }
+
+# serving the app with several processes (e.g. gunicorn workers, see gunicorn.conf.py): a single process reads the
+# sql table and publishes the snapshots to the on-disk cache, the others load them from the cache every POLL_SECONDS
+# (requires the snapshot cache and file locks, the app is served by a single process otherwise)
+MULTI_PROCESS = {'ENABLED': os.environ.get('SLCOMPLY_MULTI_PROCESS') == '1',
+                 'POLL_SECONDS': 10
+                 }
+
+# number of rows of synthetic data the app serves instead of the sql table (see synthetic_data.py), to run the app and
+# the benchmarks without the sql server, 0 to read the sql table
+SYNTHETIC_DATA = {'ROWS': int(os.environ.get('SLCOMPLY_SYNTHETIC_ROWS', '0')),
+                  'SEED': 0
+                  }
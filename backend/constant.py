@@ -14,5 +14,73 @@ LINK_REL_MAP = {'not relevant': 0, 'Soft': 0.5, 'Strong': 1}
 DT_FORMAT = '%Y-%m-%d'
 # status of a change (reviewed/addressed)
 STATUS = ['Not Started', 'Reviewed', 'Addressed', 'Not Relevant']
+# cols of the sql table which are updated when a user submits status changes
+STATUS_DB_COLS = ['reviewed', 'addressed', 'validatedNotRelevant', 'lastSubmit']
+# number of rows fetched per round trip when reading the sql table
+SQL_FETCH_CHUNK_SIZE = 10000
+# max number of rows in the table of values of a single update statement (sql server limit is 1000)
+MAX_ROWS_PER_UPDATE = 1000
+# columns the detailed table of the Detect Changes tab can be sorted by and the dataframe column each is sorted on
+DETAIL_SORT_COLS = {'currentRevision': 'currentRevision', 'revisionNumber': 'revisionNumber',
+                    'sectionTitle': 'sectionTitle', 'pageNumber': 'pageNumber', 'Relevance': 'rel_model_pred',
+                    'ID': 'ID', 'status': 'status'}
+# max number of rows of a page of the detailed table
+MAX_DETAIL_PAGE_SIZE = 1000
+# default number of changes of a page of the changes linked to an SL document (see /sl_doc_changes)
+SL_DOC_CHANGES_PAGE_SIZE = 100
+# columns of the changes indexed for the full-text search (see search_index.py), BM25 ranking parameters, default
+# number of results of a page of /search and number of recent searches the latency stats of /stats are computed on
+SEARCH_FIELDS = ['changeText', 'previousParagraph', 'nextParagraph', 'sectionTitle']
+BM25_K1 = 1.2
+BM25_B = 0.75
+SEARCH_PAGE_SIZE = 20
+SEARCH_LATENCY_WINDOW = 1000
+# columns of the change exports (see utils.iter_export_chunks) and number of rows formatted per chunk of an export
+EXPORT_COLS = ['ID', 'documentType', 'documentName', 'revisionNumber', 'currentRevision', 'previousRevision',
+               'sectionTitle', 'pageNumber', 'changeText', 'previousParagraph', 'nextParagraph', 'Relevance',
+               'strongLinks', 'softLinks', 'status', 'lastSubmit']
+EXPORT_CHUNK_ROWS = 5000
+# number of change contexts (see utils.create_context) kept rendered for the rows shown again in the detailed table
+CHANGE_CONTEXT_CACHE_SIZE = 4096
+# validity of the SAS tokens of the pdf viewer urls, a cached url is signed again when it expires within the margin
+SAS_TOKEN_LIFETIME_MINUTES = 60
+SAS_TOKEN_REFRESH_MARGIN_MINUTES = 10
 # start date from which the backlog statistics are shown on the landing page
 START_DT_FOR_BACKLOG_STATS = "01/01/2022"
+# number of most recent documents shown on the landing page, and max number returned by /top_docs (the stats of
+# this many documents are computed when the data is loaded)
+TOP_DOCS_STATS_N = 3
+MAX_TOP_DOCS = 50
+
+# number of hourly delta refreshes after which the data manager falls back to a full reload of the sql table
+# (a full reload also picks up deleted rows and changes that do not move the watermark columns)
+FULL_RELOAD_EVERY_N_UPDATES = 24
+# text date columns of the sql table compared with the watermark of a delta refresh (see utils.get_delta_query), with
+# the sql server CONVERT style and the pandas dayfirst flag of their format - currentRevision is day first (dd/mm/yyyy)
+# and lastSubmit is written month first (mm/dd/yyyy hh:mi:ss) by utils.update_status_on_submit
+WATERMARK_DATE_COLS = {'lastSubmit': {'sql_style': 101, 'dayfirst': False},
+                       'currentRevision': {'sql_style': 103, 'dayfirst': True}}
+
+# ** Typed schema of the datasets, applied once when the data is loaded (see utils.apply_schema) **
+# columns parsed to datetime64 (dates in the sql table are day first)
+DATETIME_COLS = ['currentRevision']
+# columns with a small set of repeated string values stored as categoricals
+CATEGORICAL_COLS = ['documentName', 'documentType', 'sectionTitle', 'status', 'sl_document', 'revisionNumber',
+                    'prevRevisionNumber', 'previousRevision']
+# numeric columns only holding 0, 0.5 and 1 stored as float32
+FLOAT32_COLS = ['rel_model_pred', 'link_relevancy']
+# integer columns with small values stored as int32
+INT32_COLS = ['pageNumber']
+# columns of the viz dataframes (one row per change and sl document link) read by the viz tabs, the other columns
+# of a change are only kept once in final_output_df (see utils.compact_datasets)
+VIZ_COLS = ['ID', 'documentName', 'documentType', 'currentRevision', 'sectionTitle', 'pageNumber', 'sl_document',
+            'link_relevancy']
+
+# serialise the plots with orjson when it is installed (see utils.fig_to_json)
+FAST_PLOT_JSON = True
+
+# ** Response cache of the plot routes (see response_cache.py) **
+# max number of cached plots
+RESPONSE_CACHE_MAX_ENTRIES = 512
+# max total size of the cached plots in bytes
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 ** 2
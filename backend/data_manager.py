@@ -1,44 +1,262 @@
 import utils
+import constant
 import pymssql
 import pandas as pd
-from config import SQL_CONNECTION
+from config import SQL_CONNECTION, SQL_POOL, SNAPSHOT_CACHE, MULTI_PROCESS
+from sql_pool import ConnectionPool, PoolTimeoutError
+from snapshot import DataSnapshot
+from search_index import SearchIndex
+import snapshot_cache
 import datetime
+import contextlib
+import functools
+import os
+import threading
+import time
 
 
 class DataManager:
-    """Class for managing data that the flask web app uses"""
-    final_output_df = None
-    gov_docs = None
-    nongov_docs = None
-    gov_viz_df = None
-    nongov_viz_df = None
-    top_docs_stats = None
-
-    def __init__(self):
-        self.update()
-
-    def update(self):
-        """ Update all datasets in data manager class"""
-        final_output_df, gov_docs, nongov_docs, gov_viz_df, nongov_viz_df, top_docs_stats = self.get_sql_info()
-        self.final_output_df = final_output_df
-        self.gov_docs = gov_docs
-        self.nongov_docs = nongov_docs
-        self.gov_viz_df = gov_viz_df
-        self.nongov_viz_df = nongov_viz_df
-        self.top_docs_stats = top_docs_stats
+    """Class for managing data that the flask web app uses
 
-    @staticmethod
-    def get_sql_info():
-        """ Get the datasets from the SQL database """
+    The datasets are held in an immutable DataSnapshot (see snapshot.py), request threads read dm.snapshot once and
+    use that snapshot for the whole request, updates build a new snapshot and swap the reference.
+
+    Each published snapshot is also written to an on-disk cache (see snapshot_cache.py). On start up the cached
+    snapshot is served straight away while the datasets are reloaded from the sql table on a background thread.
+
+    When the app is served by several processes (see config.MULTI_PROCESS), only the process holding the refresher
+    lock (the refresher) reads the sql table, the other processes (followers) load the snapshots it writes to the
+    cache (see sync_shared_snapshot) and share the status overlay through the cache. A follower takes over the
+    refreshes when the refresher exits.
+
+    The rows can be read from another data source than the sql table (e.g. synthetic_data.SyntheticDataSource, to run
+    the app and the benchmarks without the sql server), the snapshots are then not cached on disk.
+    """
+    snapshot = None
+    # number of delta refreshes done since the last full reload
+    delta_updates_since_full_reload = 0
+    # MB used by each dataframe of the last snapshot built by this process (see utils.get_memory_report)
+    memory_report = None
+
+    def __init__(self, data_source=None):
+        """
+        Args:
+            data_source: object with read(table_name, watermark) and write(table_name, updates) methods reading and
+                         updating the rows instead of the sql table (see synthetic_data.SyntheticDataSource), None to
+                         use the sql table
+        """
+        self.data_source = data_source
+        # serialises the publishing of new snapshots (data refreshes and status updates), readers never take it
+        self._publish_lock = threading.Lock()
+        # sql connections shared by the data refreshes and the status updates
+        self.pool = ConnectionPool(functools.partial(pymssql.connect,
+                                                     server=SQL_CONNECTION['SERVER'],
+                                                     port=SQL_CONNECTION['PORT'],
+                                                     user=SQL_CONNECTION['USER'],
+                                                     password=SQL_CONNECTION['PASSWORD'],
+                                                     database=SQL_CONNECTION['DATABASE']),
+                                   size=SQL_POOL['SIZE'],
+                                   max_idle_seconds=SQL_POOL['MAX_IDLE_SECONDS'],
+                                   checkout_timeout=SQL_POOL['CHECKOUT_TIMEOUT_SECONDS'])
+        self.cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), SNAPSHOT_CACHE['DIR']) \
+            if SNAPSHOT_CACHE['ENABLED'] and data_source is None else None
+        self.multi_process = MULTI_PROCESS['ENABLED'] and self.cache_dir is not None and \
+            snapshot_cache.feather is not None and snapshot_cache.fcntl is not None
+        if MULTI_PROCESS['ENABLED'] and not self.multi_process:
+            print("Multi-process serving needs the snapshot cache, pyarrow and file locks, refreshing in this process")
+        # open refresher lock file (None for a follower) and last cached snapshot and status overlay loaded from it
+        self._refresher_lock = None
+        self._shared_snapshot_name = None
+        self._shared_overlay_mtime = None
+
+        # a follower serves the snapshots of the refresher, it waits for the first one to be cached
+        if self.multi_process and not self.__try_become_refresher():
+            while not self.sync_shared_snapshot():
+                time.sleep(MULTI_PROCESS['POLL_SECONDS'])
+            return
+
+        cached_snapshot = self.__load_cached_snapshot()
+        if cached_snapshot is None:
+            self.update(full_reload=True)
+        else:
+            self.snapshot = cached_snapshot
+            # catch up with the sql table without blocking the start up, the cached snapshot is served meanwhile
+            threading.Thread(target=self.update, kwargs={'full_reload': True}, daemon=True).start()
+
+    def update(self, full_reload=False):
+        """ Update all datasets in data manager class
+
+        Only the rows added or modified since the last watermark are fetched and merged into the existing datasets,
+        a full reload of the sql table is done on start up and every constant.FULL_RELOAD_EVERY_N_UPDATES updates.
+        The new datasets are built on the calling (background) thread and published as a new snapshot.
+
+        Args:
+            full_reload: (bool) reload the whole sql table instead of only the rows changed since the last update
+        """
+        # the followers get the snapshots from the cache (see sync_shared_snapshot)
+        if not self.is_refresher:
+            return
+
+        refresh_started_at = time.time()
+        current_snapshot = self.snapshot
+
+        if full_reload or current_snapshot is None or \
+                self.delta_updates_since_full_reload >= constant.FULL_RELOAD_EVERY_N_UPDATES:
+            datasets, watermark = self.get_sql_info()
+            # the sql table could not be read, keep serving the current snapshot until the next update
+            if datasets is None:
+                return
+            search_index = SearchIndex(datasets[0])
+            self.delta_updates_since_full_reload = 0
+        else:
+            datasets, watermark, search_index = self.get_sql_delta_info(current_snapshot.final_output_df,
+                                                                        current_snapshot.gov_viz_df,
+                                                                        current_snapshot.nongov_viz_df,
+                                                                        current_snapshot.watermark,
+                                                                        current_snapshot.search_index)
+            self.delta_updates_since_full_reload += 1
+            # nothing has changed in the sql table since the last update, only sign again the expiring pdf urls
+            if datasets is None:
+                utils.pdf_url_cache.warm(current_snapshot.get_pdf_blobs())
+                return
+
+        version = current_snapshot.version + 1 if current_snapshot is not None else 1
+        new_snapshot = DataSnapshot(version, *datasets, watermark, search_index=search_index)
+        self.memory_report = utils.get_memory_report({name: getattr(new_snapshot, name) for name in
+                                                      ['final_output_df', 'gov_viz_df', 'nongov_viz_df']})
+        print(f"Memory of the datasets of snapshot v{version} (MB): {self.memory_report}")
+        print(f"Search index of snapshot v{version}: {search_index.stats()}")
+        # write the datasets to the cache before publishing them, so that the cached overlay is never older than them
+        self.__cache_snapshot(new_snapshot)
+        # sign the pdf urls of the latest revision of each document, so the Detect Changes tab reuses them
+        utils.pdf_url_cache.warm(new_snapshot.get_pdf_blobs())
+
+        with self._publish_lock, self.__shared_overlay_lock():
+            # keep the status updates saved while this refresh was running, they might not be in the data read
+            current_snapshot = self.__get_current_snapshot()
+            if current_snapshot is not None:
+                new_snapshot = new_snapshot.with_overlay_written_after(current_snapshot, refresh_started_at)
+            self.snapshot = new_snapshot
+            self.__cache_status_overlay()
+
+    def save_status_updates(self, df_updates):
+        """ publishes a new snapshot with status updates saved by a user added to its overlay
+
+        Args:
+            df_updates: (list of tuples) - (row id, col name, value to be set), see utils.update_status_on_submit
+        """
+        with self._publish_lock, self.__shared_overlay_lock():
+            self.snapshot = self.__get_current_snapshot().with_status_updates(df_updates)
+            self.__cache_status_overlay()
+
+    @property
+    def is_refresher(self):
+        """ True if this process reads the sql table, always the case unless the app is served by several processes """
+        return not self.multi_process or self._refresher_lock is not None
+
+    def sync_shared_snapshot(self):
+        """ publishes the snapshot or status overlay cached by the other processes if they have changed since the last
+        call, called periodically by the followers when the app is served by several processes. A follower becomes the
+        refresher if the refresher has exited.
+
+        Returns: bool, True if a new snapshot has been published
+        """
+        if self.is_refresher:
+            return False
+        if self.__try_become_refresher():
+            self.update()
+            return True
+
+        # read the names before the files, a change made in between is picked up by the next call
+        snapshot_name = snapshot_cache.get_current_snapshot_name(self.cache_dir)
+        overlay_mtime = snapshot_cache.get_status_overlay_mtime(self.cache_dir)
+        if snapshot_name is not None and snapshot_name != self._shared_snapshot_name:
+            cached_snapshot = self.__load_cached_snapshot()
+            if cached_snapshot is None:
+                return False
+            with self._publish_lock:
+                self.snapshot = cached_snapshot
+            self._shared_snapshot_name, self._shared_overlay_mtime = snapshot_name, overlay_mtime
+            return True
+
+        if self.snapshot is not None and overlay_mtime != self._shared_overlay_mtime:
+            with self._publish_lock:
+                self.snapshot = self.snapshot.with_status_overlay(*snapshot_cache.load_status_overlay(self.cache_dir))
+            self._shared_overlay_mtime = overlay_mtime
+            return True
+        return False
+
+    def get_sql_info(self):
+        """ Get the datasets from the SQL database
+
+        Returns: tuple of the datasets (see build_datasets) and the watermark of the loaded rows, (None, None) if the
+                 sql table could not be read
+        """
         print(f"RAN background update at: {datetime.datetime.now()}")
         # Load input data from sql db
-        dependency_mapper_output_df = DataManager.__get_sql_data(SQL_CONNECTION['TABLE_NAME'])
+        dependency_mapper_output_df = self.__get_sql_data(SQL_CONNECTION['TABLE_NAME'])
+        if dependency_mapper_output_df is None:
+            return None, None
+        watermark = utils.get_watermark(dependency_mapper_output_df)
+
+        final_output_df, final_output_for_viz_df = DataManager.transform(dependency_mapper_output_df)
+
+        return DataManager.build_datasets(final_output_df, final_output_for_viz_df), watermark
+
+    def get_sql_delta_info(self, final_output_df, gov_viz_df, nongov_viz_df, watermark, search_index):
+        """ Get the rows added or modified in the SQL database since the watermark and merge them into the existing
+        datasets
+
+        Args:
+            final_output_df: (dataframe) - current dataframe used for the Detect Changes tab
+            gov_viz_df: (dataframe) - current dataframe of gov docs used for the viz tabs
+            nongov_viz_df: (dataframe) - current dataframe of non-gov docs used for the viz tabs
+            watermark: (dict) - watermark of the rows already loaded, see utils.get_watermark
+            search_index: (SearchIndex) - current full-text index of final_output_df
+
+        Returns: tuple of the merged datasets (None if no rows have changed), the new watermark and the search index
+                 with the new/modified rows
+        """
+        print(f"RAN background delta update at: {datetime.datetime.now()}")
+        delta_df = self.__get_sql_data(SQL_CONNECTION['TABLE_NAME'], watermark)
+        if delta_df is None or delta_df.empty:
+            return None, watermark, search_index
+
+        new_watermark = utils.merge_watermarks(watermark, utils.get_watermark(delta_df))
+        # ids of the new/modified rows, any older version of these rows is replaced in the existing datasets
+        changed_ids = delta_df['ID']
+
+        delta_final_output_df, delta_final_output_for_viz_df = DataManager.transform(delta_df)
+
+        final_output_df = utils.merge_delta_rows(final_output_df, delta_final_output_df, changed_ids)
+        final_output_for_viz_df = utils.merge_delta_rows(pd.concat([gov_viz_df, nongov_viz_df]),
+                                                         delta_final_output_for_viz_df, changed_ids)
+        # categoricals with different categories are concatenated as objects, convert them back
+        final_output_df = utils.apply_schema(final_output_df)
+        final_output_for_viz_df = utils.apply_schema(final_output_for_viz_df)
+        print(f"Merged {len(delta_df)} new/modified rows into the datasets")
+
+        # only index the new/modified rows, the older version of these rows are marked as deleted in the index
+        search_index = search_index.with_changed_rows(delta_final_output_df, changed_ids)
+
+        return DataManager.build_datasets(final_output_df, final_output_for_viz_df), new_watermark, search_index
+
+    @staticmethod
+    def transform(dependency_mapper_output_df):
+        """ Clean the rows read from the sql table and format them for the change tabs and the viz tabs
+
+        Args:
+            dependency_mapper_output_df: (dataframe) - rows read from the sql table (the full table or a delta)
+
+        Returns: (dataframe) final_output_df used for the Detect Changes tab,
+                 (dataframe) final_output_for_viz_df used for the viz tabs
+        """
         # Clean input data - remove null and strip whitespace
         # remove rows where 'documentName' col is null
         dependency_mapper_output_df = dependency_mapper_output_df.dropna(axis=0, subset=['documentName'])
         # remove date and revision number from the documentName column
-        dependency_mapper_output_df['documentName'] = dependency_mapper_output_df.apply(
-            lambda x: utils.clean_documentname(x['documentName']), axis=1)
+        dependency_mapper_output_df['documentName'] = utils.clean_documentnames(
+            dependency_mapper_output_df['documentName'])
 
         # strip spaces from documentType col
         dependency_mapper_output_df['documentType'] = dependency_mapper_output_df['documentType'].str.strip()
@@ -59,21 +277,35 @@ class DataManager:
         final_output_df = utils.get_rel_sl_links(dependency_mapper_output_df, long_tbl_sl_links_df)
 
         # removing values in strongLinks and softLinks column if the change is not relevant (rel_model_pred = 0.0)
-        final_output_df['strongLinks'] = final_output_df[['rel_model_pred', 'strongLinks']].apply(
-            lambda x: "" if x['rel_model_pred'] < 0.5 else x['strongLinks'], axis=1)
-        final_output_df['softLinks'] = final_output_df[['rel_model_pred', 'softLinks']].apply(
-            lambda x: "" if x['rel_model_pred'] < 0.5 else x['softLinks'], axis=1)
+        mask_not_relevant = final_output_df['rel_model_pred'] < 0.5
+        final_output_df['strongLinks'] = final_output_df['strongLinks'].mask(mask_not_relevant, "")
+        final_output_df['softLinks'] = final_output_df['softLinks'].mask(mask_not_relevant, "")
 
-        # adding new column 'change_context' which will have values from previousParagraph and nextParagraph alongwith
-        # the changeText
-        final_output_df['change_context'] = \
-            final_output_df.apply(lambda x: utils.create_context(x['changeText'], x['previousParagraph'],
-                                                                 x['nextParagraph']), axis=1)
+        # the 'change_context' col (previousParagraph and nextParagraph alongwith the changeText) is not stored, it is
+        # rendered for the rows returned by /doc_change only (see utils.create_context)
 
         #  ** generate df for sankey and treemap viz by removing the cols starting with 'SL' and instead having **
         # them in a long table format
         final_output_for_viz_df = utils.get_final_df_for_viz(dependency_mapper_output_df, long_tbl_sl_links_df)
 
+        # only keep the columns read by the app, then parse the revision dates and convert the columns to compact
+        # types once, see constant.py for the schema
+        final_output_df, final_output_for_viz_df = utils.compact_datasets(final_output_df, final_output_for_viz_df)
+        final_output_df = utils.apply_schema(final_output_df)
+        final_output_for_viz_df = utils.apply_schema(final_output_for_viz_df)
+
+        return final_output_df, final_output_for_viz_df
+
+    @staticmethod
+    def build_datasets(final_output_df, final_output_for_viz_df):
+        """ Split the formatted data into the datasets used by the different tabs and calc the landing page stats
+
+        Args:
+            final_output_df: (dataframe) - dataframe used for the Detect Changes tab
+            final_output_for_viz_df: (dataframe) - dataframe used for the viz tabs
+
+        Returns: tuple - (final_output_df, gov_docs, nongov_docs, gov_viz_df, nongov_viz_df, top_docs_stats)
+        """
         # ** Filter input data for specific features for tabs **
         # creating dataframe for gov and nongov document type for detect_changes tab
         gov_df = utils.get_gov_df(final_output_df)
@@ -89,78 +321,130 @@ class DataManager:
 
         # ** Calc stats for landing page **
 
-        # get recent change stats for top (last changed) 3 documents for the landing page
-        top_docs_stats = utils.get_recent_changes_stats(final_output_df)
+        # get recent change stats for the last changed documents for the landing page and /top_docs
+        top_docs_stats = utils.get_recent_changes_stats(final_output_df, constant.MAX_TOP_DOCS)
 
         return final_output_df, gov_docs, nongov_docs, gov_viz_df, nongov_viz_df, top_docs_stats
 
-    @staticmethod
-    def __get_sql_data(table_name):
+    def __load_cached_snapshot(self):
+        """ returns the snapshot saved in the on-disk cache, None if there is none or the cache is disabled """
+        if self.cache_dir is None:
+            return None
+        start = time.perf_counter()
+        try:
+            cached_snapshot = snapshot_cache.load_snapshot(self.cache_dir)
+        except Exception as e:
+            print(f"Could not read the cached snapshot, loading the data from the sql table: {e}")
+            return None
+        if cached_snapshot is not None:
+            print(f"Loaded cached snapshot v{cached_snapshot.version} (built at {cached_snapshot.created_at}) in "
+                  f"{time.perf_counter() - start:.3f}s")
+        return cached_snapshot
+
+    def __try_become_refresher(self):
+        """ takes the refresher lock if no other process holds it, returns True if this process is the refresher """
+        if self._refresher_lock is None:
+            self._refresher_lock = snapshot_cache.try_lock_refresher(self.cache_dir)
+            if self._refresher_lock is not None:
+                print(f"Process {os.getpid()} is refreshing the data for all the processes")
+        return self._refresher_lock is not None
+
+    def __shared_overlay_lock(self):
+        # the status overlay file is shared by all the processes when there are several, they update it in turn
+        if not self.multi_process:
+            return contextlib.nullcontext()
+        return snapshot_cache.status_overlay_lock(self.cache_dir)
+
+    def __get_current_snapshot(self):
+        # the published snapshot with the status overlay of all the processes, called with the overlay lock held
+        if not self.multi_process or self.snapshot is None:
+            return self.snapshot
+        return self.snapshot.with_status_overlay(*snapshot_cache.load_status_overlay(self.cache_dir))
+
+    def __cache_snapshot(self, snapshot):
+        # the cache is only used to speed up the start up, failing to write it must not fail the refresh
+        if self.cache_dir is None:
+            return
+        try:
+            snapshot_cache.save_snapshot(snapshot, self.cache_dir)
+        except Exception as e:
+            print(f"Could not write the snapshot to the cache: {e}")
+
+    def __cache_status_overlay(self):
+        # called with the publish lock held, so that an older overlay never overwrites a newer one
+        if self.cache_dir is None:
+            return
+        try:
+            snapshot_cache.save_status_overlay(self.snapshot, self.cache_dir)
+            self._shared_overlay_mtime = snapshot_cache.get_status_overlay_mtime(self.cache_dir)
+        except Exception as e:
+            print(f"Could not write the status overlay to the cache: {e}")
+
+    def __get_sql_data(self, table_name, watermark=None):
         """creates a dataframe copy of the sql database table
 
         Args:
             table_name: (str) name of the table which is being queried
+            watermark: (dict) if given, only the rows with a higher ID, lastSubmit or currentRevision than the
+                       watermark are read (see utils.get_watermark)
 
-        Returns: dataframe
+        Returns: dataframe, None if the table could not be read
         """
-        conn = pymssql.connect(
-            server=SQL_CONNECTION['SERVER'],
-            port=SQL_CONNECTION['PORT'],
-            user=SQL_CONNECTION['USER'],
-            password=SQL_CONNECTION['PASSWORD'],
-            database=SQL_CONNECTION['DATABASE']
-        )
-
-        cur = conn.cursor(as_dict=True)
+        if self.data_source is not None:
+            return self.data_source.read(table_name, watermark)
+
+        query, params = utils.get_delta_query(table_name, watermark)
+
+        peak_memory_before = utils.get_peak_memory_mb()
         try:
-            cur.execute(f"SELECT * FROM [dbo].[{table_name}]")
-            data = cur.fetchall()
-        except:
-            pass
-        else:
-            df = pd.DataFrame(data)
-        finally:
-            cur.close()
-            conn.close()
-            if df is not None:
-                return df
+            with self.pool.connection() as conn:
+                cur = conn.cursor()
+                try:
+                    cur.execute(query, params)
+                    # stream the rows in chunks instead of materialising the whole table as a list of dicts
+                    df = utils.read_sql_chunks(cur, constant.SQL_FETCH_CHUNK_SIZE)
+                finally:
+                    cur.close()
+        except (pymssql.Error, PoolTimeoutError) as e:
+            print(f"Could not read {table_name}, the current datasets are kept: {e}")
+            return None
+        if peak_memory_before is not None:
+            print(f"Read {len(df)} rows from {table_name}, peak memory before/after the read: "
+                  f"{peak_memory_before:.0f}/{utils.get_peak_memory_mb():.0f} MB")
+        return df
 
-    @staticmethod
-    def update_sql(table_name, updates):
-        """ updates the sql database rows based on a list of tuples
+    def update_sql(self, table_name, updates):
+        """ updates the sql database rows in a single round trip, see utils.get_batch_update_query
 
         Args:
             table_name: str, name of the table which is being updated
-            updates:    list, each elemant of the list is a tuple (col_name, id) - col_name is the name of the col to be
-                        updated and id is the row id
+            updates:    list, each element of the list is a tuple (id, changes) - id is the row id and changes is a
+                        dict of col name: value to be set
 
         Returns: bool, True/False based on successfully passing commit
         """
         success = False
+        if not updates:
+            return True
+        if self.data_source is not None:
+            return self.data_source.write(table_name, updates)
 
         try:
-            conn = pymssql.connect(
-                server=SQL_CONNECTION['SERVER'],
-                port=SQL_CONNECTION['PORT'],
-                user=SQL_CONNECTION['USER'],
-                password=SQL_CONNECTION['PASSWORD'],
-                database=SQL_CONNECTION['DATABASE']
-            )
-
-            cur = conn.cursor()
-            try:
-                for update in updates:
-                    cur.execute(f"UPDATE [dbo].[{table_name}] set {update[0]} = '{update[1]}' WHERE ID ={update[2]}")
-            except Exception as e:
-                # print(e)
-                print("There was an error connecting to the database, the current selections have not been saved.")
-            else:
-                conn.commit()
-                print("The database has been updated with the current selections.")
-                success = True
-            finally:
-                cur.close()
-                conn.close()
+            with self.pool.connection() as conn:
+                cur = conn.cursor()
+                try:
+                    query, params = utils.get_batch_update_query(table_name, updates)
+                    cur.execute(query, params)
+                except Exception as e:
+                    # print(e)
+                    print("There was an error connecting to the database, the current selections have not been "
+                          "saved.")
+                else:
+                    conn.commit()
+                    print("The database has been updated with the current selections.")
+                    success = True
+                finally:
+                    cur.close()
         except Exception as e:
             print("There was an error connecting to the database, the current selections have not been saved. outer")
         return success
@@ -0,0 +1,23 @@
+"""
+=====================================
+Gunicorn settings for serving the flask web app with several worker processes
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Each worker imports app.py and builds its own data manager, SLCOMPLY_MULTI_PROCESS makes them share the data: the
+first worker to take the refresher lock reads the sql table and writes the snapshots to the on-disk cache, the other
+workers load them from the cache (see config.MULTI_PROCESS and DataManager).
+=====================================
+"""
+import multiprocessing
+
+bind = "0.0.0.0:5000"
+workers = min(multiprocessing.cpu_count(), 4)
+# the requests mostly wait on pandas/numpy, threads let a worker serve a request while another is being processed
+threads = 4
+raw_env = ["SLCOMPLY_MULTI_PROCESS=1"]
+# the app must be imported in each worker, not in the master: the refresher lock and the scheduler thread of the
+# data manager are per process and would otherwise be shared by all the forked workers
+preload_app = False
+# the first worker may need to load the whole sql table before it can serve requests
+timeout = 600
@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """Thread-safe LRU cache of the responses of the plot routes
+
+    A response only depends on the request arguments and on the data snapshot it was built from, so the entries are
+    stored per snapshot version - when a request sees a newer snapshot version, all the entries of the older versions
+    are dropped. The least recently used entries are evicted when the cache holds more than max_entries responses or
+    more than max_bytes of response bodies.
+    """
+
+    def __init__(self, max_entries=512, max_bytes=64 * 1024 ** 2):
+        """
+        Args:
+            max_entries: (int) max number of cached responses
+            max_bytes: (int) max total size in bytes of the cached response bodies
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._version = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, version, key):
+        """ returns the cached response for a request (None if it is not cached)
+
+        Args:
+            version: (int) version of the snapshot the request is served from
+            key: (tuple) request arguments
+
+        Returns: bytes or None
+        """
+        with self._lock:
+            self.__check_version(version)
+            response = self._entries.get(key)
+            if response is None:
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return response
+
+    def put(self, version, key, response):
+        """ caches the response of a request
+
+        Args:
+            version: (int) version of the snapshot the response was built from
+            key: (tuple) request arguments
+            response: (bytes) response body, encoded so that its size is counted in bytes
+        """
+        size = len(response)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self.__check_version(version)
+            # a response built from an older snapshot than the cached ones is not cached
+            if version != self._version:
+                return
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key))
+            self._entries[key] = response
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self._counters['evictions'] += 1
+
+    def stats(self):
+        """ returns the cache counters (hits, misses, evictions, invalidations) and its current size """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+            stats['version'] = self._version
+        return stats
+
+    def __check_version(self, version):
+        # drop the responses of the older snapshots when a newer snapshot is seen, called with the lock held
+        if self._version is None or version > self._version:
+            if self._entries:
+                self._counters['invalidations'] += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._version = version
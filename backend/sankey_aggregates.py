@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+
+class SankeyAggregates:
+    """Number of changes from each document to each SL document of a viz dataframe, precomputed when a snapshot is
+    built so that the golden thread plot does not group the change rows on every request
+
+    For each link relevancy, the changes of each (document, SL document) link are counted per revision date, only for
+    the (revision date, link) pairs having changes, sorted by date. The changes revised after a recency date are then
+    the sum per link of the counts of the pairs after the recency date (a slice of the sorted pairs), and all the
+    changes are the total count of each link. The memory grows with the number of links revised on each date, not
+    with the number of links times the length of the revision history.
+    """
+
+    def __init__(self, viz_df, link_relevancies):
+        """
+        Args:
+            viz_df: (dataframe) - gov or non-gov dataframe used for the viz tabs
+            link_relevancies: (list) - link relevancy values the aggregates are built for (see constant.LINK_REL_MAP)
+        """
+        self._aggregates = {link_relevancy: self.__build(viz_df.loc[viz_df['link_relevancy'] == link_relevancy])
+                            for link_relevancy in link_relevancies}
+
+    def get_sankey_df(self, link_relevancy, recency_date=None):
+        """ returns the dataframe for a sankey plot of the changes with a link relevancy revised after a date, same as
+        utils.format_data_for_sankey on the filtered viz dataframe
+
+        Args:
+            link_relevancy: (float) - link relevancy of the changes (see constant.LINK_REL_MAP)
+            recency_date: (datetime) - only count the changes revised after this date, None to count all the changes
+
+        Returns: (dataframe) - dataframe suitable for a sankey plot
+        """
+        aggregate = self._aggregates[link_relevancy]
+        if recency_date is None:
+            counts = aggregate['total_counts']
+        else:
+            counts = self.__get_counts_after(aggregate, np.datetime64(recency_date, 'ns'))
+
+        mask_links = counts > 0
+        doc_names = aggregate['doc_names'][mask_links]
+        sl_doc_names = aggregate['sl_doc_names'][mask_links]
+        # the links are sorted by document name, then sl document name, so the ids follow the order of the names
+        unique_doc_names, source_ids = np.unique(doc_names, return_inverse=True)
+        _, target_ids = np.unique(sl_doc_names, return_inverse=True)
+
+        return pd.DataFrame({'documentName': doc_names,
+                             'sl_document': sl_doc_names,
+                             'no_of_changes': counts[mask_links].astype('int64'),
+                             'source_id': source_ids.astype('int64'),
+                             'target_id': target_ids.astype('int64') + len(unique_doc_names)})
+
+    @staticmethod
+    def __build(link_df):
+        link_df = link_df.dropna(subset=['documentName', 'sl_document'])
+        links_df = pd.DataFrame({'documentName': link_df['documentName'].astype(str).to_numpy(),
+                                 'sl_document': link_df['sl_document'].astype(str).to_numpy()})
+
+        # number the (document, sl document) links in the order of their names
+        link_ids = links_df.groupby(['documentName', 'sl_document']).ngroup().to_numpy()
+        unique_links_df = links_df.drop_duplicates().sort_values(['documentName', 'sl_document'])
+        n_links = len(unique_links_df)
+        # the revision dates (NaT for changes without a parsed revision date)
+        rev_dates = link_df['currentRevision'].to_numpy(dtype='datetime64[ns]')
+        mask_dated = ~np.isnat(rev_dates)
+
+        # changes per (revision date, link) sorted by date, the changes without a revision date are only in the totals
+        date_counts = pd.DataFrame({'rev_date': rev_dates[mask_dated], 'link_id': link_ids[mask_dated]})\
+            .groupby(['rev_date', 'link_id']).size().reset_index(name='count')
+
+        return {'doc_names': unique_links_df['documentName'].to_numpy(),
+                'sl_doc_names': unique_links_df['sl_document'].to_numpy(),
+                'total_counts': np.bincount(link_ids, minlength=n_links),
+                'dates': date_counts['rev_date'].to_numpy(dtype='datetime64[ns]'),
+                'date_link_ids': date_counts['link_id'].to_numpy(),
+                'date_counts': date_counts['count'].to_numpy(dtype='int32')}
+
+    @staticmethod
+    def __get_counts_after(aggregate, recency_date):
+        # changes of each link revised after the recency date, from the (revision date, link) pairs after it
+        start = np.searchsorted(aggregate['dates'], recency_date, side='right')
+        counts = np.bincount(aggregate['date_link_ids'][start:], weights=aggregate['date_counts'][start:],
+                             minlength=len(aggregate['total_counts']))
+        return counts.astype('int64')
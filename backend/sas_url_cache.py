@@ -0,0 +1,69 @@
+import threading
+from datetime import datetime, timedelta
+
+
+class SasUrlCache:
+    """Thread-safe cache of the SAS token urls of the pdfs shown in the pdf viewer, keyed by blob path
+
+    A url is reused until it gets close to the expiry of its token, then a new token is generated. The urls of the
+    latest revisions of each document are generated when the data is refreshed (see warm), so the Detect Changes tab
+    does not sign new tokens on every request.
+    """
+
+    def __init__(self, generate_url, lifetime=timedelta(hours=1), refresh_margin=timedelta(minutes=10)):
+        """
+        Args:
+            generate_url: function (blob_name, expiry) returning the url of a blob with a SAS token expiring at expiry
+            lifetime: (timedelta) validity of the generated tokens
+            refresh_margin: (timedelta) a new token is generated when the cached one expires within this margin
+        """
+        self._generate_url = generate_url
+        self.lifetime = lifetime
+        self.refresh_margin = refresh_margin
+
+        # {blob name: (url, expiry of its token)}
+        self._urls = {}
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'generated': 0}
+
+    def get(self, blob_name):
+        """ returns the url of a blob with a SAS token valid for at least the refresh margin
+
+        Args:
+            blob_name: (str) path of the blob in the container
+
+        Returns: str
+        """
+        now = datetime.utcnow()
+        with self._lock:
+            cached = self._urls.get(blob_name)
+            if cached is not None and cached[1] - now > self.refresh_margin:
+                self._counters['hits'] += 1
+                return cached[0]
+
+        # sign a new token outside of the lock, two requests might both sign one which is harmless
+        expiry = now + self.lifetime
+        url = self._generate_url(blob_name, expiry)
+        with self._lock:
+            self._urls[blob_name] = (url, expiry)
+            self._counters['generated'] += 1
+        return url
+
+    def warm(self, blob_names):
+        """ generates the urls of the blobs whose token is missing or close to expiry and drops the expired urls
+
+        Args:
+            blob_names: (iterable) paths of the blobs in the container
+        """
+        now = datetime.utcnow()
+        with self._lock:
+            self._urls = {blob_name: cached for blob_name, cached in self._urls.items() if cached[1] > now}
+        for blob_name in blob_names:
+            self.get(blob_name)
+
+    def stats(self):
+        """ returns the number of urls reused and generated and the number of cached urls """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['urls'] = len(self._urls)
+        return stats
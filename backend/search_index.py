@@ -0,0 +1,331 @@
+import constant
+import copy
+import itertools
+import json
+import os
+import re
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# tokens of the indexed text and of the queries (lower cased words), compiled once as tokenize is called for each
+# distinct text of the rows, and phrases of a query (text between quotes)
+TOKEN_PATTERN = re.compile(r'\w+')
+PHRASE_PATTERN = r'"([^"]*)"'
+# file of the vocabulary of the segments of an index written to a folder (see SearchIndex.save)
+INDEX_META_FILE = 'index.json'
+
+
+class SearchIndex:
+    """In-process full-text index of the changes (see constant.SEARCH_FIELDS), with BM25 ranking
+
+    The text of the indexed fields of each row is tokenized into lower case words, and the positions of the words are
+    kept so that a query can match a phrase (words between quotes in the query). The postings are held in numpy arrays
+    per segment: the rows read by a full reload are indexed in one segment, and each delta refresh adds a segment with
+    the rows it read and marks the older version of these rows as deleted, instead of indexing all the rows again. The
+    deleted rows are dropped when the index is built again by the next full reload.
+
+    Like the snapshot that holds it, an index is never modified once built, with_changed_rows returns a new index
+    sharing the segments of this one. The index is written with the snapshot to the on-disk cache (see save and
+    load), so a restarted worker or a follower process memory-maps it instead of indexing all the rows again.
+    """
+
+    def __init__(self, final_output_df):
+        """
+        Args:
+            final_output_df: (dataframe) - the dataframe with all change and SL link details
+        """
+        started_at = time.perf_counter()
+        segment = _Segment([final_output_df[col] for col in constant.SEARCH_FIELDS], 0)
+        self._segments = [segment]
+        # per indexed row (the rows of all the segments, in order): its ID, number of words and whether it is deleted
+        self._ids = final_output_df['ID'].to_numpy(dtype='int64')
+        self._doc_lens = segment.doc_lens
+        self._alive = np.ones(len(self._ids), dtype=bool)
+        self.__set_row_stats()
+        # time taken to build the index in this process, or to load it from the cache (see load)
+        self.build_seconds = time.perf_counter() - started_at
+        self.load_seconds = None
+
+    @classmethod
+    def load(cls, index_dir):
+        """ reads an index written by save, the arrays of the postings are memory-mapped
+
+        Args:
+            index_dir: (str) - folder the index has been written to
+
+        Returns: SearchIndex
+        """
+        started_at = time.perf_counter()
+        with open(os.path.join(index_dir, INDEX_META_FILE)) as f:
+            meta = json.load(f)
+
+        def read(name):
+            return np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode='r')
+
+        index = cls.__new__(cls)
+        index._segments = [_Segment.from_arrays(segment['vocab'], segment['doc_offset'],
+                                                {name: read(f"segment_{i}_{name}") for name in _Segment.ARRAYS})
+                           for i, segment in enumerate(meta['segments'])]
+        index._ids, index._doc_lens, index._alive = read('ids'), read('doc_lens'), read('alive')
+        index.__set_row_stats()
+        index.build_seconds = None
+        index.load_seconds = time.perf_counter() - started_at
+        return index
+
+    def save(self, index_dir):
+        """ writes the index to a folder, as a .npy file per array and the vocabulary of the segments in a json file
+
+        Args:
+            index_dir: (str) - folder the index is written to, created if needed
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        arrays = {'ids': self._ids, 'doc_lens': self._doc_lens, 'alive': self._alive}
+        for i, segment in enumerate(self._segments):
+            arrays.update({f"segment_{i}_{name}": getattr(segment, name) for name in _Segment.ARRAYS})
+        for name, array in arrays.items():
+            np.save(os.path.join(index_dir, f"{name}.npy"), array)
+        # the term ids are the positions of the terms in the vocabulary
+        with open(os.path.join(index_dir, INDEX_META_FILE), 'w') as f:
+            json.dump({'segments': [{'doc_offset': int(segment.doc_offset), 'vocab': list(segment.vocab)}
+                                    for segment in self._segments]}, f)
+
+    def with_changed_rows(self, changed_rows_df, changed_ids):
+        """ returns a new index with the rows modified by a delta refresh, the rows are indexed in a new segment
+
+        Args:
+            changed_rows_df: (dataframe) - new/modified rows formatted the same way as final_output_df
+            changed_ids: (series) - IDs of all the rows read by the delta refresh (including the ones removed while
+                                    formatting), see utils.merge_delta_rows
+
+        Returns: SearchIndex
+        """
+        started_at = time.perf_counter()
+        segment = _Segment([changed_rows_df[col] for col in constant.SEARCH_FIELDS], len(self._ids))
+
+        # mark the older version of the changed rows as deleted
+        alive = self._alive.copy()
+        positions = pd.Index(self._ids).get_indexer_for(changed_ids)
+        alive[positions[positions >= 0]] = False
+
+        index = copy.copy(self)
+        index._segments = self._segments + [segment]
+        index._ids = np.concatenate([self._ids, changed_rows_df['ID'].to_numpy(dtype='int64')])
+        index._doc_lens = np.concatenate([self._doc_lens, segment.doc_lens])
+        index._alive = np.concatenate([alive, np.ones(len(changed_rows_df), dtype=bool)])
+        index.__set_row_stats()
+        index.build_seconds = time.perf_counter() - started_at
+        index.load_seconds = None
+        return index
+
+    def search(self, query):
+        """ returns the rows matching a query and their BM25 scores
+
+        A row matches when it has any of the words of the query and all the phrases of the query (words between
+        quotes, matched within a field), the words of the phrases are also scored as words.
+
+        Args:
+            query: (string) - search query, e.g. radiation "dose limit"
+
+        Returns: tuple of the IDs of the matching rows (array) and their scores (array), in no particular order
+        """
+        phrases = [tokenize(phrase) for phrase in re.findall(PHRASE_PATTERN, query)]
+        phrases = [phrase for phrase in phrases if phrase]
+        terms = list(dict.fromkeys(tokenize(re.sub(PHRASE_PATTERN, ' ', query)) +
+                                   [term for phrase in phrases for term in phrase]))
+
+        scores = np.zeros(len(self._ids), dtype='float64')
+        matched = np.zeros(len(self._ids), dtype=bool)
+        for term in terms:
+            docs, tfs = self.__get_postings(term)
+            if len(docs) == 0:
+                continue
+            # docs are unique within the postings of a term
+            idf = np.log(1 + (self._n_alive - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += idf * tfs * (constant.BM25_K1 + 1) / (tfs + self._len_norms[docs])
+            matched[docs] = True
+
+        for phrase in phrases:
+            matched &= self.__match_phrase(phrase)
+
+        docs = np.flatnonzero(matched)
+        return self._ids[docs], scores[docs]
+
+    def stats(self):
+        """ returns the size of the index and the time it took to build (or update) it, or to load it from the cache """
+        stats = {'rows': self._n_alive,
+                'deleted_rows': int(len(self._alive) - self._n_alive),
+                'segments': len(self._segments),
+                'terms': sum(len(segment.vocab) for segment in self._segments),
+                'postings': sum(len(segment.pair_docs) for segment in self._segments),
+                'memory_mb': round((sum(segment.memory_bytes for segment in self._segments) + self._ids.nbytes +
+                                    self._doc_lens.nbytes + self._alive.nbytes + self._len_norms.nbytes) /
+                                   1024 ** 2, 1)}
+        if self.build_seconds is not None:
+            stats['build_seconds'] = round(self.build_seconds, 3)
+        else:
+            stats['load_seconds'] = round(self.load_seconds, 3)
+        return stats
+
+    def __set_row_stats(self):
+        # number of rows not deleted and BM25 length normalisation of each row (relative to the average row length)
+        self._n_alive = int(self._alive.sum())
+        avg_doc_len = self._doc_lens[self._alive].mean() if self._n_alive else 1
+        self._len_norms = (constant.BM25_K1 * (1 - constant.BM25_B + constant.BM25_B * self._doc_lens /
+                                               max(avg_doc_len, 1))).astype('float32')
+
+    def __get_postings(self, term):
+        # rows (not deleted) having a term in all the segments and the number of times they have it
+        docs, tfs = [], []
+        for segment in self._segments:
+            term_id = segment.vocab.get(term)
+            if term_id is not None:
+                start, end = segment.term_pair_starts[term_id], segment.term_pair_starts[term_id + 1]
+                docs.append(segment.pair_docs[start:end] + segment.doc_offset)
+                tfs.append(segment.pair_tfs[start:end])
+        if not docs:
+            return np.array([], dtype='int64'), np.array([], dtype='float64')
+        docs, tfs = np.concatenate(docs), np.concatenate(tfs).astype('float64')
+        alive = self._alive[docs]
+        return docs[alive], tfs[alive]
+
+    def __match_phrase(self, phrase):
+        # mask of the rows (not deleted) having the words of a phrase at consecutive positions
+        matched = np.zeros(len(self._ids), dtype=bool)
+        for segment in self._segments:
+            term_ids = [segment.vocab.get(term) for term in phrase]
+            if None in term_ids:
+                continue
+            keys = None
+            # start with the rarest word, so that the next words are looked up for the fewest keys
+            for offset, term_id in sorted(enumerate(term_ids), key=lambda item: segment.term_occ_starts[item[1] + 1] -
+                                          segment.term_occ_starts[item[1]]):
+                start, end = segment.term_occ_starts[term_id], segment.term_occ_starts[term_id + 1]
+                # (row, position of the first word of the phrase) of each occurrence of the word, sorted as the
+                # occurrences are sorted by row and position
+                term_keys = (segment.occ_docs[start:end].astype('int64') << 32) + \
+                    segment.occ_pos[start:end].astype('int64') - offset
+                if keys is None:
+                    keys = term_keys
+                else:
+                    found = np.minimum(np.searchsorted(term_keys, keys), len(term_keys) - 1)
+                    keys = keys[term_keys[found] == keys]
+            matched[(keys >> 32) + segment.doc_offset] = True
+        return matched & self._alive
+
+
+class _Segment:
+    """Postings of the rows indexed together (by a full reload or a delta refresh), as flat arrays sorted by term
+
+    For the term with id t, the occurrences (row, position) of the term are occ_docs/occ_pos[term_occ_starts[t]:
+    term_occ_starts[t + 1]] sorted by row and position, and the rows having the term and the number of times they
+    have it are pair_docs/pair_tfs[term_pair_starts[t]:term_pair_starts[t + 1]]. Rows are numbered from 0 within the
+    segment, doc_offset is the number of the first row in the index.
+    """
+    # arrays of a segment, written to the cache with the vocabulary (see SearchIndex.save)
+    ARRAYS = ['doc_lens', 'occ_docs', 'occ_pos', 'term_occ_starts', 'pair_docs', 'pair_tfs', 'term_pair_starts']
+
+    def __init__(self, fields, doc_offset):
+        """
+        Args:
+            fields: (list) - series of the text of each indexed field of the rows
+            doc_offset: (int) - number of the first row of the segment in the index
+        """
+        self.doc_offset = doc_offset
+        n_rows = len(fields[0])
+        # the texts are repeated across the rows and the fields (e.g. the paragraphs around the changes of a section,
+        # the previous paragraph of a change is often the text of another change), each distinct text is tokenized
+        # once and the term ids of its words are copied for each row and field
+        all_text_codes, unique_texts = pd.factorize(pd.concat([texts.astype(object) for texts in fields],
+                                                              ignore_index=True).fillna('').astype(str))
+        tokens = [tokenize(text) for text in unique_texts]
+        text_lengths = np.array([len(text_tokens) for text_tokens in tokens], dtype='int64')
+        text_starts = np.cumsum(text_lengths) - text_lengths
+        # term id of each term (in the order the terms are first seen) and of each word of the distinct texts
+        text_term_ids, terms = pd.factorize(np.array(list(itertools.chain.from_iterable(tokens)), dtype=object))
+        vocab = {term: term_id for term_id, term in enumerate(terms)}
+        del tokens
+
+        codes, docs, positions = [], [], []
+        # position of the first word of the next field of each row, a gap is left between the fields of a row so
+        # that a phrase does not match across two fields
+        row_offsets = np.zeros(n_rows, dtype='int64')
+        for field_index in range(len(fields)):
+            text_codes = all_text_codes[field_index * n_rows:(field_index + 1) * n_rows]
+            lengths = text_lengths[text_codes]
+            field_docs = np.repeat(np.arange(n_rows), lengths)
+            # position of each word in its text, and of the first word of the text of each row in text_term_ids
+            word_positions = np.arange(len(field_docs)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            codes.append(text_term_ids[text_starts[text_codes][field_docs] + word_positions])
+            docs.append(field_docs)
+            positions.append(word_positions + row_offsets[field_docs])
+            row_offsets += lengths + 1
+        self.doc_lens = row_offsets - len(fields)
+
+        codes, docs, positions = np.concatenate(codes), np.concatenate(docs), np.concatenate(positions)
+        max_position = int(positions.max(initial=0))
+        # sort the words by term, row and position
+        pos_bits, doc_bits = max_position.bit_length(), n_rows.bit_length()
+        if pos_bits + doc_bits + len(vocab).bit_length() <= 63:
+            # as a single int64 key (unique for each word of each row), sorted in place and split back
+            keys = codes.astype('int64', copy=False)
+            keys <<= doc_bits + pos_bits
+            keys |= docs << pos_bits
+            keys |= positions
+            del docs, positions
+            keys.sort()
+            codes = keys >> (doc_bits + pos_bits)
+            docs = (keys >> pos_bits) & ((1 << doc_bits) - 1)
+            positions = keys & ((1 << pos_bits) - 1)
+            del keys
+        else:
+            order = np.lexsort((positions, docs, codes))
+            codes, docs, positions = codes[order], docs[order], positions[order]
+        self.vocab = vocab
+        self.occ_docs = docs.astype('int32')
+        self.occ_pos = positions.astype(np.min_scalar_type(max_position))
+        self.term_occ_starts = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(vocab)))])
+
+        # first occurrence of each (term, row) pair
+        pair_starts = np.flatnonzero(np.concatenate([[True], (codes[1:] != codes[:-1]) |
+                                                     (self.occ_docs[1:] != self.occ_docs[:-1])])) \
+            if len(codes) else np.array([], dtype='int64')
+        self.pair_docs = self.occ_docs[pair_starts]
+        tfs = np.diff(np.append(pair_starts, len(codes)))
+        self.pair_tfs = tfs.astype(np.min_scalar_type(tfs.max(initial=0)))
+        self.term_pair_starts = np.concatenate([[0], np.cumsum(np.bincount(codes[pair_starts],
+                                                                           minlength=len(vocab)))])
+        self.__set_memory_bytes()
+
+    @classmethod
+    def from_arrays(cls, vocab, doc_offset, arrays):
+        """ returns a segment from its vocabulary and arrays, see SearchIndex.load
+
+        Args:
+            vocab: (list) - terms of the segment, in the order of their ids
+            doc_offset: (int) - number of the first row of the segment in the index
+            arrays: (dict) - name: array of the ARRAYS of the segment
+        """
+        segment = cls.__new__(cls)
+        segment.doc_offset = doc_offset
+        segment.vocab = {term: term_id for term_id, term in enumerate(vocab)}
+        for name in cls.ARRAYS:
+            setattr(segment, name, arrays[name])
+        segment.__set_memory_bytes()
+        return segment
+
+    def __set_memory_bytes(self):
+        self.memory_bytes = sum(getattr(self, name).nbytes for name in self.ARRAYS) + \
+            sys.getsizeof(self.vocab) + sum(sys.getsizeof(term) for term in self.vocab)
+
+
+def tokenize(text):
+    """ returns the lower case words of a text, the same way the indexed text is tokenized
+
+    Args:
+        text: (string) - text to tokenize
+
+    Returns: (list) - words
+    """
+    return TOKEN_PATTERN.findall(text.lower())
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+COLS = ['ID', 'documentName', 'documentType', 'currentRevision', 'sectionTitle', 'pageNumber', 'sl_document',
+        'link_relevancy']
+
+
+class SlDocIndex:
+    """Reverse index from each SL document to the changes of the gov and non-gov documents linked to it, built when a
+    snapshot is built so that the changes impacting an SL document are read without filtering the viz dataframes
+
+    The links of the viz dataframes are sorted once by SL document, link relevancy, revision date and ID (most recent
+    first, changes without a revision date last), so the changes of an (SL document, link relevancy) partition are a
+    slice of the sorted links and the changes revised after a recency date are the start of that slice.
+    """
+
+    def __init__(self, viz_dfs):
+        """
+        Args:
+            viz_dfs: (list) - gov and non-gov dataframes used for the viz tabs
+        """
+        links_df = pd.concat([viz_df[COLS] for viz_df in viz_dfs], ignore_index=True)
+        links_df = links_df.astype({'documentName': str, 'documentType': str, 'sectionTitle': str,
+                                    'sl_document': str})
+        self._links_df = links_df.sort_values(['sl_document', 'link_relevancy', 'currentRevision', 'ID'],
+                                              ascending=[True, True, False, False], ignore_index=True)
+        # revision dates as int64 in descending order within each partition (NaT is the smallest int64)
+        self._rev_dates = self._links_df['currentRevision'].to_numpy(dtype='datetime64[ns]').view('int64')
+
+        # (start, end) positions of the links of each (sl document, link relevancy) in the sorted links
+        self._partitions = {key: (positions[0], positions[-1] + 1) for key, positions
+                            in self._links_df.groupby(['sl_document', 'link_relevancy'], sort=False).indices.items()}
+        self.sl_docs = frozenset(sl_document for sl_document, _ in self._partitions)
+
+    def get_changes(self, sl_document, link_relevancies, recency_date=None, doc_type_key=None, offset=0, limit=None):
+        """ returns a page of the changes linked to an SL document, most recent revision first
+
+        Args:
+            sl_document: (str) - SL document name (e.g. SLM 1.05.03)
+            link_relevancies: (list) - link relevancy values of the links (see constant.LINK_REL_MAP)
+            recency_date: (datetime) - only return the changes revised after this date, None for all the changes
+            doc_type_key: (str) - 'gov' or 'non-gov' to only return the changes of a document type, None for both
+            offset: (int) - number of changes skipped
+            limit: (int) - max number of changes returned, None for all
+
+        Returns: tuple of the page of changes (dataframe with the COLS cols) and the total number of changes
+        """
+        slices = []
+        for link_relevancy in link_relevancies:
+            start, end = self._partitions.get((sl_document, link_relevancy), (0, 0))
+            if recency_date is not None and end > start:
+                # the dates are in descending order, count the ones after the recency date from the end of the slice
+                recency = np.datetime64(recency_date, 'ns').view('int64')
+                end = end - np.searchsorted(self._rev_dates[start:end][::-1], recency, side='right')
+            slices.append(self._links_df.iloc[start:end])
+
+        changes_df = slices[0] if len(slices) == 1 else pd.concat(slices)
+        if doc_type_key is not None:
+            prefix = 'gov' if doc_type_key == 'gov' else 'non'
+            changes_df = changes_df.loc[changes_df['documentType'].str.startswith(prefix)]
+        if len(slices) > 1:
+            changes_df = changes_df.sort_values(['currentRevision', 'ID'], ascending=[False, False])
+
+        end = None if limit is None else offset + limit
+        return changes_df.iloc[offset:end], len(changes_df)
@@ -0,0 +1,289 @@
+import utils
+import constant
+from sankey_aggregates import SankeyAggregates
+from backlog_stats import BacklogStats
+from sl_doc_index import SlDocIndex
+from search_index import SearchIndex
+import numpy as np
+import pandas as pd
+import copy
+import datetime
+import time
+
+
+class DataSnapshot:
+    """Consistent, read-only set of the datasets that the flask web app uses
+
+    A snapshot is never modified once it has been published by the data manager. Each update builds a new snapshot
+    and publishes it with a single reference swap, so a request that pins a snapshot reads the same version of every
+    dataset for its whole lifetime. Status changes saved by the users are not written into the shared dataframes,
+    they are kept in a copy-on-write overlay ({ID: {col_name: value}}) that is applied to the rows returned by a route.
+
+    The rows of each document are indexed by (doc type, document name) when the snapshot is built, so the routes
+    only read the rows of the selected document instead of scanning and copying the whole dataframe. The link counts
+    of the golden thread plot (see sankey_aggregates.py), the changes linked to each SL document (see sl_doc_index.py)
+    and the latest revision of each document shown in the pdf viewer are also precomputed when the snapshot is built,
+    as well as the full-text search index of the changes (see search_index.py).
+    """
+
+    def __init__(self, version, final_output_df, gov_docs, nongov_docs, gov_viz_df, nongov_viz_df, top_docs_stats,
+                 watermark, status_overlay=None, overlay_written_at=None, created_at=None, search_index=None):
+        self.version = version
+        # time the datasets were built (kept when the snapshot is loaded from the on-disk cache)
+        self.created_at = created_at or datetime.datetime.now()
+        self.final_output_df = final_output_df
+        self.gov_docs = gov_docs
+        self.nongov_docs = nongov_docs
+        self.gov_viz_df = gov_viz_df
+        self.nongov_viz_df = nongov_viz_df
+        self.top_docs_stats = top_docs_stats
+        self.watermark = watermark
+        # index of the row ids, to look up the position of the rows in final_output_df without masking the whole df
+        self.id_index = pd.Index(final_output_df['ID'])
+        # positions of the rows of each (doc type, document name) in final_output_df and in the gov/non-gov viz df
+        self.doc_partitions = utils.get_doc_partitions(final_output_df)
+        self.viz_doc_partitions = {**utils.get_doc_partitions(gov_viz_df), **utils.get_doc_partitions(nongov_viz_df)}
+        # latest revision dates and numbers of each document and the blob paths of their pdfs, for the pdf viewer
+        self.doc_revisions = utils.get_doc_revisions(final_output_df, self.doc_partitions)
+        # counts of the changes per (document, sl document) link of the gov and non-gov viz df, for the sankey plot
+        link_relevancies = list(constant.LINK_REL_MAP.values())
+        self.sankey_aggregates = {'gov': SankeyAggregates(gov_viz_df, link_relevancies),
+                                  'non-gov': SankeyAggregates(nongov_viz_df, link_relevancies)}
+        # changes of the gov and non-gov viz df linked to each SL document, for the reverse lookup of the golden thread
+        self.sl_doc_index = SlDocIndex([gov_viz_df, nongov_viz_df])
+        # full-text index of the changes, updated from the index of the previous snapshot by a delta refresh (see
+        # DataManager.update), loaded with the snapshot from the on-disk cache (see snapshot_cache.py) or built from
+        # the rows
+        self.search_index = search_index or SearchIndex(final_output_df)
+        # status changes saved since the datasets were read from the sql table and the time they were saved at
+        self.status_overlay = status_overlay or {}
+        self.overlay_written_at = overlay_written_at or {}
+        # counts of the backlog changes per status for the landing page, with the status overlay applied
+        self._base_backlog_stats = BacklogStats(final_output_df, self.id_index)
+        self.backlog_stats = self._base_backlog_stats.with_status_overlay(self.status_overlay)
+
+    def with_status_updates(self, df_updates):
+        """ returns a new snapshot sharing the datasets of this one, with the status updates added to the overlay
+
+        Args:
+            df_updates: (list of tuples) - (row id, col name, value to be set), see utils.update_status_on_submit
+
+        Returns: DataSnapshot
+        """
+        status_overlay = {row_id: dict(cols) for row_id, cols in self.status_overlay.items()}
+        overlay_written_at = dict(self.overlay_written_at)
+        written_at = time.time()
+        for row_id, col, value in df_updates:
+            status_overlay.setdefault(row_id, {})[col] = value
+            overlay_written_at[row_id] = written_at
+
+        # move the updated rows between the backlog counts instead of counting all the rows again
+        status_changes = {row_id: value for row_id, col, value in df_updates if col == 'status'}
+        backlog_stats = self.backlog_stats.with_status_changes(self.status_overlay, status_changes)
+        return self.__copy_with_overlay(status_overlay, overlay_written_at, backlog_stats)
+
+    def with_overlay_written_after(self, snapshot, refresh_started_at):
+        """ returns a copy of this snapshot carrying over the status updates of an older snapshot which were saved
+        after a refresh started, as the sql data read by the refresh might not include them
+
+        Args:
+            snapshot: (DataSnapshot) - snapshot that was current when the refresh finished
+            refresh_started_at: (float) - time.time() at the start of the refresh
+
+        Returns: DataSnapshot
+        """
+        overlay_written_at = {row_id: written_at for row_id, written_at in snapshot.overlay_written_at.items()
+                              if written_at >= refresh_started_at}
+        status_overlay = {row_id: dict(snapshot.status_overlay[row_id]) for row_id in overlay_written_at}
+
+        return self.__copy_with_overlay(status_overlay, overlay_written_at)
+
+    def with_status_overlay(self, status_overlay, overlay_written_at):
+        """ returns a copy of this snapshot with another status overlay, e.g. the overlay shared by the processes
+        serving the app (see snapshot_cache.load_status_overlay)
+
+        Args:
+            status_overlay: (dict) - {ID: {col_name: value}}
+            overlay_written_at: (dict) - {ID: time.time() the status change was saved at}
+
+        Returns: DataSnapshot
+        """
+        return self.__copy_with_overlay(status_overlay, overlay_written_at)
+
+    def apply_status_overlay(self, df):
+        """ returns the rows of a dataframe with the saved status changes applied, see utils.apply_status_overlay """
+        return utils.apply_status_overlay(df, self.status_overlay)
+
+    def get_doc_df(self, doc_type, docs):
+        """ returns the rows of final_output_df for a document
+
+        Args:
+            doc_type: (string) - document type selected by the user (Legislation/Guidance)
+            docs: (string) - document name
+
+        Returns: dataframe (empty if there are no rows for the document)
+        """
+        positions = self.doc_partitions.get((utils.get_doc_type_key(doc_type), docs), [])
+        return self.final_output_df.iloc[positions]
+
+    def get_doc_revision(self, doc_type, docs):
+        """ returns the latest revision of a document for the pdf viewer, see utils.get_doc_revisions
+
+        Args:
+            doc_type: (string) - document type selected by the user (Legislation/Guidance)
+            docs: (string) - document name
+
+        Returns: dict (None if the document has no revision date)
+        """
+        return self.doc_revisions.get((utils.get_doc_type_key(doc_type), docs))
+
+    def get_pdf_blobs(self):
+        """ returns the blob paths of the pdfs of the latest revision of each document """
+        return [blob for doc_revision in self.doc_revisions.values()
+                for blob in (doc_revision['current_rev_blob'], doc_revision['previous_rev_blob'])]
+
+    def get_doc_positions(self, doc_type, docs=None):
+        """ returns the positions of the rows of a document (or of all the documents of a doc type) in final_output_df
+
+        Args:
+            doc_type: (string) - document type selected by the user (Legislation/Guidance)
+            docs: (string) - document name, None for all the documents of the doc type
+
+        Returns: array of positions
+        """
+        doc_type_key = utils.get_doc_type_key(doc_type)
+        if docs is not None:
+            return np.asarray(self.doc_partitions.get((doc_type_key, docs), []), dtype='int64')
+        doc_positions = [positions for (key, _), positions in self.doc_partitions.items() if key == doc_type_key]
+        return np.sort(np.concatenate(doc_positions)) if doc_positions else np.array([], dtype='int64')
+
+    def get_viz_df(self, doc_type):
+        """ returns the gov_viz_df or nongov_viz_df depending on the document type selected by the user, the
+        dataframe is shared with other requests and must not be modified
+
+        Args:
+            doc_type: (string) - document type selected by the user (Legislation/Guidance)
+
+        Returns: dataframe
+        """
+        return self.gov_viz_df if utils.get_doc_type_key(doc_type) == 'gov' else self.nongov_viz_df
+
+    def get_viz_doc_df(self, doc_type, docs):
+        """ returns the rows of the gov_viz_df or nongov_viz_df for a document
+
+        Args:
+            doc_type: (string) - document type selected by the user (Legislation/Guidance)
+            docs: (string) - document name
+
+        Returns: dataframe (empty if there are no rows for the document)
+        """
+        positions = self.viz_doc_partitions.get((utils.get_doc_type_key(doc_type), docs), [])
+        return self.get_viz_df(doc_type).iloc[positions]
+
+    def get_change_texts(self, ids):
+        """ returns the change text of rows by ID, the viz dataframes do not hold the change text (see
+        utils.compact_datasets)
+
+        Args:
+            ids: (array) - row ids
+
+        Returns: array of change texts
+        """
+        return self.final_output_df['changeText'].to_numpy()[self.id_index.get_indexer(ids)]
+
+    def get_sankey_df(self, doc_type, link_rel_type, recency):
+        """ returns the dataframe for the sankey plot of a document type from the precomputed link counts, same as
+        filtering the viz df on the link relevancy and recency and formatting it with utils.format_data_for_sankey
+
+        Args:
+            doc_type: (string) - document type selected by the user (Legislation/Guidance)
+            link_rel_type: (string) - link relevancy selected by the user (Strong/Soft)
+            recency: (string) - recency period selected by the user (1 month, 1 year, Historical, etc)
+
+        Returns: dataframe
+        """
+        _, historical = utils.get_recency_historical(recency)
+        recency_date = None if historical else utils.get_recency_date(recency)
+        return self.sankey_aggregates[utils.get_doc_type_key(doc_type)].get_sankey_df(
+            constant.LINK_REL_MAP[link_rel_type], recency_date)
+
+    def get_sl_doc_changes(self, sl_document, link_rel_type, recency, doc_type=None, offset=0, limit=None):
+        """ returns a page of the changes linked to an SL document from the reverse index, same as filtering the gov
+        and non-gov viz df on the SL document, link relevancy and recency and sorting them by revision date
+
+        Args:
+            sl_document: (string) - SL document name
+            link_rel_type: (string) - link relevancy selected by the user (Strong/Soft), 'all' for both
+            recency: (string) - recency period selected by the user (1 month, 1 year, Historical, etc)
+            doc_type: (string) - document type selected by the user (Legislation/Guidance), None for both
+            offset: (int) - number of changes skipped
+            limit: (int) - max number of changes returned, None for all
+
+        Returns: tuple of the page of changes (dataframe) and the total number of changes
+        """
+        if link_rel_type.lower() == 'all':
+            link_relevancies = [constant.LINK_REL_MAP['Strong'], constant.LINK_REL_MAP['Soft']]
+        else:
+            link_relevancies = [constant.LINK_REL_MAP[link_rel_type]]
+        _, historical = utils.get_recency_historical(recency)
+        recency_date = None if historical else utils.get_recency_date(recency)
+        doc_type_key = None if doc_type is None else utils.get_doc_type_key(doc_type)
+        return self.sl_doc_index.get_changes(sl_document, link_relevancies, recency_date, doc_type_key, offset, limit)
+
+    def search(self, query, doc_type=None, docs=None, recency='Historical', rel_type='all', offset=0, limit=None):
+        """ returns a page of the changes matching a full-text search, best match first, filtered with the same
+        filters as the Detect Changes tab
+
+        Args:
+            query: (string) - search query, see SearchIndex.search
+            doc_type: (string) - document type selected by the user (Legislation/Guidance), None for both
+            docs: (string) - document name, None for all the documents (only used with a doc type)
+            recency: (string) - recency period selected by the user (1 month, 1 year, Historical, etc)
+            rel_type: (string) - change relevance, see utils.relevance_secs
+            offset: (int) - number of results skipped
+            limit: (int) - max number of results returned, None for all
+
+        Returns: tuple of the page of rows (dataframe with the status overlay applied), their scores (array) and the
+                 total number of results
+        """
+        ids, scores = self.search_index.search(query)
+        positions = self.id_index.get_indexer(ids)
+        keep = positions >= 0
+        if doc_type is not None:
+            keep &= np.isin(positions, self.get_doc_positions(doc_type, docs))
+        positions, scores = positions[keep], scores[keep]
+        # recency and relevance filters (with the saved status changes applied)
+        keep = utils.get_filter_mask(self.final_output_df, positions, recency, 'All', rel_type,
+                                     status_overlay=self.status_overlay)
+        positions, scores = positions[keep], scores[keep]
+
+        # only sort the results up to the end of the page (and the ones with the same score as the last one), best
+        # score first, then most recent change (highest ID)
+        end = len(positions) if limit is None else min(offset + limit, len(positions))
+        if 0 < end < len(positions):
+            top = scores >= np.partition(scores, len(scores) - end)[len(scores) - end]
+            positions, scores = positions[top], scores[top]
+        order = np.lexsort((-self.final_output_df['ID'].to_numpy()[positions], -scores))
+        page = order[offset:end]
+        return self.apply_status_overlay(self.final_output_df.iloc[positions[page]]), scores[page], int(keep.sum())
+
+    def get_change_rows(self, ids):
+        """ returns the rows of final_output_df for a list of change IDs, with the saved status changes applied
+
+        Args:
+            ids: (list) - row ids
+
+        Returns: dataframe
+        """
+        positions = self.id_index.get_indexer_for(ids)
+        rows_df = self.final_output_df.iloc[positions[positions >= 0]]
+        return self.apply_status_overlay(rows_df)
+
+    def __copy_with_overlay(self, status_overlay, overlay_written_at, backlog_stats=None):
+        # shallow copy, the datasets and indexes are shared with this snapshot
+        snapshot = copy.copy(self)
+        snapshot.status_overlay = status_overlay
+        snapshot.overlay_written_at = overlay_written_at
+        # the backlog counts are counted from the rows of the new overlay when they are not updated by the caller
+        snapshot.backlog_stats = backlog_stats or self._base_backlog_stats.with_status_overlay(status_overlay)
+        return snapshot
@@ -0,0 +1,242 @@
+"""
+=====================================
+On-disk cache of the last published data snapshot
+
+The dataframes of a snapshot are written as uncompressed Feather (Arrow IPC) files after each refresh, so that a
+restarted worker can memory-map them and serve requests straight away instead of waiting on the sql load and the
+transform pipeline. The doc lists, landing page stats and watermark are written in a meta.json file next to them,
+and the full-text search index of the changes in a search_index folder (memory-mapped too, see SearchIndex.save).
+
+Each snapshot is written to its own folder and the CURRENT file, replaced atomically once all the files have been
+written, points to the folder of the latest complete snapshot. The status overlay changes on every save, it is kept
+in a single status_overlay.json file that is also replaced atomically.
+
+When the app is served by several processes (see config.MULTI_PROCESS), the cache is also how the snapshots are
+shared: the process holding the refresher lock reads the sql table and writes the snapshots, the other processes
+memory-map them when CURRENT changes. The status overlay file is then read, merged and written under a file lock by
+every process that saves status changes.
+=====================================
+"""
+import json
+import os
+import shutil
+import tempfile
+import datetime
+from contextlib import contextmanager
+import pandas as pd
+from snapshot import DataSnapshot
+from search_index import SearchIndex
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    # the cache is disabled without pyarrow, the datasets are then always loaded from the sql table
+    feather = None
+
+try:
+    import fcntl
+except ImportError:
+    # file locks are not available (windows), the app can then only be served by a single process
+    fcntl = None
+
+FRAMES = ['final_output_df', 'gov_viz_df', 'nongov_viz_df']
+CURRENT_FILE = 'CURRENT'
+META_FILE = 'meta.json'
+STATUS_OVERLAY_FILE = 'status_overlay.json'
+SEARCH_INDEX_DIR = 'search_index'
+REFRESHER_LOCK_FILE = 'refresher.lock'
+STATUS_OVERLAY_LOCK_FILE = 'status_overlay.lock'
+
+
+def save_snapshot(snapshot, cache_dir):
+    """ writes the datasets of a snapshot to the cache and makes them the current cached snapshot
+
+    Args:
+        snapshot: (DataSnapshot) - published snapshot
+        cache_dir: (str) - folder of the cache
+
+    Returns: bool, True if the snapshot has been written
+    """
+    if feather is None:
+        return False
+
+    os.makedirs(cache_dir, exist_ok=True)
+    snapshot_dir = tempfile.mkdtemp(prefix=f"snapshot_{snapshot.version}_", dir=cache_dir)
+    try:
+        for name in FRAMES:
+            feather.write_feather(getattr(snapshot, name), os.path.join(snapshot_dir, f"{name}.feather"),
+                                  compression='uncompressed')
+        snapshot.search_index.save(os.path.join(snapshot_dir, SEARCH_INDEX_DIR))
+        meta = {'version': snapshot.version,
+                'created_at': snapshot.created_at.isoformat(),
+                'gov_docs': snapshot.gov_docs,
+                'nongov_docs': snapshot.nongov_docs,
+                'top_docs_stats': [{**stats, 'rev_date': stats['rev_date'].isoformat(),
+                                    'not_relevant': int(stats['not_relevant']),
+                                    'maybe_relevant': int(stats['maybe_relevant']),
+                                    'relevant': int(stats['relevant'])} for stats in snapshot.top_docs_stats],
+                'watermark': {col: value.isoformat() if isinstance(value, datetime.datetime) else value
+                              for col, value in snapshot.watermark.items()}}
+        _write_json(os.path.join(snapshot_dir, META_FILE), meta)
+    except Exception:
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+        raise
+
+    # point to the new snapshot, readers either see the previous complete snapshot or this one
+    previous_snapshot_name = get_current_snapshot_name(cache_dir)
+    _write_file(os.path.join(cache_dir, CURRENT_FILE), os.path.basename(snapshot_dir))
+
+    # remove the snapshots at least two generations old, the previous one is kept as the processes which read CURRENT
+    # before it was replaced may still be memory-mapping its files
+    for entry in os.listdir(cache_dir):
+        if entry.startswith('snapshot_') and entry not in (os.path.basename(snapshot_dir), previous_snapshot_name):
+            shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+
+    return True
+
+
+def save_status_overlay(snapshot, cache_dir):
+    """ writes the status overlay of a snapshot to the cache, the overlay is applied to the cached snapshot on load
+
+    Args:
+        snapshot: (DataSnapshot) - published snapshot
+        cache_dir: (str) - folder of the cache
+    """
+    if feather is None:
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    _write_json(os.path.join(cache_dir, STATUS_OVERLAY_FILE),
+                {'status_overlay': snapshot.status_overlay, 'overlay_written_at': snapshot.overlay_written_at})
+
+
+def load_status_overlay(cache_dir):
+    """ reads the cached status overlay
+
+    Args:
+        cache_dir: (str) - folder of the cache
+
+    Returns: tuple of the status overlay and the time each row was saved at (both empty if there is no cached overlay)
+    """
+    # json keys are strings, the row ids are ints
+    try:
+        with open(os.path.join(cache_dir, STATUS_OVERLAY_FILE)) as f:
+            overlay = json.load(f)
+    except FileNotFoundError:
+        return {}, {}
+    status_overlay = {int(row_id): cols for row_id, cols in overlay['status_overlay'].items()}
+    overlay_written_at = {int(row_id): written_at for row_id, written_at in overlay['overlay_written_at'].items()}
+    return status_overlay, overlay_written_at
+
+
+def get_current_snapshot_name(cache_dir):
+    """ returns the folder name of the current cached snapshot, None if there is none """
+    try:
+        with open(os.path.join(cache_dir, CURRENT_FILE)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def get_status_overlay_mtime(cache_dir):
+    """ returns the modification time (ns) of the cached status overlay, None if there is none """
+    try:
+        return os.stat(os.path.join(cache_dir, STATUS_OVERLAY_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def try_lock_refresher(cache_dir):
+    """ tries to take the lock of the process refreshing the data, without waiting. The lock is held until the
+    returned file is closed or the process exits, so another process takes over when the refresher dies
+
+    Args:
+        cache_dir: (str) - folder of the cache
+
+    Returns: open lock file, None if another process holds the lock (or file locks are not available)
+    """
+    if fcntl is None:
+        return None
+
+    os.makedirs(cache_dir, exist_ok=True)
+    lock_file = open(os.path.join(cache_dir, REFRESHER_LOCK_FILE), 'a')
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+@contextmanager
+def status_overlay_lock(cache_dir):
+    """ holds the lock of the cached status overlay, so that the processes read, merge and write it in turn
+
+    Args:
+        cache_dir: (str) - folder of the cache
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, STATUS_OVERLAY_LOCK_FILE), 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def load_snapshot(cache_dir):
+    """ reads the current cached snapshot, the dataframes are read from memory-mapped files
+
+    Args:
+        cache_dir: (str) - folder of the cache
+
+    Returns: DataSnapshot, None if there is no cached snapshot (or it cannot be read)
+    """
+    if feather is None:
+        return None
+
+    snapshot_name = get_current_snapshot_name(cache_dir)
+    if snapshot_name is None:
+        return None
+    snapshot_dir = os.path.join(cache_dir, snapshot_name)
+
+    with open(os.path.join(snapshot_dir, META_FILE)) as f:
+        meta = json.load(f)
+    # split_blocks keeps the numeric columns without nulls as views of the memory-mapped files instead of copies,
+    # so the processes serving the same snapshot share their pages
+    frames = {name: feather.read_table(os.path.join(snapshot_dir, f"{name}.feather"), memory_map=True)
+              .to_pandas(split_blocks=True) for name in FRAMES}
+
+    top_docs_stats = [{**stats, 'rev_date': pd.Timestamp(stats['rev_date'])} for stats in meta['top_docs_stats']]
+    watermark = {col: datetime.datetime.fromisoformat(value) if isinstance(value, str) else value
+                 for col, value in meta['watermark'].items()}
+
+    # the search index is built again only for a snapshot cached without it
+    search_index_dir = os.path.join(snapshot_dir, SEARCH_INDEX_DIR)
+    search_index = SearchIndex.load(search_index_dir) if os.path.isdir(search_index_dir) else None
+
+    # status changes saved after the snapshot was cached
+    status_overlay, overlay_written_at = load_status_overlay(cache_dir)
+
+    return DataSnapshot(meta['version'], frames['final_output_df'], meta['gov_docs'], meta['nongov_docs'],
+                        frames['gov_viz_df'], frames['nongov_viz_df'], top_docs_stats, watermark,
+                        status_overlay=status_overlay, overlay_written_at=overlay_written_at,
+                        created_at=datetime.datetime.fromisoformat(meta['created_at']), search_index=search_index)
+
+
+def _write_json(path, data):
+    _write_file(path, json.dumps(data))
+
+
+def _write_file(path, text):
+    # write to a temp file in the same folder and rename it, so that the file is never read half written
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
@@ -0,0 +1,161 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection of the pool becomes free within the checkout timeout"""
+
+
+class ConnectionPool:
+    """Small thread-safe pool of sql connections shared by the reads and writes of the data manager
+
+    Connections are opened on demand up to the size of the pool, validated with a cheap query when they are checked
+    out and closed when they have been idle for too long. Any DB-API connection can be pooled, so the pool can be
+    used with a local stand-in database (e.g. sqlite3) instead of the production sql server.
+    """
+
+    def __init__(self, connect, size=4, max_idle_seconds=300, checkout_timeout=30, validation_query="SELECT 1"):
+        """
+        Args:
+            connect: function with no arguments returning a new connection (e.g. a partial of pymssql.connect)
+            size: (int) max number of open connections
+            max_idle_seconds: (float) connections idle for longer than this are closed instead of being reused
+            checkout_timeout: (float) seconds to wait for a free connection before raising a PoolTimeoutError
+            validation_query: (str) query run on a connection when it is checked out to check it is still usable
+        """
+        self._connect = connect
+        self.size = size
+        self.max_idle_seconds = max_idle_seconds
+        self.checkout_timeout = checkout_timeout
+        self.validation_query = validation_query
+
+        # idle connections and the time they were returned to the pool, the most recently used is reused first
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open_connections = 0
+        self._counters = {'checkouts': 0, 'created': 0, 'reused': 0, 'recycled_idle': 0, 'failed_validation': 0,
+                          'discarded': 0, 'waits': 0, 'wait_seconds': 0.0, 'timeouts': 0}
+
+    @contextmanager
+    def connection(self):
+        """ checks out a connection for the duration of a with block, the connection is rolled back and returned to the
+        pool at the end of the block, or closed if the block raised an exception as it might not be usable anymore
+        """
+        conn = self._checkout()
+        try:
+            yield conn
+        except Exception:
+            self._discard(conn)
+            raise
+
+        # end any transaction left open by the block (e.g. by a select) before the connection is reused
+        try:
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+        else:
+            self._idle.put((conn, time.monotonic()))
+
+    def stats(self):
+        """ returns the pool counters (checkouts, connections created/reused/recycled, waits for a free connection) """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['open_connections'] = self._open_connections
+        stats['idle_connections'] = self._idle.qsize()
+        stats['size'] = self.size
+        return stats
+
+    def close_all(self):
+        """ closes all the idle connections of the pool """
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn, counter=None)
+
+    def _checkout(self):
+        start = time.monotonic()
+        waited = False
+        self._count('checkouts')
+
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._open_new_connection()
+                if conn is not None:
+                    self._record_wait(waited, start)
+                    return conn
+
+                # all the connections are in use, wait for one to be returned
+                waited = True
+                remaining = self.checkout_timeout - (time.monotonic() - start)
+                try:
+                    if remaining <= 0:
+                        raise queue.Empty
+                    conn, last_used = self._idle.get(timeout=remaining)
+                except queue.Empty:
+                    self._record_wait(waited, start)
+                    self._count('timeouts')
+                    raise PoolTimeoutError(f"No sql connection available after {self.checkout_timeout} seconds")
+
+            if time.monotonic() - last_used > self.max_idle_seconds:
+                self._discard(conn, counter='recycled_idle')
+                continue
+            if not self._is_valid(conn):
+                self._discard(conn, counter='failed_validation')
+                continue
+
+            self._count('reused')
+            self._record_wait(waited, start)
+            return conn
+
+    def _open_new_connection(self):
+        # reserve a slot before connecting so that the pool never opens more than size connections
+        with self._lock:
+            if self._open_connections >= self.size:
+                return None
+            self._open_connections += 1
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._lock:
+                self._open_connections -= 1
+            raise
+        self._count('created')
+        return conn
+
+    def _is_valid(self, conn):
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute(self.validation_query)
+                cur.fetchall()
+            finally:
+                cur.close()
+        except Exception:
+            return False
+        return True
+
+    def _discard(self, conn, counter='discarded'):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._open_connections -= 1
+            if counter:
+                self._counters[counter] += 1
+
+    def _record_wait(self, waited, start):
+        if waited:
+            with self._lock:
+                self._counters['waits'] += 1
+                self._counters['wait_seconds'] += time.monotonic() - start
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
@@ -0,0 +1,222 @@
+import constant
+import datetime
+import threading
+import numpy as np
+import pandas as pd
+import utils
+
+# words the synthetic paragraphs are made of
+WORDS = ['the', 'licensee', 'shall', 'ensure', 'that', 'radiation', 'dose', 'limit', 'employee', 'exposure', 'site',
+         'nuclear', 'safety', 'case', 'assessment', 'of', 'and', 'to', 'in', 'for', 'with', 'any', 'must', 'be',
+         'waste', 'storage', 'facility', 'inspection', 'maintenance', 'records', 'regulator', 'approval', 'plant',
+         'emergency', 'arrangements', 'training', 'competent', 'person', 'contamination', 'monitoring', 'controlled',
+         'area', 'equipment', 'procedure', 'review', 'period', 'annual', 'report', 'operator', 'requirement',
+         'criticality', 'decommissioning', 'environmental', 'discharge', 'permit', 'quality', 'management', 'system',
+         'hazard', 'risk', 'reasonably', 'practicable', 'measures', 'protection', 'worker', 'public', 'incident']
+# first words of the names of the legislation (gov) and guidance (non-gov) documents
+GOV_NAMES = ['Ionising Radiations Regulations', 'Nuclear Installations Act', 'Radiation Emergency Regulations',
+             'Environmental Permitting Regulations', 'Health and Safety at Work Act']
+NONGOV_NAMES = ['Safety Assessment Principles', 'Technical Assessment Guide', 'Approved Code of Practice',
+                'Licence Condition Handbook', 'Radioactive Waste Guidance']
+
+
+class SyntheticDataSource:
+    """Stands in for the sql table, so that the app and the benchmarks can run without the sql server (see
+    DataManager and benchmarks/bench_app.py)
+
+    The rows are generated once by make_dependency_mapper_output. The status updates saved by the app are applied to
+    the rows with their lastSubmit, so a delta refresh reads them back as it would from the sql table.
+    """
+
+    def __init__(self, n_rows, seed=0, rev_date_format='%Y-%m-%d'):
+        """
+        Args:
+            n_rows: (int) number of rows of the table
+            seed: (int) random seed
+            rev_date_format: (str) format of the currentRevision and previousRevision dates
+        """
+        self._lock = threading.Lock()
+        self._df = make_dependency_mapper_output(n_rows, seed=seed, rev_date_format=rev_date_format)
+        self._id_index = pd.Index(self._df['ID'])
+
+    def read(self, table_name, watermark=None):
+        """ returns the rows of the table, same as the rows returned by the query of utils.get_delta_query
+
+        Args:
+            table_name: (str) name of the table (ignored, there is a single table)
+            watermark: (dict) if given, only the rows with a higher ID, lastSubmit or currentRevision than the
+                       watermark are returned (see utils.get_watermark)
+
+        Returns: dataframe (a copy, the caller can modify it)
+        """
+        with self._lock:
+            if watermark is None:
+                return self._df.copy()
+
+            mask = np.zeros(len(self._df), dtype=bool)
+            if watermark['ID'] is not None:
+                mask |= (self._df['ID'] > watermark['ID']).to_numpy()
+            for col in constant.WATERMARK_DATE_COLS:
+                if watermark[col] is not None:
+                    mask |= (utils.parse_watermark_dates(self._df[col], col) > watermark[col]).to_numpy()
+            return self._df.loc[mask].reset_index(drop=True)
+
+    def write(self, table_name, updates):
+        """ applies status updates to the rows, see DataManager.update_sql
+
+        Args:
+            table_name: (str) name of the table (ignored, there is a single table)
+            updates: (list) each element of the list is a tuple (id, changes) - id is the row id and changes is a
+                     dict of col name: value to be set
+
+        Returns: bool, True
+        """
+        with self._lock:
+            for row_id, changes in updates:
+                positions = self._id_index.get_indexer_for([row_id])
+                for col, value in changes.items():
+                    self._df.loc[positions[positions >= 0], col] = value
+        return True
+
+    def insert(self, rows_df):
+        """ appends rows to the table, as rows inserted in the sql table by the dependency mapper
+
+        Args:
+            rows_df: (dataframe) rows with the columns of the table and new IDs
+        """
+        with self._lock:
+            self._df = pd.concat([self._df, rows_df], ignore_index=True)
+            self._id_index = pd.Index(self._df['ID'])
+
+
+def make_dependency_mapper_output(n_rows, n_docs=None, n_sl_cols=200, seed=0, rev_date_format='%Y-%m-%d'):
+    """ returns rows with the columns of the dependency mapper output sql table, as read by utils.read_sql_chunks
+
+    The documents are half legislation (gov) and half guidance (non-gov), each with a history of 2 to 7 revisions
+    over the last years, and every row is a change of one of the revisions after the first one. The paragraphs are
+    drawn from a pool of generated paragraphs, so that the text columns share their strings like the values read
+    from the sql table do. About a third of the changes are linked to 1 to 3 SL documents (the SL columns only hold
+    these links and are sparse), and some changes have been reviewed, addressed or validated as not relevant.
+
+    Args:
+        n_rows: (int) number of rows
+        n_docs: (int) number of documents, by default 1 per 500 rows (between 20 and 1000)
+        n_sl_cols: (int) number of SL document columns
+        seed: (int) random seed
+        rev_date_format: (str) format of the currentRevision and previousRevision dates (the document names end
+                         with the date in the %Y-%m-%d format)
+
+    Returns: dataframe
+    """
+    rng = np.random.default_rng(seed)
+    today = pd.Timestamp(datetime.date.today())
+    n_docs = n_docs or int(np.clip(n_rows // 500, 20, 1000))
+
+    # ** documents and their revisions **
+    is_gov = np.arange(n_docs) % 2 == 0
+    base_names = np.array([f"{GOV_NAMES[i // 2 % len(GOV_NAMES)]} {i // 2 + 1}" if is_gov[i] else
+                           f"{NONGOV_NAMES[i // 2 % len(NONGOV_NAMES)]} {i // 2 + 1}" for i in range(n_docs)],
+                          dtype=object)
+    n_revs = rng.integers(2, 8, n_docs)
+    rev_docs = np.repeat(np.arange(n_docs), n_revs)
+    rev_numbers = np.arange(len(rev_docs)) - np.repeat(np.cumsum(n_revs) - n_revs, n_revs) + 1
+    # the last revision of a document is within the last 2 years, the previous ones are 2 months to a year apart
+    gaps = rng.integers(60, 365, len(rev_docs))
+    days_before_last = pd.Series(gaps[::-1]).groupby(rev_docs[::-1]).cumsum().to_numpy()[::-1] - gaps
+    rev_dates = today - pd.to_timedelta(rng.integers(0, 730, n_docs)[rev_docs] + days_before_last, unit='D')
+    rev_date_strings = rev_dates.strftime('%Y-%m-%d').to_numpy(dtype=object)
+    rev_date_values = rev_date_strings if rev_date_format == '%Y-%m-%d' else \
+        rev_dates.strftime(rev_date_format).to_numpy(dtype=object)
+    # as in the sql table, the document names end with the revision number and date (see utils.clean_documentname)
+    rev_names = np.array([f"{base_names[doc]} Rev{rev} {date}" for doc, rev, date in
+                          zip(rev_docs, rev_numbers, rev_date_strings)], dtype=object)
+    # only the guidance documents have revision numbers
+    rev_labels = np.where(is_gov[rev_docs], None, np.char.add('Rev', rev_numbers.astype(str)).astype(object))
+    prev_rev_labels = np.where(is_gov[rev_docs], None,
+                               np.char.add('Rev', (rev_numbers - 1).astype(str)).astype(object))
+
+    # ** rows (changes of the revisions after the first one) **
+    changed_revs = np.flatnonzero(rev_numbers > 1)
+    row_revs = changed_revs[rng.integers(0, len(changed_revs), n_rows)]
+    row_docs = rev_docs[row_revs]
+    n_sections = rng.integers(5, 40, n_docs)
+    sections = (rng.random(n_rows) * n_sections[row_docs]).astype('int64') + 1
+    section_titles = np.array([f"Section {i}" for i in range(n_sections.max() + 1)], dtype=object)
+
+    paragraphs = make_paragraphs(rng, min(max(n_rows, 100), 50_000))
+    previous_paragraphs = paragraphs[rng.integers(0, len(paragraphs), n_rows)]
+    previous_paragraphs[rng.random(n_rows) < 0.03] = None
+    next_paragraphs = paragraphs[rng.integers(0, len(paragraphs), n_rows)]
+    next_paragraphs[rng.random(n_rows) < 0.03] = None
+
+    rel_model_pred = rng.choice([0.0, 0.5, 1.0], n_rows, p=[0.65, 0.2, 0.15])
+
+    # ** statuses set by the users and the time they were saved **
+    validated_not_relevant = rng.random(n_rows) < 0.03
+    addressed = rng.random(n_rows) < 0.1
+    reviewed = addressed | (rng.random(n_rows) < 0.2)
+    submitted = reviewed | validated_not_relevant
+    # saved 1 to 60 days after the revision (before today, so that the statuses saved by the app are read by the next
+    # delta refresh), only the unique dates are formatted
+    submit_days = np.minimum(rev_dates.to_numpy()[row_revs] + rng.integers(1, 61, n_rows).astype('timedelta64[D]'),
+                             (today - pd.Timedelta(days=1)).to_datetime64())
+    unique_days, day_codes = np.unique(submit_days[submitted], return_inverse=True)
+    last_submit = np.full(n_rows, None, dtype=object)
+    last_submit[submitted] = pd.DatetimeIndex(unique_days).strftime('%m/%d/%Y 10:00:00').to_numpy(dtype=object)[
+        day_codes]
+
+    df = pd.DataFrame({
+        'ID': np.arange(1, n_rows + 1),
+        'documentName': rev_names[row_revs],
+        'documentType': np.where(is_gov[row_docs], 'gov', 'non-gov').astype(object),
+        'revisionNumber': rev_labels[row_revs],
+        'prevRevisionNumber': prev_rev_labels[row_revs],
+        'currentRevision': rev_date_values[row_revs],
+        'previousRevision': rev_date_values[row_revs - 1],
+        'sectionTitle': section_titles[sections],
+        'pageNumber': sections * 3 + rng.integers(0, 3, n_rows),
+        'changeText': paragraphs[rng.integers(0, len(paragraphs), n_rows)],
+        'previousParagraph': previous_paragraphs,
+        'nextParagraph': next_paragraphs,
+        'rel_model_pred': rel_model_pred,
+        'reviewed': reviewed,
+        'addressed': addressed,
+        'validatedNotRelevant': validated_not_relevant,
+        'lastSubmit': last_submit,
+    })
+
+    # ** links to the SL documents **
+    sl_cols = [f"SL{'MP'[i % 2]}_{1 + i // 100}_{i // 10 % 10:02d}_{i % 10:02d}" for i in range(n_sl_cols)]
+    # the relevant changes (and a few of the others) have 1 to 3 links, some SL documents have far more links
+    linked_rows = np.flatnonzero((rel_model_pred >= 0.5) | (rng.random(n_rows) < 0.05))
+    n_links = rng.integers(1, 4, len(linked_rows))
+    link_rows = np.repeat(linked_rows, n_links)
+    link_cols = (rng.random(len(link_rows)) ** 2 * n_sl_cols).astype('int64')
+    link_values = np.where(rng.random(len(link_rows)) < 0.5, 1.0, 0.5).astype('float32')
+    order = np.argsort(link_cols, kind='stable')
+    col_starts = np.searchsorted(link_cols[order], np.arange(n_sl_cols + 1))
+    sl_values = {}
+    for i, col in enumerate(sl_cols):
+        values = np.zeros(n_rows, dtype='float32')
+        col_links = order[col_starts[i]:col_starts[i + 1]]
+        values[link_rows[col_links]] = link_values[col_links]
+        sl_values[col] = pd.arrays.SparseArray(values, dtype=pd.SparseDtype('float32', 0))
+
+    return pd.concat([df, pd.DataFrame(sl_values)], axis=1)
+
+
+def make_paragraphs(rng, n_paragraphs):
+    """ returns paragraphs of 10 to 60 random words, with a clause number
+
+    Args:
+        rng: (Generator) numpy random generator
+        n_paragraphs: (int) number of paragraphs
+
+    Returns: array of strings
+    """
+    words = np.array(WORDS, dtype=object)
+    lengths = rng.integers(10, 61, n_paragraphs)
+    paragraph_words = words[rng.integers(0, len(words), lengths.sum())]
+    starts = np.cumsum(lengths) - lengths
+    return np.array([f"{i % 40 + 1}({i % 7 + 1}) " + ' '.join(paragraph_words[start:start + length]) + '.'
+                     for i, (start, length) in enumerate(zip(starts, lengths))], dtype=object)
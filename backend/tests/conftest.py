@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the backend modules import each other by name (e.g. import utils), as when the app is run from the backend folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
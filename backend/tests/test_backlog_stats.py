@@ -0,0 +1,46 @@
+from datetime import datetime
+import pytest
+import constant
+from data_manager import DataManager
+from synthetic_data import SyntheticDataSource
+
+
+@pytest.fixture(scope='module')
+def snapshot():
+    """ returns a snapshot of synthetic data """
+    return DataManager(data_source=SyntheticDataSource(3000)).snapshot
+
+
+def get_backlog_stats(final_output_df):
+    """ counts the statuses of the rows of the backlog, as the landing page counted them on every request """
+    start_dt_for_backlog_stats = datetime.strptime(constant.START_DT_FOR_BACKLOG_STATS, '%d/%m/%Y')
+    final_output_df = final_output_df.loc[final_output_df['currentRevision'] >= start_dt_for_backlog_stats]
+    return {status: int((final_output_df['status'].str.lower() == status).sum())
+            for status in ('not started', 'reviewed', 'addressed')}
+
+
+def test_backlog_stats_of_a_snapshot(snapshot):
+    counts = snapshot.backlog_stats.get_counts()
+
+    assert counts == get_backlog_stats(snapshot.final_output_df)
+    # the synthetic revisions are spread before and after the start date of the backlog
+    assert 0 < sum(counts.values()) < len(snapshot.final_output_df)
+
+
+def test_backlog_stats_follow_the_status_changes(snapshot):
+    ids = snapshot.final_output_df['ID'].tolist()
+    # a row changed several times, changed back, set to not relevant, and an unknown id
+    status_updates = [[(ids[0], 'status', 'reviewed'), (ids[1], 'status', 'addressed')],
+                      [(ids[0], 'status', 'addressed'), (ids[2], 'status', 'not relevant')],
+                      [(ids[0], 'status', 'not started'), (ids[1], 'lastSubmit', '01/01/2024 10:00:00')],
+                      [(row_id, 'status', 'reviewed') for row_id in ids[100:400]] + [(10 ** 9, 'status', 'reviewed')],
+                      [(row_id, 'status', 'not started') for row_id in ids[200:300]]]
+
+    for df_updates in status_updates:
+        snapshot = snapshot.with_status_updates(df_updates)
+        assert snapshot.backlog_stats.get_counts() == \
+            get_backlog_stats(snapshot.apply_status_overlay(snapshot.final_output_df))
+
+    # the counts of an overlay loaded from the cache are counted from the rows of the overlay
+    loaded_snapshot = snapshot.with_status_overlay(snapshot.status_overlay, snapshot.overlay_written_at)
+    assert loaded_snapshot.backlog_stats.get_counts() == snapshot.backlog_stats.get_counts()
@@ -0,0 +1,57 @@
+import pytest
+import utils
+from data_manager import DataManager
+from synthetic_data import SyntheticDataSource
+
+
+@pytest.fixture(scope='module')
+def snapshot():
+    """ returns a snapshot of synthetic data (about 3% of the paragraphs around the changes are null) """
+    return DataManager(data_source=SyntheticDataSource(3000)).snapshot
+
+
+def render_change_contexts(rows_df):
+    """ the change_context column as it was rendered for all the rows when the data was loaded """
+    return '<strong><i>Previous:</i></strong><br>' + rows_df['previousParagraph'].astype(str) + \
+        '<br><br><strong>Change:</strong><br>' + rows_df['changeText'].astype(str) + \
+        '<br><br><strong><i>Next:</i></strong><br>' + rows_df['nextParagraph'].astype(str)
+
+
+def get_largest_doc(snapshot, doc_type):
+    doc_type_key = utils.get_doc_type_key(doc_type)
+    (_, docs), _ = max(((key, positions) for key, positions in snapshot.doc_partitions.items()
+                        if key[0] == doc_type_key), key=lambda item: len(item[1]))
+    return docs
+
+
+@pytest.mark.parametrize('doc_type', ['Legislation', 'Guidance'])
+def test_change_context_of_the_pages_is_the_same_as_the_full_render(snapshot, doc_type):
+    docs = get_largest_doc(snapshot, doc_type)
+    doc_df = snapshot.get_doc_df(doc_type, docs)
+    contexts = dict(zip(doc_df['ID'], render_change_contexts(doc_df)))
+    # the change_context is the 4th column of the detailed table, after the revisionNumber for the non-gov documents
+    context_col = 3 if doc_type == 'Legislation' else 4
+
+    all_rows = utils.get_doc_changes(doc_type, docs, 'Historical', 'All', 'all', doc_df)['detail_df']
+    assert len(all_rows) == len(doc_df)
+    assert [row[context_col] for row in all_rows] == [contexts[row[-2]] for row in all_rows]
+
+    # the pages rendered one at a time give the same rows as the full table
+    page_rows, cursor = [], None
+    while True:
+        page = utils.get_doc_changes(doc_type, docs, 'Historical', 'All', 'all', doc_df, limit=25, cursor=cursor)
+        page_rows.extend(page['detail_df'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert page_rows == all_rows
+
+
+def test_change_context_with_null_paragraphs(snapshot):
+    rows_df = snapshot.final_output_df
+    rows_df = rows_df.loc[rows_df['previousParagraph'].isna() | rows_df['nextParagraph'].isna()]
+    assert len(rows_df)
+
+    contexts = [utils.create_context(change, previous, after) for change, previous, after
+                in zip(rows_df['changeText'], rows_df['previousParagraph'], rows_df['nextParagraph'])]
+    assert contexts == render_change_contexts(rows_df).tolist()
@@ -0,0 +1,93 @@
+import datetime
+import pandas as pd
+import pytest
+import utils
+from data_manager import DataManager
+from synthetic_data import SyntheticDataSource
+
+QUERIES = ['radiation', '"dose limit"', 'amended clause']
+
+
+def test_delta_query_converts_the_dates_with_their_format():
+    watermark = {'ID': 10, 'lastSubmit': datetime.datetime(2024, 5, 3, 10),
+                 'currentRevision': datetime.datetime(2024, 3, 28)}
+    query, params = utils.get_delta_query('table', watermark)
+
+    # the styles do not depend on the language/DATEFORMAT of the sql server session
+    assert query == ("SELECT * FROM [dbo].[table] WHERE ID > %d OR TRY_CONVERT(datetime2, lastSubmit, 101) > %s "
+                     "OR TRY_CONVERT(datetime2, currentRevision, 103) > %s")
+    assert params == (10, watermark['lastSubmit'], watermark['currentRevision'])
+    assert utils.get_delta_query('table') == ("SELECT * FROM [dbo].[table]", None)
+
+
+def test_watermark_parses_the_dates_with_their_format():
+    # currentRevision is day first, lastSubmit is written month first by update_status_on_submit
+    df = pd.DataFrame({'ID': [1, 2, 3], 'currentRevision': ['05/03/2024', '28/02/2024', None],
+                       'lastSubmit': ['05/03/2024 10:00:00', '02/28/2024 09:00:00', None]})
+
+    assert utils.get_watermark(df) == {'ID': 3, 'lastSubmit': datetime.datetime(2024, 5, 3, 10),
+                                       'currentRevision': datetime.datetime(2024, 3, 5)}
+
+
+def as_comparable(df, sort_cols):
+    """ returns the rows of a dataset sorted by sort_cols, with the categoricals as objects (the categories of a
+    merged dataset are in a different order) """
+    df = df.sort_values(sort_cols).reset_index(drop=True)
+    return df.astype({col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+
+
+@pytest.fixture
+def source():
+    """ returns a synthetic sql table whose revision dates are day first, as in the sql table """
+    return SyntheticDataSource(2000, rev_date_format='%d/%m/%Y')
+
+
+def test_delta_refresh_is_the_same_as_a_full_reload(source):
+    dm = DataManager(data_source=source)
+    table_df = source.read('table')
+    submitted_at = datetime.datetime.now().strftime('%m/%d/%Y %H:%M:%S')
+    next_year = datetime.date.today().year + 1
+
+    # updated rows: statuses saved by a user, a new revision (with a day above 12), an amended text, and a document
+    # name removed (the row is dropped by the transform)
+    source.write('table', [(1, {'reviewed': True, 'addressed': True, 'lastSubmit': submitted_at}),
+                           (2, {'validatedNotRelevant': True, 'lastSubmit': submitted_at}),
+                           (3, {'currentRevision': f"28/12/{next_year}"}),
+                           (4, {'changeText': 'amended clause of the licence', 'lastSubmit': submitted_at}),
+                           (5, {'documentName': None, 'lastSubmit': submitted_at})])
+    # inserted rows
+    inserted_df = table_df.iloc[10:20].assign(ID=table_df['ID'].max() + 1 + pd.RangeIndex(10), lastSubmit=None,
+                                              changeText='new amended clause')
+    source.insert(inserted_df)
+
+    dm.update()
+    assert dm.delta_updates_since_full_reload == 1
+    delta_snapshot = dm.snapshot
+    full_snapshot = DataManager(data_source=source).snapshot
+
+    assert len(delta_snapshot.final_output_df) == len(table_df) - 1 + len(inserted_df)
+    pd.testing.assert_frame_equal(as_comparable(delta_snapshot.final_output_df, ['ID']),
+                                  as_comparable(full_snapshot.final_output_df, ['ID']))
+    for name in ['gov_viz_df', 'nongov_viz_df']:
+        pd.testing.assert_frame_equal(as_comparable(getattr(delta_snapshot, name), ['ID', 'sl_document']),
+                                      as_comparable(getattr(full_snapshot, name), ['ID', 'sl_document']))
+    assert delta_snapshot.watermark == full_snapshot.watermark
+    assert delta_snapshot.watermark['currentRevision'] == datetime.datetime(next_year, 12, 28)
+    # the document names are unordered (see utils.get_unique_file_names)
+    for name in ['gov_docs', 'nongov_docs']:
+        assert sorted(getattr(delta_snapshot, name)) == sorted(getattr(full_snapshot, name))
+    assert delta_snapshot.top_docs_stats == full_snapshot.top_docs_stats
+
+    for query in QUERIES:
+        rows_df, scores, num_results = delta_snapshot.search(query, limit=50)
+        full_rows_df, full_scores, full_num_results = full_snapshot.search(query, limit=50)
+        assert num_results == full_num_results
+        assert sorted(rows_df['ID']) == sorted(full_rows_df['ID']), query
+
+
+def test_delta_refresh_without_changes_keeps_the_snapshot(source):
+    dm = DataManager(data_source=source)
+    snapshot = dm.snapshot
+
+    dm.update()
+    assert dm.snapshot is snapshot
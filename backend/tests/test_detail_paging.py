@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+import constant
+import utils
+
+
+@pytest.fixture
+def doc_df():
+    """ returns rows of a detailed table, with many rows revised on the same dates and rows without a revision date """
+    rng = np.random.default_rng(0)
+    n_rows = 250
+    rev_dates = pd.to_datetime('2024-01-01') + pd.to_timedelta(rng.integers(0, 5, n_rows) * 30, unit='D')
+    rev_dates = rev_dates.where(rng.random(n_rows) > 0.1)
+    return pd.DataFrame({'ID': rng.permutation(n_rows) + 1, 'currentRevision': rev_dates,
+                         'revisionNumber': [f"Rev{i}" for i in rng.integers(1, 4, n_rows)],
+                         'sectionTitle': [f"Section {i}" for i in rng.integers(1, 6, n_rows)],
+                         'pageNumber': rng.integers(1, 20, n_rows), 'rel_model_pred': rng.choice([0, 0.5, 1], n_rows),
+                         'status': rng.choice(['not started', 'reviewed'], n_rows)})
+
+
+def get_pages_by_cursor(doc_df, limit):
+    """ returns the IDs of the pages of the detailed table, each page read after the cursor of the previous one """
+    pages, cursor = [], None
+    while True:
+        page_df, cursor = utils.get_detail_page(doc_df, limit=limit, cursor=cursor)
+        pages.append(page_df['ID'].tolist())
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.parametrize('limit', [1, 7, 50, 250, 1000])
+def test_cursor_pages_return_every_row_once_in_order(doc_df, limit):
+    pages = get_pages_by_cursor(doc_df, limit)
+
+    all_rows_df, next_cursor = utils.get_detail_page(doc_df)
+    assert next_cursor is None
+    assert [row_id for page in pages for row_id in page] == all_rows_df['ID'].tolist()
+    assert all(len(page) == limit for page in pages[:-1])
+    # the rows without a revision date are last
+    assert all_rows_df['currentRevision'].iloc[-1:].isna().all()
+
+
+def test_cursor_pages_do_not_skip_or_repeat_rows_added_between_pages(doc_df):
+    first_page_df, cursor = utils.get_detail_page(doc_df, limit=40)
+    # new changes (the most recent revision) are added before the next page is read
+    new_rows_df = doc_df.iloc[:30].assign(ID=doc_df['ID'].max() + 1 + np.arange(30),
+                                          currentRevision=pd.Timestamp('2025-06-01'))
+    doc_df = pd.concat([doc_df, new_rows_df], ignore_index=True)
+
+    ids = first_page_df['ID'].tolist()
+    while cursor is not None:
+        page_df, cursor = utils.get_detail_page(doc_df, limit=40, cursor=cursor)
+        ids.extend(page_df['ID'])
+
+    # every row of the first read is returned once, the new rows are before the first page
+    assert len(ids) == len(set(ids)) == len(doc_df) - len(new_rows_df)
+    assert set(ids) == set(doc_df['ID']) - set(new_rows_df['ID'])
+
+
+def test_offset_pages_after_a_cursor(doc_df):
+    _, cursor = utils.get_detail_page(doc_df, limit=20)
+    page_df, _ = utils.get_detail_page(doc_df, offset=5, limit=10, cursor=cursor)
+
+    all_rows_df, _ = utils.get_detail_page(doc_df)
+    assert page_df['ID'].tolist() == all_rows_df['ID'].iloc[25:35].tolist()
+
+
+@pytest.mark.parametrize('sort', list(constant.DETAIL_SORT_COLS))
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_offset_pages_of_a_sort_return_every_row_once(doc_df, sort, order):
+    ids = []
+    for offset in range(0, len(doc_df), 40):
+        page_df, next_cursor = utils.get_detail_page(doc_df, offset=offset, limit=40, sort=sort, order=order)
+        assert next_cursor is None
+        ids.extend(page_df['ID'])
+
+    sort_col = constant.DETAIL_SORT_COLS[sort]
+    expected_df = doc_df.sort_values([sort_col, 'ID'], ascending=order == 'asc')
+    assert ids == expected_df['ID'].tolist()
+
+
+@pytest.mark.parametrize('kwargs', [{'cursor': 'not a cursor'}, {'cursor': '2024-01-01T00:00:00|x'},
+                                    {'cursor': '2024-01-01T00:00:00|5', 'sort': 'ID'}, {'sort': 'changeText'},
+                                    {'order': 'up'}])
+def test_invalid_page_arguments(doc_df, kwargs):
+    with pytest.raises(ValueError):
+        utils.get_detail_page(doc_df, limit=10, **kwargs)
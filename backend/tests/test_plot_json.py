@@ -0,0 +1,57 @@
+import json
+import plotly
+import plotly.graph_objs as go
+import pytest
+import utils
+from data_manager import DataManager
+from synthetic_data import SyntheticDataSource
+
+
+@pytest.fixture(scope='module')
+def snapshot():
+    """ returns a snapshot of synthetic data """
+    return DataManager(data_source=SyntheticDataSource(3000)).snapshot
+
+
+def get_treemap(snapshot, doc_type):
+    # built as by the /plot_treemap route, for the document with the most changes
+    doc_type_key = utils.get_doc_type_key(doc_type)
+    (_, docs), _ = max(((key, positions) for key, positions in snapshot.viz_doc_partitions.items()
+                        if key[0] == doc_type_key), key=lambda item: len(item[1]))
+    plot_doc_df = snapshot.get_viz_doc_df(doc_type, docs)
+    plot_doc_df = utils.get_relevant_link_rows_for_viz('Soft', plot_doc_df)
+    plot_doc_df = utils.get_recent_rows_for_viz('Historical', plot_doc_df)
+    plot_doc_df = plot_doc_df.assign(changeText=snapshot.get_change_texts(plot_doc_df['ID']))
+    return utils.plot_treemap(plot_doc_df)
+
+
+def get_sankey(snapshot, doc_type):
+    # built as by the /plot_sankey route
+    sankey_df = snapshot.get_sankey_df(doc_type, 'Soft', 'Historical')
+    labels = utils.create_labels(sankey_df)
+    sankey_df, sankey_cmaps = utils.gen_colour(sankey_df)
+    return utils.sankey_plot(sankey_df, labels, sankey_cmaps)
+
+
+def plotly_json(fig):
+    return json.loads(json.dumps(fig.to_plotly_json(), cls=plotly.utils.PlotlyJSONEncoder))
+
+
+@pytest.mark.parametrize('doc_type', ['Legislation', 'Guidance'])
+@pytest.mark.parametrize('get_fig', [get_treemap, get_sankey])
+def test_fig_to_json_is_the_same_as_plotly_json_encoder(snapshot, doc_type, get_fig, monkeypatch):
+    assert utils.orjson is not None, "fig_to_json uses plotly's encoder without orjson"
+    fig = get_fig(snapshot, doc_type)
+
+    assert json.loads(utils.fig_to_json(fig)) == plotly_json(fig)
+    # plotly's encoder is the fallback
+    monkeypatch.setattr(utils.constant, 'FAST_PLOT_JSON', False)
+    assert json.loads(utils.fig_to_json(fig)) == plotly_json(fig)
+
+
+@pytest.mark.parametrize('doc_type', ['Legislation', 'Guidance'])
+def test_unvalidated_sankey_is_the_same_as_validated(snapshot, doc_type):
+    # the sankey is built with _validate=False, building it again from its json validates all its properties
+    fig = get_sankey(snapshot, doc_type)
+
+    assert plotly_json(go.Figure(fig.to_plotly_json())) == plotly_json(fig)
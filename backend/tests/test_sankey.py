@@ -0,0 +1,80 @@
+import matplotlib as mpl
+import numpy as np
+import pandas as pd
+import pytest
+from PIL import ImageColor
+import colour_scales
+import constant
+import utils
+from data_manager import DataManager
+from synthetic_data import SyntheticDataSource
+
+
+@pytest.fixture(scope='module')
+def snapshot():
+    """ returns a snapshot of synthetic data """
+    return DataManager(data_source=SyntheticDataSource(3000)).snapshot
+
+
+def groupby_sankey_df(viz_df, link_rel_type, recency):
+    """ the sankey dataframe as the /plot_sankey route built it on every request, by filtering the viz dataframe and
+    grouping its rows (with the document names as strings, as they were read) """
+    plot_doc_df = viz_df.astype({'documentName': str, 'sl_document': str})
+    plot_doc_df = utils.get_relevant_link_rows_for_viz(link_rel_type, plot_doc_df)
+    plot_doc_df = utils.get_recent_rows_for_viz(recency, plot_doc_df)
+
+    sankey_df = plot_doc_df.groupby(['documentName', 'sl_document'])['ID'].count().reset_index(name='no_of_changes')
+    sankey_df['source_id'] = sankey_df.groupby('documentName').ngroup()
+    length_of_doc = len(sankey_df.groupby(['documentName']))
+    sankey_df['target_id'] = sankey_df.groupby('sl_document').ngroup() + length_of_doc
+    return sankey_df
+
+
+@pytest.mark.parametrize('doc_type', constant.DOC_TYPES)
+@pytest.mark.parametrize('link_rel_type', constant.LINK_RELEVANCY_TYPES)
+@pytest.mark.parametrize('recency', constant.RECENCY_PERIODS)
+def test_sankey_aggregates_are_the_same_as_groupby(snapshot, doc_type, link_rel_type, recency):
+    viz_df = snapshot.gov_viz_df if utils.get_doc_type_key(doc_type) == 'gov' else snapshot.nongov_viz_df
+
+    pd.testing.assert_frame_equal(snapshot.get_sankey_df(doc_type, link_rel_type, recency),
+                                  groupby_sankey_df(viz_df, link_rel_type, recency))
+
+
+def old_gen_colour(sankey_df):
+    """ the link and node colours as gen_colour computed them for each row before the palette was vectorized """
+    def color_fader(c1, c2, mix=0):
+        c1 = np.array(mpl.colors.to_rgb(c1))
+        c2 = np.array(mpl.colors.to_rgb(c2))
+        return mpl.colors.to_hex((1 - mix) * c1 + mix * c2)
+
+    cnames = colour_scales.get_cnames()
+    sl_doc_names = sankey_df['sl_document'].unique().tolist()
+    sankey_cmaps = [color_fader(cnames['darkslateblue'], cnames['blanchedalmond'], int(ix / len(sl_doc_names)))
+                    for ix in range(len(sl_doc_names))]
+    link_colours = sankey_df['sl_document'].apply(lambda x: sankey_cmaps[sl_doc_names.index(x)])
+    sankey_df['link_colours'] = link_colours.apply(lambda x: f"rgba{ImageColor.getcolor(x.lower(), 'RGB') + (0.6,)}")
+    return sankey_df, sankey_cmaps
+
+
+@pytest.mark.parametrize('n_sl_docs', [1, 2, 7, 300])
+def test_sankey_palette_is_the_same_as_the_old_palette(n_sl_docs):
+    rng = np.random.default_rng(n_sl_docs)
+    sl_doc_ids = rng.permutation(np.arange(5 * n_sl_docs) % n_sl_docs)
+    sankey_df = pd.DataFrame({'documentName': [f"Doc {i}" for i in rng.integers(0, 20, len(sl_doc_ids))],
+                              'sl_document': [f"SLM {i}" for i in sl_doc_ids]})
+
+    sankey_df, sankey_cmaps = utils.gen_colour(sankey_df.copy())
+    old_sankey_df, old_sankey_cmaps = old_gen_colour(sankey_df.drop(columns='link_colours'))
+
+    assert sankey_cmaps == old_sankey_cmaps and len(sankey_cmaps) == n_sl_docs
+    assert sankey_df['link_colours'].tolist() == old_sankey_df['link_colours'].tolist()
+
+
+@pytest.mark.parametrize('doc_type', constant.DOC_TYPES)
+def test_sankey_colours_of_a_plot_are_the_same_as_the_old_colours(snapshot, doc_type):
+    sankey_df = snapshot.get_sankey_df(doc_type, 'Soft', 'Historical')
+
+    sankey_df, sankey_cmaps = utils.gen_colour(sankey_df)
+    old_sankey_df, old_sankey_cmaps = old_gen_colour(sankey_df.drop(columns='link_colours'))
+    assert sankey_cmaps == old_sankey_cmaps
+    assert sankey_df['link_colours'].tolist() == old_sankey_df['link_colours'].tolist()
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+import utils
+from synthetic_data import make_dependency_mapper_output
+
+
+def melt_sl_links_df(dependency_mapper_output_df):
+    """ the long table of the SL links as it was built from the dense SL columns, by unstacking all the values of the
+    rows having at least one link (including the 0 and null values of these rows) """
+    sliced_change_links_df = dependency_mapper_output_df.loc[:, dependency_mapper_output_df.columns.str[:2] == 'SL']
+    # the SL columns were read as dense columns
+    sliced_change_links_df = pd.DataFrame(sliced_change_links_df.to_numpy(dtype=float),
+                                          columns=sliced_change_links_df.columns)
+    sliced_change_links_df['ID'] = dependency_mapper_output_df[['ID']]
+    sliced_change_links_df.set_index('ID', inplace=True)
+    sliced_change_links_df.dropna(how='all', inplace=True)
+    sliced_change_links_df = sliced_change_links_df[(sliced_change_links_df.T != 0).any()]
+    long_tbl_sl_links_df = sliced_change_links_df.unstack().reset_index()
+    long_tbl_sl_links_df.rename(columns={"level_1": "ID", "level_0": "sl_document", 0: "link_relevancy"}, inplace=True)
+    long_tbl_sl_links_df['sl_document'] = long_tbl_sl_links_df['sl_document'].str.replace('_', '.')
+    long_tbl_sl_links_df['sl_document'] = long_tbl_sl_links_df['sl_document'].str[:3] + ' ' \
+        + long_tbl_sl_links_df['sl_document'].str[4:]
+    return long_tbl_sl_links_df
+
+
+@pytest.fixture(scope='module', params=['sparse', 'dense'])
+def table_df(request):
+    """ returns synthetic rows of the sql table, with the SL columns as read by read_sql_chunks (sparse) or as dense
+    columns holding nulls """
+    table_df = make_dependency_mapper_output(1000, n_sl_cols=60, seed=5)
+    table_df = utils.get_status(table_df)
+    if request.param == 'dense':
+        sl_cols = [col for col in table_df.columns if col.startswith('SL')]
+        sl_values = table_df[sl_cols].sparse.to_dense().to_numpy(dtype='float64')
+        sl_values[np.random.default_rng(5).random(sl_values.shape) < 0.05] = np.nan
+        table_df = pd.concat([table_df.drop(columns=sl_cols), pd.DataFrame(sl_values, columns=sl_cols)], axis=1)
+    return table_df
+
+
+def melt_rel_sl_links(dependency_mapper_output_df, long_tbl_sl_links_df):
+    """ the strongLinks and softLinks columns as they were joined by a groupby of the melted links """
+    def join_links(link_relevancy, col):
+        links_df = long_tbl_sl_links_df[long_tbl_sl_links_df['link_relevancy'] == link_relevancy]
+        return links_df.groupby('ID').agg({'sl_document': lambda x: "<br>".join(x)}).reset_index()\
+            .rename(columns={'sl_document': col})
+
+    links_df = pd.merge(join_links(1, 'strongLinks'), join_links(0.5, 'softLinks'), on='ID', how='outer').fillna('')
+    final_output_df = pd.merge(dependency_mapper_output_df, links_df, on='ID', how='left')
+    final_output_df[['strongLinks', 'softLinks']] = final_output_df[['strongLinks', 'softLinks']].fillna('')
+    return final_output_df
+
+
+def melt_final_df_for_viz(dependency_mapper_output_df, long_tbl_sl_links_df):
+    """ the viz dataframe as it was merged with the melted links """
+    cols = [col for col in dependency_mapper_output_df.columns if col[:3] != 'SL']
+    viz_df = pd.merge(dependency_mapper_output_df[cols], long_tbl_sl_links_df, on='ID', how='left')
+    viz_df = viz_df.dropna(axis=0, subset=['sl_document', 'link_relevancy'])
+    return viz_df.loc[viz_df['rel_model_pred'] >= 0.5]
+
+
+def test_sl_links_are_the_non_zero_values_of_the_melt(table_df):
+    long_tbl_sl_links_df = utils.get_long_tbl_sl_links_df(table_df)
+
+    melt_df = melt_sl_links_df(table_df)
+    melt_df = melt_df.loc[melt_df['link_relevancy'].notna() & (melt_df['link_relevancy'] != 0)]
+    assert len(long_tbl_sl_links_df) > 0
+    pd.testing.assert_frame_equal(
+        long_tbl_sl_links_df.sort_values(['ID', 'sl_document'], ignore_index=True),
+        melt_df[['ID', 'sl_document', 'link_relevancy']].sort_values(['ID', 'sl_document'], ignore_index=True)
+        .astype({'link_relevancy': 'float32'}))
+    # the links of a change are next to each other, in the order of the rows (see join_sl_links)
+    assert long_tbl_sl_links_df['ID'].is_monotonic_increasing
+
+
+def test_datasets_built_from_the_sl_links_are_the_same_as_from_the_melt(table_df):
+    long_tbl_sl_links_df = utils.get_long_tbl_sl_links_df(table_df)
+    melt_df = melt_sl_links_df(table_df)
+
+    final_output_df = utils.get_rel_sl_links(table_df, long_tbl_sl_links_df)
+    melt_final_output_df = melt_rel_sl_links(table_df, melt_df)
+    pd.testing.assert_frame_equal(final_output_df[['ID', 'strongLinks', 'softLinks']],
+                                  melt_final_output_df[['ID', 'strongLinks', 'softLinks']])
+    assert (final_output_df['strongLinks'] != '').any() and (final_output_df['softLinks'] != '').any()
+
+    # the viz dataframe does not hold the 0 values of the melt any more
+    viz_df = utils.get_final_df_for_viz(table_df, long_tbl_sl_links_df)
+    melt_viz_df = melt_final_df_for_viz(table_df, melt_df)
+    melt_viz_df = melt_viz_df.loc[melt_viz_df['link_relevancy'] != 0, viz_df.columns]
+    pd.testing.assert_frame_equal(viz_df.reset_index(drop=True),
+                                  melt_viz_df.reset_index(drop=True).astype({'link_relevancy': 'float32'}))
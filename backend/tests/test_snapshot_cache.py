@@ -0,0 +1,55 @@
+import os
+import numpy as np
+import pytest
+import snapshot_cache
+from data_manager import DataManager
+from synthetic_data import SyntheticDataSource
+
+QUERIES = ['radiation', 'dose limit', '"dose limit"', 'waste "the licensee shall"', 'inspection "storage facility"',
+           'no such word']
+
+
+@pytest.fixture(scope='module')
+def snapshot():
+    """ returns a snapshot of synthetic data whose search index has a segment added by a delta refresh """
+    snapshot = DataManager(data_source=SyntheticDataSource(3000)).snapshot
+    changed_rows_df = snapshot.final_output_df.iloc[:50].assign(changeText='the licensee shall report the dose limit')
+    snapshot.search_index = snapshot.search_index.with_changed_rows(changed_rows_df, changed_rows_df['ID'])
+    return snapshot
+
+
+@pytest.mark.skipif(snapshot_cache.feather is None, reason="the snapshot cache needs pyarrow")
+def test_search_index_is_loaded_with_the_snapshot(snapshot, tmp_path):
+    assert snapshot_cache.save_snapshot(snapshot, str(tmp_path))
+    loaded = snapshot_cache.load_snapshot(str(tmp_path))
+
+    # the index is read from the cache, not built again
+    stats = loaded.search_index.stats()
+    assert 'build_seconds' not in stats and stats['load_seconds'] >= 0
+    assert {key: value for key, value in stats.items() if key != 'load_seconds'} == \
+        {key: value for key, value in snapshot.search_index.stats().items() if key != 'build_seconds'}
+
+    for query in QUERIES:
+        ids, scores = snapshot.search_index.search(query)
+        loaded_ids, loaded_scores = loaded.search_index.search(query)
+        assert np.array_equal(ids, loaded_ids) and np.allclose(scores, loaded_scores), query
+
+        rows_df, scores, num_results = snapshot.search(query, limit=20)
+        loaded_rows_df, loaded_scores, loaded_num_results = loaded.search(query, limit=20)
+        assert num_results == loaded_num_results
+        assert rows_df['ID'].tolist() == loaded_rows_df['ID'].tolist()
+
+
+@pytest.mark.skipif(snapshot_cache.feather is None, reason="the snapshot cache needs pyarrow")
+def test_previous_snapshot_is_kept_until_two_generations_old(snapshot, tmp_path):
+    names = []
+    for _ in range(3):
+        assert snapshot_cache.save_snapshot(snapshot, str(tmp_path))
+        names.append(snapshot_cache.get_current_snapshot_name(str(tmp_path)))
+        # the current and previous snapshots are on disk, a process that read CURRENT before it was replaced can
+        # still load the previous one
+        assert sorted(entry for entry in os.listdir(tmp_path) if entry.startswith('snapshot_')) == sorted(names[-2:])
+
+    assert len(set(names)) == 3
+    previous_dir = os.path.join(str(tmp_path), names[-2])
+    assert os.path.exists(os.path.join(previous_dir, snapshot_cache.META_FILE))
@@ -0,0 +1,122 @@
+import functools
+import sqlite3
+import threading
+import time
+import pytest
+from sql_pool import ConnectionPool, PoolTimeoutError
+
+
+@pytest.fixture
+def connect(tmp_path):
+    """ returns a function opening a connection to a local sqlite database, a stand-in for the sql server """
+    path = str(tmp_path / 'pool.db')
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE rows (id INTEGER)")
+    # the connections are shared between threads by the pool
+    return functools.partial(sqlite3.connect, path, check_same_thread=False)
+
+
+def test_connections_are_reused(connect):
+    pool = ConnectionPool(connect, size=2)
+    with pool.connection() as conn:
+        first_conn = conn
+    with pool.connection() as conn:
+        assert conn is first_conn
+
+    stats = pool.stats()
+    assert (stats['checkouts'], stats['created'], stats['reused']) == (2, 1, 1)
+    assert (stats['open_connections'], stats['idle_connections']) == (1, 1)
+
+
+def test_checkout_waits_for_a_free_connection_when_the_pool_is_full(connect):
+    pool = ConnectionPool(connect, size=1, checkout_timeout=5)
+    checked_out = []
+
+    def checkout():
+        with pool.connection() as conn:
+            checked_out.append(conn)
+
+    with pool.connection() as conn:
+        thread = threading.Thread(target=checkout)
+        thread.start()
+        time.sleep(0.1)
+        # the pool never opens more than size connections, the thread waits for this one to be returned
+        assert checked_out == []
+        assert pool.stats()['open_connections'] == 1
+    thread.join(timeout=5)
+
+    assert checked_out == [conn]
+    stats = pool.stats()
+    assert (stats['created'], stats['waits'], stats['timeouts']) == (1, 1, 0)
+    assert stats['wait_seconds'] > 0
+
+
+def test_checkout_times_out_when_no_connection_is_returned(connect):
+    pool = ConnectionPool(connect, size=1, checkout_timeout=0.05)
+    with pool.connection():
+        with pytest.raises(PoolTimeoutError):
+            with pool.connection():
+                pass
+
+    stats = pool.stats()
+    assert (stats['waits'], stats['timeouts'], stats['open_connections']) == (1, 1, 1)
+
+
+def test_connection_failing_validation_is_replaced(connect):
+    pool = ConnectionPool(connect, size=1)
+    with pool.connection() as conn:
+        broken_conn = conn
+    # SELECT 1 fails on the idle connection when it is checked out again
+    broken_conn.close()
+
+    with pool.connection() as conn:
+        assert conn is not broken_conn
+        assert conn.execute("SELECT 1").fetchall() == [(1,)]
+
+    stats = pool.stats()
+    assert (stats['failed_validation'], stats['created'], stats['reused']) == (1, 2, 0)
+    assert stats['open_connections'] == 1
+
+
+def test_idle_connection_is_recycled(connect):
+    pool = ConnectionPool(connect, size=1, max_idle_seconds=0.05)
+    with pool.connection() as conn:
+        idle_conn = conn
+    time.sleep(0.1)
+
+    with pool.connection() as conn:
+        assert conn is not idle_conn
+    # the recycled connection is closed
+    with pytest.raises(sqlite3.ProgrammingError):
+        idle_conn.execute("SELECT 1")
+
+    stats = pool.stats()
+    assert (stats['recycled_idle'], stats['created'], stats['open_connections']) == (1, 2, 1)
+
+
+def test_returned_connection_is_rolled_back(connect):
+    pool = ConnectionPool(connect, size=1)
+    with pool.connection() as conn:
+        conn.execute("INSERT INTO rows VALUES (1)")
+        # the insert is not committed
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM rows").fetchall() == [(0,)]
+
+    with pool.connection() as conn:
+        conn.execute("INSERT INTO rows VALUES (2)")
+        conn.commit()
+    with connect() as conn:
+        assert conn.execute("SELECT id FROM rows").fetchall() == [(2,)]
+
+
+def test_connection_is_discarded_when_the_block_raises(connect):
+    pool = ConnectionPool(connect, size=1)
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            failed_conn = conn
+            raise ValueError
+
+    with pool.connection() as conn:
+        assert conn is not failed_conn
+    stats = pool.stats()
+    assert (stats['discarded'], stats['created'], stats['open_connections']) == (1, 2, 1)
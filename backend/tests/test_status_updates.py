@@ -0,0 +1,29 @@
+import pandas as pd
+import utils
+
+
+def get_change_rows_df():
+    return pd.DataFrame({'ID': [1, 2, 3],
+                         'status': pd.Series(['not started', 'reviewed', 'addressed'], dtype=utils.STATUS_DTYPE)})
+
+
+def test_status_updates_of_the_submitted_rows():
+    results = [{'id': '1', 'value': 'Reviewed'}, {'id': '2', 'value': 'Reviewed'}, {'id': '3', 'value': 'Not Started'}]
+    db_updates, df_updates = utils.update_status_on_submit(results, get_change_rows_df())
+
+    # row 2 is already reviewed
+    assert [(row_id, {col: value for col, value in changes.items() if col != 'lastSubmit'})
+            for row_id, changes in db_updates] == [(1, {'reviewed': True, 'addressed': False}),
+                                                   (3, {'addressed': False, 'reviewed': False})]
+    assert [(row_id, col, value) for row_id, col, value in df_updates if col == 'status'] == \
+        [(1, 'status', 'reviewed'), (3, 'status', 'not started')]
+
+
+def test_unknown_ids_are_skipped():
+    # rows 4 and 5 have been removed by a refresh since the page was loaded
+    results = [{'id': '4', 'value': 'Reviewed'}, {'id': '1', 'value': 'Addressed'},
+               {'id': '5', 'value': 'Not Relevant'}]
+    db_updates, df_updates = utils.update_status_on_submit(results, get_change_rows_df())
+
+    assert [row_id for row_id, _ in db_updates] == [1]
+    assert {row_id for row_id, _, _ in df_updates} == {1}
@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+import utils
+from data_manager import DataManager
+from synthetic_data import make_dependency_mapper_output
+
+
+@pytest.fixture(scope='module')
+def table_df():
+    """ returns synthetic rows of the sql table with the values the transform cleans """
+    table_df = make_dependency_mapper_output(1500, seed=3)
+    table_df.loc[:9, 'documentName'] = None
+    table_df.loc[10:19, 'documentName'] = 'Technical Guide.2 Rev3 2021-04-05'
+    table_df.loc[20:29, 'documentType'] = ' non-gov '
+    table_df.loc[30:39, 'rel_model_pred'] = None
+    return table_df
+
+
+def row_wise_transform(table_df):
+    """ DataManager.transform with the stages it ran with DataFrame.apply(..., axis=1) before they were vectorized """
+    df = table_df.dropna(axis=0, subset=['documentName']).copy()
+    df['documentName'] = df[['documentName']].apply(lambda x: utils.clean_documentname(x['documentName']), axis=1)
+    df['documentType'] = df['documentType'].str.strip()
+    df['revisionNumber'] = df['revisionNumber'].fillna('')
+    df['prevRevisionNumber'] = df['prevRevisionNumber'].fillna('')
+
+    df = utils.get_status(df)
+    long_tbl_sl_links_df = utils.get_long_tbl_sl_links_df(df)
+    final_output_df = utils.get_rel_sl_links(df, long_tbl_sl_links_df)
+    final_output_df['strongLinks'] = final_output_df[['rel_model_pred', 'strongLinks']].apply(
+        lambda x: "" if x['rel_model_pred'] < 0.5 else x['strongLinks'], axis=1)
+    final_output_df['softLinks'] = final_output_df[['rel_model_pred', 'softLinks']].apply(
+        lambda x: "" if x['rel_model_pred'] < 0.5 else x['softLinks'], axis=1)
+    final_output_for_viz_df = utils.get_final_df_for_viz(df, long_tbl_sl_links_df)
+
+    final_output_df, final_output_for_viz_df = utils.compact_datasets(final_output_df, final_output_for_viz_df)
+    return utils.apply_schema(final_output_df), utils.apply_schema(final_output_for_viz_df)
+
+
+def test_clean_documentnames_is_the_same_as_row_wise(table_df):
+    names = table_df['documentName'].dropna()
+
+    pd.testing.assert_series_equal(utils.clean_documentnames(names), names.apply(utils.clean_documentname))
+
+
+@pytest.mark.filterwarnings('ignore::pandas.errors.SettingWithCopyWarning')
+def test_transform_is_the_same_as_row_wise(table_df):
+    final_output_df, final_output_for_viz_df = DataManager.transform(table_df.copy())
+    expected_final_output_df, expected_final_output_for_viz_df = row_wise_transform(table_df)
+
+    pd.testing.assert_frame_equal(final_output_df, expected_final_output_df)
+    pd.testing.assert_frame_equal(final_output_for_viz_df, expected_final_output_for_viz_df)
+    # the links of the changes which are not relevant are blanked
+    not_relevant_df = final_output_df.loc[final_output_df['rel_model_pred'] < 0.5]
+    assert len(not_relevant_df) and (not_relevant_df[['strongLinks', 'softLinks']] == "").all().all()
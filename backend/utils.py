@@ -10,13 +10,28 @@ from collections import OrderedDict
 import colour_scales as funcs_cnames
 import matplotlib as mpl
 import numpy as np
-from PIL import ImageColor
 import textwrap
 import constant
 from config import BLOB_CONNECTION
 import re
+from functools import lru_cache
+from sas_url_cache import SasUrlCache
 from azure.storage.blob import generate_blob_sas, BlobSasPermissions
 from datetime import datetime, timedelta  
+try:
+    import resource
+except ImportError:
+    # not available on windows, the peak memory is then not reported
+    resource = None
+try:
+    import orjson
+except ImportError:
+    # the plots are then serialised with plotly's json encoder
+    orjson = None
+
+
+# categorical type of the status column, with all the status values the users can set
+STATUS_DTYPE = pd.CategoricalDtype([status.lower() for status in constant.STATUS])
 
 
 # Functions for formatting and cleaning input data
@@ -29,12 +44,238 @@ def clean_documentname(name):
     return newname
 
 
-def get_pdf_url_with_blob_sas_token(blob_name):
+def clean_documentnames(document_names):
+    """ removes date and revision number from a column of document names, the regexes in clean_documentname are run
+        once per unique document name instead of once per row
+
+    Args:
+        document_names (series): documentName column
+
+    Returns:
+        series: cleaned document names
+    """
+    cleaned_names = {name: clean_documentname(name) for name in document_names.unique()}
+    return document_names.map(cleaned_names)
+
+
+def get_watermark(dependency_mapper_output_df):
+    """ returns the highest ID, lastSubmit and currentRevision values of the rows read from the sql table, rows
+        added or modified after these values are picked up by the next delta refresh
+
+    Args:
+        dependency_mapper_output_df (df): dataframe read from the sql table
+
+    Returns:
+        dict: keys 'ID' (int), 'lastSubmit' and 'currentRevision' (datetime), None if the column has no values
+    """
+    watermark = {'ID': None, 'lastSubmit': None, 'currentRevision': None}
+    if dependency_mapper_output_df.empty:
+        return watermark
+
+    watermark['ID'] = int(dependency_mapper_output_df['ID'].max())
+    for col in constant.WATERMARK_DATE_COLS:
+        latest = parse_watermark_dates(dependency_mapper_output_df[col], col).max()
+        if not pd.isnull(latest):
+            watermark[col] = latest.to_pydatetime()
+
+    return watermark
+
+
+def parse_watermark_dates(dates, col):
+    """ parses the text dates of a watermark column of the sql table with the format of the column, the same way
+        the delta query compares them with the watermark (see constant.WATERMARK_DATE_COLS)
+
+    Args:
+        dates (series): text dates of the column
+        col (str): name of the column, 'lastSubmit' or 'currentRevision'
+
+    Returns:
+        series: datetime64 dates, NaT for the values which cannot be parsed
+    """
+    return pd.to_datetime(dates, dayfirst=constant.WATERMARK_DATE_COLS[col]['dayfirst'], errors='coerce')
+
+
+def merge_watermarks(watermark, delta_watermark):
+    """ returns a watermark with the highest value of each column of the two watermarks
+
+    Args:
+        watermark (dict): watermark of the rows already loaded
+        delta_watermark (dict): watermark of the new/modified rows
+
+    Returns:
+        dict: merged watermark
+    """
+    merged_watermark = {}
+    for col, value in watermark.items():
+        values = [v for v in [value, delta_watermark.get(col)] if v is not None]
+        merged_watermark[col] = max(values) if values else None
+
+    return merged_watermark
+
+
+def get_delta_query(table_name, watermark=None):
+    """ returns the query (and its parameters) to read the rows of the sql table added or modified after the
+        watermark, or the whole table if there is no watermark
+
+    Args:
+        table_name (str): name of the table which is being queried
+        watermark (dict): watermark of the rows already loaded, see get_watermark
+
+    Returns:
+        str: sql query
+        tuple: query parameters (None if the query has no parameters)
+    """
+    query = f"SELECT * FROM [dbo].[{table_name}]"
+    if watermark is None:
+        return query, None
+
+    # rows with a new ID have been inserted, rows with a later lastSubmit/currentRevision have been modified
+    conditions = []
+    params = []
+    if watermark['ID'] is not None:
+        conditions.append("ID > %d")
+        params.append(watermark['ID'])
+    # the text dates are converted with the style of their format, not with the language/DATEFORMAT of the session
+    for col, date_format in constant.WATERMARK_DATE_COLS.items():
+        if watermark[col] is not None:
+            conditions.append(f"TRY_CONVERT(datetime2, {col}, {date_format['sql_style']}) > %s")
+            params.append(watermark[col])
+
+    if not conditions:
+        return query, None
+
+    return f"{query} WHERE {' OR '.join(conditions)}", tuple(params)
+
+
+def read_sql_chunks(cursor, chunk_size=constant.SQL_FETCH_CHUNK_SIZE):
+    """ builds a dataframe from the result of an executed query by fetching the rows in chunks - each chunk of rows
+        is converted to typed columns and released before the next one is fetched, so the whole table is never held
+        as python objects at once
+
+    Args:
+        cursor: cursor (returning rows as tuples) on which the query has been executed
+        chunk_size (int): number of rows fetched per round trip
+
+    Returns:
+        df: dataframe with the rows read, the SL link columns are stored as sparse float32 columns (they only hold 0,
+            0.5 and 1 and nulls, which are read as 0)
+    """
+    columns = [col[0] for col in cursor.description]
+    sl_cols = [col for col in columns if col.startswith('SL')]
+
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        chunk_df = pd.DataFrame.from_records(rows, columns=columns)
+        del rows
+        # most SL values are null or 0, only the links are stored (see get_long_tbl_sl_links_df)
+        chunk_df[sl_cols] = chunk_df[sl_cols].astype('float32').fillna(0).astype(pd.SparseDtype('float32', 0))
+        chunks.append(chunk_df)
+
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    # a column only holding nulls in a chunk is read as object, infer the type again over all the rows
+    return pd.concat(chunks, ignore_index=True, copy=False).infer_objects()
+
+
+def get_peak_memory_mb():
+    """ returns the peak resident memory of the process in MB (None if it is not available on the platform) """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def merge_delta_rows(output_df, delta_df, changed_ids):
+    """ replaces the rows of a dataframe with the new/modified rows read by a delta refresh
+
+    Args:
+        output_df (df): dataframe with the rows already loaded
+        delta_df (df): new/modified rows formatted the same way as output_df
+        changed_ids (series): IDs of all the rows read by the delta refresh (including the ones removed while
+                              formatting, e.g. because of a null documentName)
+
+    Returns:
+        df: output_df without the old version of the changed rows, with delta_df appended
+    """
+    mask_unchanged = ~output_df['ID'].isin(changed_ids)
+    return pd.concat([output_df.loc[mask_unchanged], delta_df], ignore_index=True)
+
+
+def apply_schema(output_df):
+    """ converts the columns of a dataframe to the types defined in constant.py - revision dates are parsed to
+        datetime64 once here instead of on every request, repeated strings are stored as categoricals, the
+        relevancy values as float32 and the page numbers as int32
+
+    Args:
+        output_df (df): dataframe formatted for the app (final_output_df or final_output_for_viz_df)
+
+    Returns:
+        df: new dataframe with the typed columns, columns already of the right type are not converted again
+    """
+    dtypes = {}
+    for col in constant.CATEGORICAL_COLS:
+        if col in output_df.columns and not isinstance(output_df[col].dtype, pd.CategoricalDtype):
+            # the status categories are fixed so that any status value can be set in the status overlay
+            dtypes[col] = STATUS_DTYPE if col == 'status' else 'category'
+    for col in constant.FLOAT32_COLS:
+        if col in output_df.columns:
+            dtypes[col] = 'float32'
+    for col in constant.INT32_COLS:
+        if col in output_df.columns and pd.api.types.is_integer_dtype(output_df[col]):
+            dtypes[col] = 'int32'
+
+    parsed_cols = {col: pd.to_datetime(output_df[col], dayfirst=True) for col in constant.DATETIME_COLS
+                   if col in output_df.columns and not pd.api.types.is_datetime64_any_dtype(output_df[col])}
+
+    output_df = output_df.astype(dtypes)
+    for col, values in parsed_cols.items():
+        output_df[col] = values
+
+    return output_df
+
+
+def compact_datasets(final_output_df, final_output_for_viz_df):
+    """ drops the columns of the datasets that the app does not read, so that the snapshot only holds each value once
+
+    Args:
+        final_output_df (df): dataframe used for the Detect Changes tab
+        final_output_for_viz_df (df): dataframe used for the viz tabs, with a row per change and sl document link
+
+    Returns:
+        tuple: final_output_df without the SL document cols (the links are in strongLinks/softLinks and in the viz
+               rows) and final_output_for_viz_df with only the constant.VIZ_COLS cols (the change text of a viz row is
+               read from final_output_df, see DataSnapshot.get_change_texts)
+    """
+    final_output_df = final_output_df.drop(columns=[col for col in final_output_df.columns if col.startswith('SL')])
+    final_output_for_viz_df = final_output_for_viz_df[constant.VIZ_COLS]
+
+    return final_output_df, final_output_for_viz_df
+
+
+def get_memory_report(frames):
+    """ returns the memory used by dataframes, including the strings they hold
+
+    Args:
+        frames (dict): dataframes by name
+
+    Returns:
+        dict: MB used by each dataframe and in total
+    """
+    report = {name: round(df.memory_usage(deep=True).sum() / 1024 ** 2, 1) for name, df in frames.items()}
+    report['total'] = round(sum(report.values()), 1)
+    return report
+
+
+def get_pdf_url_with_blob_sas_token(blob_name, expiry=None):
     """ get url to to a pdf by generating a SAS token using credentials
 
     Args:
         blob_name: name of file in blob storage to use. Note that this file MUST be the relative path of the file, to
                    the contained defined in config.CONTAINER_NAME
+        expiry: (datetime) utc expiry of the token, in an hour by default
 
     Returns:
 
@@ -45,7 +286,7 @@ def get_pdf_url_with_blob_sas_token(blob_name):
                                        account_key=BLOB_CONNECTION["ACCOUNT_KEY"],
                                        content_type="application/pdf",
                                        permission=BlobSasPermissions(read=True),
-                                       expiry=datetime.utcnow() + timedelta(hours=1)
+                                       expiry=expiry or datetime.utcnow() + timedelta(hours=1)
                                        )
 
     blob_url_with_blob_sas_token = f"https://{BLOB_CONNECTION['ACCOUNT_NAME']}.blob.core.windows.net/" \
@@ -54,40 +295,110 @@ def get_pdf_url_with_blob_sas_token(blob_name):
     return blob_url_with_blob_sas_token
 
 
+# urls of the pdfs shown in the pdf viewer, a token is reused until it is close to expiry
+pdf_url_cache = SasUrlCache(get_pdf_url_with_blob_sas_token,
+                            lifetime=timedelta(minutes=constant.SAS_TOKEN_LIFETIME_MINUTES),
+                            refresh_margin=timedelta(minutes=constant.SAS_TOKEN_REFRESH_MARGIN_MINUTES))
+
+
+def get_doc_revisions(output_df, doc_partitions):
+    """returns the latest revision of each document for the pdf viewer, computed once when the data is refreshed
+       instead of on every request of the Detect Changes tab
+
+    Args:
+        output_df (df): final dataframe used for different pages on app
+        doc_partitions (dict): positions of the rows of each document in output_df, see get_doc_partitions
+
+    Returns:
+        dict: keys as (doc type key, document name), values as dict with the current and previous revision dates and
+              numbers and the blob paths of their pdfs (documents without a revision date are left out)
+    """
+    rev_dates = output_df['currentRevision'].to_numpy(dtype='datetime64[ns]')
+    previous_revs = output_df['previousRevision'].to_numpy()
+    rev_numbers = output_df['revisionNumber'].to_numpy()
+    prev_rev_numbers = output_df['prevRevisionNumber'].to_numpy()
+
+    doc_revisions = {}
+    for (doc_type_key, docs), positions in doc_partitions.items():
+        doc_rev_dates = rev_dates[positions]
+        mask_dated = ~np.isnat(doc_rev_dates)
+        if not mask_dated.any():
+            continue
+        # first row of the document (in the order of output_df) revised on the latest currentRevision date
+        current_rev = doc_rev_dates[mask_dated].max()
+        position = positions[np.argmax(doc_rev_dates == current_rev)]
+
+        current_rev1 = pd.Timestamp(current_rev).strftime(constant.DT_FORMAT)
+        previous_rev1 = previous_revs[position]
+        current_rev_number = rev_numbers[position]
+        prev_rev_number = prev_rev_numbers[position].strip()
+
+        # join the name of the document and date for gov docs and name of document, revision number and date for
+        # nongov docs
+        if doc_type_key == 'gov':
+            current_rev_pdf = ' '.join([str(docs), current_rev1])
+            previous_rev_pdf = ' '.join([str(docs), str(previous_rev1)])
+            folder = BLOB_CONNECTION["GOV_MOUNT_PATH"]
+        else:
+            current_rev_pdf = ' '.join([str(docs), str(current_rev_number), current_rev1])
+            previous_rev_pdf = ' '.join([str(docs), prev_rev_number, str(previous_rev1)])
+            folder = BLOB_CONNECTION["NONGOV_MOUNT_PATH"]
+
+        doc_revisions[(doc_type_key, docs)] = {
+            'current_rev': current_rev1, 'previous_rev': previous_rev1,
+            'current_rev_number': current_rev_number, 'prev_rev_number': prev_rev_number,
+            'current_rev_blob': os.path.join(folder, ''.join([current_rev_pdf, '.pdf'])),
+            'previous_rev_blob': os.path.join(folder, ''.join([previous_rev_pdf, '.pdf']))}
+
+    return doc_revisions
+
+
 def get_long_tbl_sl_links_df(dependency_mapper_output_df):
-    """ get all the cols starting with 'SL' from the main df and change it to a long format resulting in the
-        following cols - ('ID', 'sl_document', 'link_relevancy')
+    """ get the links from the cols starting with 'SL' of the main df as a long (COO) table with the following cols -
+        ('ID', 'sl_document', 'link_relevancy'), one row per non-zero link value
+
+    The non-zero values are read column by column (straight from the stored values of the sparse SL columns, see
+    read_sql_chunks), so the table is built in a time proportional to the number of links instead of transposing and
+    unstacking the whole wide slice of SL columns.
 
     Args:
         dependency_mapper_output_df (df): dataframe read from the sql table
 
     Returns:
-        df : dataframe with the following cols - ('ID', 'sl_document', 'link_relevancy')
+        df : dataframe with the following cols - ('ID', 'sl_document', 'link_relevancy'), sorted by the position of the
+             change in the main df, then by the order of the SL cols
     """
-
     # get all the columns starting with 'SL' (SL document cols)
-    sliced_change_links_df = dependency_mapper_output_df.loc[:, dependency_mapper_output_df.columns.str.startswith('SL')]
-    # change data type to float
-    sliced_change_links_df = sliced_change_links_df.astype(float)
-    # get the ID column
-    sliced_change_links_df['ID'] = dependency_mapper_output_df[['ID']]
-    # set the ID (row id) as the sliced df index
-    sliced_change_links_df.set_index('ID', inplace=True)
-    # drop all NaN rows
-    sliced_change_links_df.dropna(how='all', inplace=True)
-    # drop rows with 0 relevancy for all SL docs as they are non-relevant links
-    sliced_change_links_df = sliced_change_links_df[(sliced_change_links_df.T != 0).any()]
-    # convert to a long table of sl docs and link value
-    long_tbl_sl_links_df = sliced_change_links_df.unstack().reset_index()
-    # rename col names to readable ones
-    long_tbl_sl_links_df.rename(columns={"level_1": "ID", "level_0": "sl_document", 0: "link_relevancy"}, inplace=True)
+    sl_cols = [col for col in dependency_mapper_output_df.columns if col.startswith('SL')]
+
+    # positions of the rows, index of the SL col and value of each non-zero link (nulls are not links)
+    row_positions, col_indexes, link_values = [], [], []
+    for col_index, col in enumerate(sl_cols):
+        values = dependency_mapper_output_df[col].array
+        if isinstance(values, pd.arrays.SparseArray) and values.fill_value == 0:
+            positions, values = values.sp_index.indices, values.sp_values.astype('float32')
+        else:
+            values = np.asarray(values, dtype='float32')
+            positions = np.flatnonzero(values)
+            values = values[positions]
+        mask_links = (values != 0) & ~np.isnan(values)
+        row_positions.append(positions[mask_links])
+        col_indexes.append(np.full(mask_links.sum(), col_index, dtype='int32'))
+        link_values.append(values[mask_links])
+
+    row_positions = np.concatenate(row_positions) if sl_cols else np.array([], dtype='int64')
+    col_indexes = np.concatenate(col_indexes) if sl_cols else np.array([], dtype='int32')
+    link_values = np.concatenate(link_values) if sl_cols else np.array([], dtype='float32')
+    order = np.lexsort((col_indexes, row_positions))
+
     # change the _ to . and insert a space after the first 3 characters for the document names to show the
     # actual file names (e.g: from SLM_1_05_03 to SLM 1.05.03)
-    long_tbl_sl_links_df['sl_document'] = long_tbl_sl_links_df['sl_document'].str.replace('_', '.')
-    long_tbl_sl_links_df['sl_document'] = long_tbl_sl_links_df['sl_document'].str[:3] + ' ' \
-                                          + long_tbl_sl_links_df['sl_document'].str[4:]
+    sl_doc_names = np.array([col.replace('_', '.')[:3] + ' ' + col.replace('_', '.')[4:] for col in sl_cols],
+                            dtype=object)
 
-    return long_tbl_sl_links_df
+    return pd.DataFrame({'ID': dependency_mapper_output_df['ID'].to_numpy()[row_positions[order]],
+                         'sl_document': sl_doc_names[col_indexes[order]],
+                         'link_relevancy': link_values[order]})
 
 
 def get_rel_sl_links(dependency_mapper_output_df, long_tbl_sl_links_df):
@@ -97,38 +408,47 @@ def get_rel_sl_links(dependency_mapper_output_df, long_tbl_sl_links_df):
 
     Args:
         dependency_mapper_output_df (df): dataframe read from the sql table
-        long_tbl_sl_links_df (df):        dataframe sliced from the main df and converted to a long format with the
-                                          following cols - ('ID', 'sl_document', 'link_relevancy')
+        long_tbl_sl_links_df (df):        long table of the links of the main df with the following cols - ('ID',
+                                          'sl_document', 'link_relevancy'), see get_long_tbl_sl_links_df
 
     Returns:
         df: new dataframe with all cols from the main df and updated with additional col 'strongLinks' and 'softLinks'
     """
-    # group by the ID and join the relevant SL doc names with a line break as they are
-    # to be displayed on new lines in the UI col
-    mask_relevant_links = long_tbl_sl_links_df['link_relevancy'] == 1
-    grouped_strong_links_df = long_tbl_sl_links_df[mask_relevant_links].groupby('ID')\
-        .agg({'sl_document': lambda x: "<br>".join(x)}).reset_index()
+    # join the relevant (1) and maybe relevant (0.5) SL doc names of each change with a line break as they are to be
+    # displayed on new lines in the UI col
+    strong_links = join_sl_links(long_tbl_sl_links_df.loc[long_tbl_sl_links_df['link_relevancy'] == 1])
+    soft_links = join_sl_links(long_tbl_sl_links_df.loc[long_tbl_sl_links_df['link_relevancy'] == 0.5])
+
+    # add the cols to a copy of the original dataframe, with empty strings for the changes without links
+    final_output_df = dependency_mapper_output_df.reset_index(drop=True)
+    final_output_df['strongLinks'] = final_output_df['ID'].map(strong_links).fillna('')
+    final_output_df['softLinks'] = final_output_df['ID'].map(soft_links).fillna('')
+
+    return final_output_df
 
-    grouped_strong_links_df.rename(columns={"sl_document": "strongLinks"}, inplace=True)
 
-    # group by the ID and join the maybe relevant SL doc names with a line break as they are
-    # to be displayed on new lines in the UI col
-    mask_maybe_relevant_links = long_tbl_sl_links_df['link_relevancy'] == 0.5
-    grouped_soft_links_df = long_tbl_sl_links_df[mask_maybe_relevant_links].groupby('ID')\
-        .agg({'sl_document': lambda x: "<br>".join(x)}).reset_index()
+def join_sl_links(links_df):
+    """ joins the SL doc names of the links of each change with a <br> tag
 
-    grouped_soft_links_df.rename(columns={"sl_document": "softLinks"}, inplace=True)
-    merged_strong_soft_links_df = pd.merge(grouped_strong_links_df, grouped_soft_links_df, on='ID', how='outer')
-    merged_strong_soft_links_df.fillna('', inplace=True)
+    Args:
+        links_df (df): links with the following cols - ('ID', 'sl_document', 'link_relevancy'), with the links of a
+                       change next to each other (see get_long_tbl_sl_links_df)
 
-    # merge with the original dataframe on the ID column 
-    final_output_df = pd.merge(dependency_mapper_output_df, merged_strong_soft_links_df, on='ID', how='left')
+    Returns:
+        series: joined SL doc names indexed by ID
+    """
+    ids = links_df['ID'].to_numpy()
+    if len(ids) == 0:
+        return pd.Series([], dtype=object)
 
-    # replace the null values in sl_document col to empty strings
-    final_output_df['strongLinks'].fillna('', inplace=True)
-    final_output_df['softLinks'].fillna('', inplace=True)
+    # start of the links of each change, every link but the first one of a change is preceded by a line break
+    mask_first = np.ones(len(ids), dtype=bool)
+    mask_first[1:] = ids[1:] != ids[:-1]
+    sl_doc_names = links_df['sl_document'].to_numpy(dtype=object).copy()
+    sl_doc_names[~mask_first] = '<br>' + sl_doc_names[~mask_first]
 
-    return final_output_df
+    starts = np.flatnonzero(mask_first)
+    return pd.Series(np.add.reduceat(sl_doc_names, starts), index=ids[starts])
 
 
 def get_final_df_for_viz(dependency_mapper_output_df, long_tbl_sl_links_df):
@@ -144,7 +464,7 @@ def get_final_df_for_viz(dependency_mapper_output_df, long_tbl_sl_links_df):
         df: slice of the main dataframe merged with the long_tbl_sl_links_df
     """
     # select all col names except ones starting with 'SL'
-    cols = [col for col in dependency_mapper_output_df.columns if col[:3] != 'SL']
+    cols = [col for col in dependency_mapper_output_df.columns if not col.startswith('SL')]
 
     # get all column values except ones starting with 'SL'
     slice_output_for_plots = dependency_mapper_output_df[cols]
@@ -193,9 +513,10 @@ def get_status(dependency_mapper_output_df):
     return dependency_mapper_output_df
 
 
+@lru_cache(maxsize=constant.CHANGE_CONTEXT_CACHE_SIZE)
 def create_context(change, previous, after):
-    """creating new column, 'change_context' where the previous and the next paragraph values are concatenated
-       with the change text
+    """the previous and the next paragraph values concatenated with the change text, as shown in the detailed table
+       (change_context col), only rendered for the rows of the page returned and cached for the rows shown again
 
     Args:
         change (str): changeText column value of the final_output_df
@@ -203,7 +524,7 @@ def create_context(change, previous, after):
         after (str): nextParagraph column value of the final_output_df
 
     Returns:
-        str: new value for the change_context column where values from previousParagraph and nextParagraph are
+        str: value for the change_context column where values from previousParagraph and nextParagraph are
              concatenated to the changeText
     """
     new_text = '<strong><i>Previous:</i></strong><br>' + str(previous) + '<br><br><strong>Change:</strong><br>' \
@@ -241,120 +562,103 @@ def get_nongov_df(output_df):
     return nongov_df
 
 
-def get_unique_file_names(df):
-    """
-    returns unique file names from the input dataframe
+def get_doc_type_key(doc_type):
+    """returns the key used to index the rows of a document type ('gov' or 'non-gov') for the document type selected
+       by the user
 
-    :param 
-    df: (dataframe) - name of the dataframe
+    Args:
+        doc_type (string): document type selected from the dropdown (Legislation/Guidance)
 
-    :return: (list) - unique document names
+    Returns:
+        string: 'gov' for Legislation, else 'non-gov'
     """
-    return list(set(df.documentName))
+    return 'gov' if doc_type.lower() == 'legislation' else 'non-gov'
 
 
-# Calc stats for landing page
-# ----------------------------------------------------
-def get_recent_changes_stats(final_output_df):
-    """returns a dictionary with stats of most recent changes to be displayed on the landing page
+def get_doc_partitions(output_df):
+    """indexes the rows of each document so that the routes only need to read the rows of the selected document
 
     Args:
-        final_output_df: (dataframe) - the dataframe with all change and SL link details
+        output_df (df): final dataframe used for different pages on app
 
     Returns:
-        list of dictionaries with details for top 3 new change stats (doc name, revision date, rel/maybe rel/not rel)
+        dict: keys as (doc type key ('gov'/'non-gov'), document name), values as array of the positions of the rows of
+              the document in output_df
     """
-    stats_df = final_output_df.copy()
-    # change the currentRevision col type to datetime and sort in descending order
-    stats_df['currentRevision'] = pd.to_datetime(stats_df["currentRevision"], dayfirst=True)
-
-    stats_df.sort_values(by='currentRevision', ascending=False, inplace=True)
+    doc_partitions = {}
+    for doc_type_key, prefix in [('gov', 'gov'), ('non-gov', 'non')]:
+        # positions of the rows of the doc type, see get_gov_df and get_nongov_df
+        positions = np.flatnonzero(output_df['documentType'].str.startswith(prefix).to_numpy(dtype=bool))
+        doc_names = output_df['documentName'].to_numpy()[positions]
+        for doc_name, doc_positions in pd.Series(positions).groupby(doc_names, sort=False).indices.items():
+            doc_partitions[(doc_type_key, doc_name)] = positions[doc_positions]
 
-    # get the stats (relevant, not relevant, maybe relevant) for latest 3 docs
-    top_docs_stats = []
-    for _ in range(3):
-        # filter df on latest date of current revision
-        mask = stats_df['currentRevision'] == max(stats_df['currentRevision'])
-        top_doc_df = stats_df[mask]
+    return doc_partitions
 
-        # get the document name and revision date
-        doc = top_doc_df['documentName'].iloc[0]
-        rev_date = top_doc_df['currentRevision'].iloc[0]
-        rev_formatted_date = rev_date.strftime('%d/%m/%Y')
 
-        # get the count of rel (1.0)/maybe rel (0.5)/not rel (0.0) by reading the 'rel_model_pred' column
-        not_relevant = (top_doc_df['rel_model_pred'] == 0).sum()
-        maybe_relevant = (top_doc_df['rel_model_pred'] == 0.5).sum()
-        relevant = (top_doc_df['rel_model_pred'] == 1).sum()
+def get_unique_file_names(df):
+    """
+    returns unique file names from the input dataframe
 
-        # append the data in the form of a dictionary for each doc in the list
-        top_docs_stats.append(
-            {
-                'doc': doc,
-                'rev_date': rev_date,
-                'rev_formatted_date': rev_formatted_date,
-                'not_relevant': not_relevant,
-                'maybe_relevant': maybe_relevant,
-                'relevant': relevant
-            }
-        )
-        # removing the doc for which the stats have been read
-        stats_df = stats_df.drop(stats_df[mask].index)
+    :param 
+    df: (dataframe) - name of the dataframe
 
-    return top_docs_stats
+    :return: (list) - unique document names
+    """
+    return list(set(df.documentName))
 
 
-def get_backlog_stats(final_output_df):
-    """ returns a dictionary with stats of the current backlog (addressed/reviewed/not started)
+# Calc stats for landing page
+# ----------------------------------------------------
+def get_recent_changes_stats(final_output_df, n_docs=constant.MAX_TOP_DOCS):
+    """returns a dictionary with stats of most recent changes to be displayed on the landing page
 
     Args:
-        final_output_df: final_output_df: (dataframe) - the dataframe with all change and SL link details
+        final_output_df: (dataframe) - the dataframe with all change and SL link details
+        n_docs: (int) - number of documents to return
 
-    Returns: dictionary with count of addressed/reviewed/not started changes
+    Returns:
+        list of dictionaries with details for top n_docs new change stats (doc name, revision date, rel/maybe rel/not
+        rel), most recent revision first (documents revised on the same date are sorted by name)
     """
-    # filter df on a start date from constant.py to calculate the backlog stats
-    start_dt_for_backlog_stats = datetime.strptime(constant.START_DT_FOR_BACKLOG_STATS, '%d/%m/%Y')
-
-    mask_start_dt = pd.to_datetime(final_output_df['currentRevision'], dayfirst=True) >= start_dt_for_backlog_stats
-    final_output_df = final_output_df.loc[mask_start_dt]
-
-    not_started = (final_output_df['status'].str.lower() == 'not started').sum()
-    reviewed = (final_output_df['status'].str.lower() == 'reviewed').sum()
-    addressed = (final_output_df['status'].str.lower() == 'addressed').sum() 
-    
-    reviewed_stats = {
-                    'not started': not_started,
-                    'reviewed': reviewed,
-                    'addressed': addressed
-                }
-    return reviewed_stats
+    # count the rel (1.0)/maybe rel (0.5)/not rel (0.0) changes of each (document, revision date) in a single groupby
+    rel_model_pred = final_output_df['rel_model_pred'].to_numpy()
+    stats_df = pd.DataFrame({'documentName': final_output_df['documentName'],
+                             'currentRevision': final_output_df['currentRevision'],
+                             'not_relevant': rel_model_pred == 0,
+                             'maybe_relevant': rel_model_pred == 0.5,
+                             'relevant': rel_model_pred == 1})
+    stats_df = stats_df.groupby(['documentName', 'currentRevision'], observed=True, sort=False).sum().reset_index()\
+        .astype({'documentName': str})
+
+    # keep the n_docs latest revisions (with the ties of the last one) before sorting them
+    stats_df = stats_df.nlargest(n_docs, 'currentRevision', keep='all')\
+        .sort_values(['currentRevision', 'documentName'], ascending=[False, True]).head(n_docs)
+
+    return [{'doc': str(doc),
+             'rev_date': rev_date,
+             'rev_formatted_date': rev_date.strftime('%d/%m/%Y'),
+             'not_relevant': int(not_relevant),
+             'maybe_relevant': int(maybe_relevant),
+             'relevant': int(relevant)}
+            for doc, rev_date, not_relevant, maybe_relevant, relevant
+            in stats_df[['documentName', 'currentRevision', 'not_relevant', 'maybe_relevant', 'relevant']]
+            .itertuples(index=False)]
 
 
 # Functions for routes
 # -----------------------------------------
-def get_docs_by_name_and_recency(doc_type, docs, recency, final_output_df):
-    """filters the dataframe based on document type, document and recency value selected by the user
+def get_docs_by_recency(recency, doc_df):
+    """filters the rows of a document based on the recency value selected by the user
     Args:
-        doc_type (string): document type
-        docs (string): document name
         recency (string): recency period
-        final_output_df (df): dataframe used for the Detect Changes tab
+        doc_df (df): rows of the document selected by the user (see DataSnapshot.get_doc_df)
     Returns:
-        (df): dataframe filtered by document type and recency
+        (df): rows of the document filtered by recency
     """
     # if recency is historical, get the date before 2 years
     _, historical = get_recency_historical(recency)
 
-    # filtering as per the selected document name and with current revision within the recency period
-    if doc_type.lower() == 'legislation':
-        doc_type_df = get_gov_df(final_output_df)
-    else:
-        doc_type_df = get_nongov_df(final_output_df)
-
-    temp_df = doc_type_df.copy()
-    temp_df['currentRevision'] = pd.to_datetime(temp_df['currentRevision'],  dayfirst=True)
-
-    doc_df = temp_df.loc[temp_df.documentName == docs]
     if not historical:
         # convert the recency period (1 month, 2 years, etc) into a date
         recency_date = get_recency_date(recency)
@@ -363,31 +667,33 @@ def get_docs_by_name_and_recency(doc_type, docs, recency, final_output_df):
     return doc_df
 
 
-def get_section_options(doc_type, docs, recency, final_output_df):
-    """filters the dataframe based on values selected by the user and returns list of sections to be displayed in the
-       section dropdown
+def get_section_options(recency, doc_df):
+    """filters the rows of a document based on values selected by the user and returns list of sections to be
+       displayed in the section dropdown
 
     Args:
-        doc_type (string): document type
-        docs (string): document name
         recency (string): recency period
-        final_output_df (df): dataframe used for the Detect Changes tab
+        doc_df (df): rows of the document selected by the user (see DataSnapshot.get_doc_df)
 
     Returns:
         (dict): dictionary with keys as section numbers and values as section titles
     """
-    # get the dataframe filtered by doc type, doc name and recency
-    doc_df = get_docs_by_name_and_recency(doc_type, docs, recency, final_output_df)
+    # get the rows of the document filtered by recency
+    recency_doc_df = get_docs_by_recency(recency, doc_df)
 
     # get the page number and section title from the filtered dataframe
-    sections = get_sections(doc_df)
+    sections = get_sections(recency_doc_df)
 
     return sections
 
 
-def get_doc_changes(doc_type, docs, recency, section, rel_type, final_output_df):
-    """filters the dataframe based on values selected by the user and returns  the change details/key metrics/pdf
-       viewer values for the Detect Changes tab
+def get_doc_changes(doc_type, docs, recency, section, rel_type, doc_df, status_overlay=None, offset=0, limit=None,
+                    cursor=None, sort=None, order='desc', doc_revision=None):
+    """filters the rows of a document based on values selected by the user and returns  the change details/key
+       metrics/pdf viewer values for the Detect Changes tab
+
+       The detailed table can be returned a page at a time (see get_detail_page), the key metrics are always the ones
+       of the full selection.
 
     Args:
         doc_type (string): document type
@@ -395,25 +701,22 @@ def get_doc_changes(doc_type, docs, recency, section, rel_type, final_output_df)
         recency (string): recency period
         section: section title
         rel_type: change relevance 
-        final_output_df (df): dataframe used for the Detect Changes tab
+        doc_df (df): rows of the document selected by the user (see DataSnapshot.get_doc_df)
+        status_overlay (dict): status changes saved since the data was read from the sql db, see apply_status_overlay
+        offset, limit, cursor, sort, order: page of the detailed table, see get_detail_page
+        doc_revision (dict): latest revision of the document (see get_doc_revisions), computed from doc_df if None -
+                             the pdf viewer values are None for a document without a revision date
 
     Returns:
         (dict): dictionary with keys as change details/key metrics/pdf viewer details and respective values
     """
-    # get the dataframe filtered by doc type, doc name and recency
-    recency_doc_df = get_docs_by_name_and_recency(doc_type, docs, recency, final_output_df)
-
-    recency_doc_df['currentRevision'] = recency_doc_df['currentRevision'].dt.strftime(constant.DT_FORMAT)
-    recency_doc_df['currentRevision'] = recency_doc_df['currentRevision'].astype(str)
+    # get the rows of the document filtered by recency
+    recency_doc_df = get_docs_by_recency(recency, doc_df)
+    # apply the status changes saved by the users to the rows of the document
+    recency_doc_df = apply_status_overlay(recency_doc_df, status_overlay)
 
     # get the full doc for the pdf viewer
-    if doc_type.lower() == 'legislation':
-        gov_df = final_output_df.loc[final_output_df.documentType == 'gov']
-        full_doc_df = gov_df.loc[gov_df.documentName == docs]
-        
-    else:
-        nongov_df = final_output_df.loc[final_output_df.documentType == 'non-gov']
-        full_doc_df = nongov_df.loc[nongov_df.documentName == docs]
+    full_doc_df = doc_df
 
     if section != 'All':
         section_doc_df = recency_doc_df[recency_doc_df.sectionTitle == section]
@@ -422,6 +725,14 @@ def get_doc_changes(doc_type, docs, recency, section, rel_type, final_output_df)
 
     # get the details depending on the relevance value chosen by the user
     doc_df = relevance_secs(section_doc_df, rel_type)
+    num_detail_rows = len(doc_df)
+    # sort the rows and only copy and format the rows of the page returned in the detailed table
+    doc_df, next_cursor = get_detail_page(doc_df, offset, limit, cursor, sort, order)
+    doc_df = doc_df.copy()
+    doc_df['currentRevision'] = doc_df['currentRevision'].dt.strftime(constant.DT_FORMAT)
+    # the change context is not stored in the dataframe, it is rendered for the rows of the page only
+    doc_df['change_context'] = [create_context(change, previous, after) for change, previous, after
+                                in zip(doc_df['changeText'], doc_df['previousParagraph'], doc_df['nextParagraph'])]
 
     # instead of 0, 0.5 and 1, get the corresponding relevant, not relevant and
     # maybe relevant tags from constant.REL_TYPES
@@ -436,33 +747,19 @@ def get_doc_changes(doc_type, docs, recency, section, rel_type, final_output_df)
 
     # PDF Viewer
 
-    # get the latest currentRevision date for the dataframe
-    current_revs = list(set(full_doc_df.currentRevision))
-    current_rev1 = max([item[:10] for item in current_revs], key=lambda d: datetime.strptime(d, constant.DT_FORMAT))
-
-    current_rev = max([item for item in current_revs], key=lambda d: datetime.strptime(d, constant.DT_FORMAT))
-
-    # use the currentRevision date to get previousRevision date, current revision number and previous revision number
-    mask_current_revision = full_doc_df['currentRevision'] == str(current_rev)
-
-    current_rev_number = full_doc_df[mask_current_revision]['revisionNumber'].iloc[0]
-    previous_rev1 = full_doc_df[mask_current_revision].previousRevision.iloc[0]
-    prev_rev_number = full_doc_df[mask_current_revision].prevRevisionNumber.iloc[0].strip()
-
-    # join the name of the document and date for gov docs and name of document, revision number and date for nongov docs
-    if doc_type.lower() == 'legislation':
-        current_rev_pdf = ' '.join([str(docs), current_rev1])
-        previous_rev_pdf = ' '.join([str(docs), previous_rev1])
-        folder = BLOB_CONNECTION["GOV_MOUNT_PATH"]
+    # latest revision of the document, precomputed when the snapshot is built (see get_doc_revisions)
+    if doc_revision is None:
+        doc_type_key = get_doc_type_key(doc_type)
+        doc_revision = get_doc_revisions(full_doc_df, {(doc_type_key, docs): np.arange(len(full_doc_df))})\
+            .get((doc_type_key, docs))
+    if doc_revision is None:
+        # no revision date, there is no pdf to show
+        current_rev1 = previous_rev1 = current_rev_pdf = previous_rev_pdf = None
     else:
-        current_rev_pdf = ' '.join([str(docs), current_rev_number, current_rev1])
-        previous_rev_pdf = ' '.join([str(docs), prev_rev_number, previous_rev1])
-        folder = BLOB_CONNECTION["NONGOV_MOUNT_PATH"]
-
-    current_rev_pdf = ''.join([current_rev_pdf, '.pdf'])
-    current_rev_pdf = get_pdf_url_with_blob_sas_token(os.path.join(folder, current_rev_pdf))
-    previous_rev_pdf = ''.join([previous_rev_pdf, '.pdf'])
-    previous_rev_pdf = get_pdf_url_with_blob_sas_token(os.path.join(folder, previous_rev_pdf))
+        current_rev1 = doc_revision['current_rev']
+        previous_rev1 = doc_revision['previous_rev']
+        current_rev_pdf = pdf_url_cache.get(doc_revision['current_rev_blob'])
+        previous_rev_pdf = pdf_url_cache.get(doc_revision['previous_rev_blob'])
 
     # Detailed Table heading
     if section == 'all':
@@ -482,8 +779,7 @@ def get_doc_changes(doc_type, docs, recency, section, rel_type, final_output_df)
     if doc_type != 'Legislation':
         detail_df.insert(0, 'revisionNumber', doc_df['revisionNumber'])
 
-    # sort dataframe by currentRevision and ID in descending order and convert to a list of values
-    detail_df = detail_df.sort_values(by=['currentRevision', 'ID'], ascending = [False, False])
+    # convert to a list of values (the rows are already sorted, see get_detail_page)
     detail_df = detail_df.values.tolist()
 
     info = 'block'
@@ -491,22 +787,200 @@ def get_doc_changes(doc_type, docs, recency, section, rel_type, final_output_df)
     return {'doc_type': doc_type, 'num_sec_changes': num_sec_changes, 'num_tot_changes': num_tot_changes, 'info': info,
             'current_rev': current_rev1, 'previous_rev': previous_rev1, 'current_rev_pdf': current_rev_pdf,
             'previous_rev_pdf': previous_rev_pdf, 'detail_df': detail_df, 'table_heading': table_heading,
-            'num_rel_sec_changes': num_rel_sec_changes, 'status': constant.STATUS}
+            'num_rel_sec_changes': num_rel_sec_changes, 'status': constant.STATUS, 'num_detail_rows': num_detail_rows,
+            'offset': offset, 'limit': limit, 'next_cursor': next_cursor}
+
+
+def get_detail_page(doc_df, offset=0, limit=None, cursor=None, sort=None, order='desc'):
+    """ sorts the rows of the detailed table and returns the rows of a page
+
+    By default the rows are sorted by currentRevision and ID in descending order, and a page starts either at an
+    offset or after a keyset cursor (the currentRevision and ID of the last row of the previous page, returned as
+    next_cursor), which does not skip or repeat rows when rows are added between two pages. With another sort column
+    (see constant.DETAIL_SORT_COLS) the ties are sorted by ID and the pages are only selected by offset.
+
+    Args:
+        doc_df (df): rows of the detailed table
+        offset (int): number of rows skipped (after the cursor if there is one)
+        limit (int): max number of rows returned, None to return all the rows
+        cursor (str): next_cursor returned with the previous page, only with the default sort
+        sort (str): column of the detailed table the rows are sorted by, None for the default sort
+        order (str): 'asc' or 'desc'
+
+    Returns:
+        df: rows of the page
+        str: cursor of the next page (None if it is the last page or the rows are not sorted by the default sort)
+    """
+    if order not in ('asc', 'desc'):
+        raise ValueError(f"Invalid sort order: {order}")
+    if sort is not None and sort not in constant.DETAIL_SORT_COLS:
+        raise ValueError(f"Invalid sort column: {sort}")
+    if cursor is not None and sort is not None:
+        raise ValueError("A cursor can only be used with the default sort")
+    ascending = order == 'asc'
+
+    if sort is None:
+        doc_df = doc_df.sort_values(by=['currentRevision', 'ID'], ascending=[False, False])
+        if cursor is not None:
+            doc_df = doc_df.loc[get_rows_after_cursor_mask(doc_df, cursor)]
+    else:
+        doc_df = doc_df.sort_values(by=[constant.DETAIL_SORT_COLS[sort], 'ID'], ascending=[ascending, ascending])
+
+    end = None if limit is None else offset + limit
+    page_df = doc_df.iloc[offset:end]
+
+    next_cursor = None
+    if sort is None and end is not None and end < len(doc_df) and not page_df.empty:
+        last_revision, last_id = page_df['currentRevision'].iloc[-1], page_df['ID'].iloc[-1]
+        last_revision = 'NaT' if pd.isnull(last_revision) else last_revision.isoformat()
+        next_cursor = f"{last_revision}|{last_id}"
+
+    return page_df, next_cursor
+
+
+def get_rows_after_cursor_mask(doc_df, cursor):
+    """ returns a mask of the rows after a keyset cursor in the default sort order (currentRevision and ID in
+        descending order, rows without a currentRevision last)
+
+    Args:
+        doc_df (df): rows of the detailed table
+        cursor (str): currentRevision (iso format or NaT) and ID of the last row of the previous page, separated by |
+
+    Returns:
+        series: boolean mask
+    """
+    try:
+        last_revision, last_id = cursor.rsplit('|', 1)
+        last_revision, last_id = pd.Timestamp(last_revision), int(last_id)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+    if pd.isnull(last_revision):
+        return doc_df['currentRevision'].isna() & (doc_df['ID'] < last_id)
+    return (doc_df['currentRevision'] < last_revision) | doc_df['currentRevision'].isna() | \
+        ((doc_df['currentRevision'] == last_revision) & (doc_df['ID'] < last_id))
+
+
+def get_filter_mask(output_df, positions, recency, section, rel_type, statuses=None, status_overlay=None):
+    """returns which of the rows of output_df at positions pass the same filters as the Detect Changes tab, only the
+       columns the filters read are accessed so that no copy of the rows is made
+
+    Args:
+        output_df (df): final_output_df of the snapshot
+        positions (array): positions of the rows in output_df
+        recency (string): recency period
+        section (string): section title, 'All' for all the sections
+        rel_type (string): change relevance, see relevance_secs
+        statuses (list): statuses of the rows kept, None for all the statuses
+        status_overlay (dict): status changes saved since the data was read from the sql db, see apply_status_overlay
+
+    Returns:
+        array: boolean mask, one value per position
+    """
+    ids = output_df['ID'].to_numpy()[positions]
+    rel_preds = output_df['rel_model_pred'].to_numpy()[positions]
+    row_statuses = np.asarray(output_df['status'].to_numpy()[positions], dtype=object)
+    # apply the status changes saved by the users
+    if status_overlay:
+        for index in np.flatnonzero(np.isin(ids, list(status_overlay.keys()))):
+            row_statuses[index] = status_overlay[ids[index]].get('status', row_statuses[index])
+
+    mask = np.ones(len(positions), dtype=bool)
+    _, historical = get_recency_historical(recency)
+    if not historical:
+        mask &= output_df['currentRevision'].to_numpy()[positions] > np.datetime64(get_recency_date(recency))
+    if section != 'All':
+        mask &= output_df['sectionTitle'].to_numpy()[positions] == section
+
+    # same filters as relevance_secs
+    not_relevant_status = row_statuses == 'not relevant'
+    if rel_type.lower() == 'relevant':
+        mask &= (rel_preds == 1) & ~not_relevant_status
+    elif rel_type.lower() == 'maybe relevant':
+        mask &= (rel_preds == 0.5) & ~not_relevant_status
+    elif rel_type.lower() == 'not relevant':
+        mask &= (rel_preds == 0) | not_relevant_status
+
+    if statuses is not None:
+        mask &= np.isin(row_statuses, statuses)
+
+    return mask
+
+
+def get_export_positions(output_df, positions, recency, section, rel_type, statuses=None, status_overlay=None):
+    """filters the rows selected for an export with the same filters as the Detect Changes tab (see get_filter_mask)
+
+    Args:
+        output_df (df): final_output_df of the snapshot
+        positions (array): positions of the rows of the selected document(s) in output_df
+        recency (string): recency period
+        section (string): section title, 'All' for all the sections
+        rel_type (string): change relevance, see relevance_secs
+        statuses (list): statuses of the rows exported, None for all the statuses
+        status_overlay (dict): status changes saved since the data was read from the sql db, see apply_status_overlay
+
+    Returns:
+        array: positions of the filtered rows in output_df, sorted by currentRevision and ID in descending order
+    """
+    mask = get_filter_mask(output_df, positions, recency, section, rel_type, statuses, status_overlay)
+    positions = positions[mask]
+    rows_df = pd.DataFrame({'currentRevision': output_df['currentRevision'].to_numpy()[positions],
+                            'ID': output_df['ID'].to_numpy()[positions], 'position': positions})
+    return rows_df.sort_values(by=['currentRevision', 'ID'], ascending=[False, False])['position'].to_numpy()
+
+
+def iter_export_chunks(output_df, positions, export_format, status_overlay=None,
+                       chunk_size=constant.EXPORT_CHUNK_ROWS):
+    """generates an export of rows of the Detect Changes dataframe in chunks, only one chunk of rows is formatted
+       and held in memory at a time
+
+    Args:
+        output_df (df): final_output_df of the snapshot
+        positions (array): positions of the exported rows in output_df, see get_export_positions
+        export_format (string): 'ndjson' (one json object per line) or 'csv'
+        status_overlay (dict): status changes saved since the data was read from the sql db, see apply_status_overlay
+        chunk_size (int): number of rows formatted per chunk
+
+    Yields:
+        string: text of the next chunk of rows
+    """
+    source_cols = [col for col in constant.EXPORT_COLS if col != 'Relevance'] + ['rel_model_pred']
+    for start in range(0, len(positions), chunk_size):
+        chunk_df = apply_status_overlay(output_df.iloc[positions[start:start + chunk_size]][source_cols],
+                                        status_overlay).copy()
+        chunk_df['currentRevision'] = chunk_df['currentRevision'].dt.strftime(constant.DT_FORMAT)
+        chunk_df['Relevance'] = np.select([chunk_df['rel_model_pred'] == 0.5, chunk_df['rel_model_pred'] == 1],
+                                          [constant.REL_TYPES[2], constant.REL_TYPES[1]], constant.REL_TYPES[0])
+        chunk_df = chunk_df[constant.EXPORT_COLS]
+
+        if export_format == 'csv':
+            yield chunk_df.to_csv(index=False, header=start == 0)
+        else:
+            # (older pandas versions do not end the last line with a line break)
+            text = chunk_df.to_json(orient='records', lines=True, date_format='iso')
+            yield text if text.endswith('\n') else text + '\n'
+
+    # csv header of an empty export
+    if export_format == 'csv' and len(positions) == 0:
+        yield ','.join(constant.EXPORT_COLS) + '\n'
 
 
 def update_status_on_submit(results, final_output_df):
     """Depending on the value chosen by the user in the status dropdown, on clicking the Submit button, prepare the
-       date to be pushed into the sql db and for updating the final_output_df
+       date to be pushed into the sql db and for updating the status overlay of the data snapshot
 
     Args:
         results (list of dict): read from the UI, each item in results is a dict of keys 'id' which has the row id
                                 to be updated and 'value' which is the status value chosen by the user on Detect
-                                Changes page final_output_df (_type_): _description_
-        final_output_df: TODO
+                                Changes page
+        final_output_df (df): rows of the Detect Changes dataframe for the submitted ids, with the status changes
+                              already saved applied (see DataSnapshot.get_change_rows) - the ids without a row are
+                              not updated (e.g. rows removed by a refresh since the page was loaded)
 
     Returns:
-        db_updates - (list of tuples): list of tuples for db - (row id, col name, value to be set)
-        df_updates - (list of tuples): list of tuples for df- (mask, col name, value to be set)
+        db_updates - (list of tuples): list of tuples for db - (row id, dict of col name: value to be set), all the
+                     changes to a row are grouped so that they are written by a single statement
+        df_updates - (list of tuples): list of tuples for the snapshot overlay - (row id, col name, value to be set)
     """
     db_updates = []
     df_updates = []
@@ -514,45 +988,110 @@ def update_status_on_submit(results, final_output_df):
     now = datetime.now()
     dt_string = now.strftime("%m/%d/%Y %H:%M:%S")
 
+    # current status of the submitted rows, looked up by id instead of masking the rows for each id
+    existing_values = dict(zip(final_output_df['ID'], final_output_df['status']))
+
     for row in results:
-        mask = final_output_df['ID'] == int(row['id'])
+        row_id = int(row['id'])
         row['value'] = row['value'].lower()
+        # the status value is used as a col name in the db, ignore anything that is not a status
+        if row['value'] not in STATUS_DTYPE.categories:
+            continue
+        # the row is not in the snapshot any more, the other rows are still updated
+        if row_id not in existing_values:
+            continue
 
         if row['value'] == 'not relevant':
-            db_updates.append(('validatedNotRelevant', True, row['id']))
-            df_updates.append((mask, 'validatedNotRelevant', True))
-            df_updates.append((mask, 'status', row['value']))
+            changes = {'validatedNotRelevant': True, 'status': row['value']}
 
-            db_updates.append(('lastSubmit', dt_string, row['id']))
-            df_updates.append((mask, 'lastSubmit', dt_string))
-
-        else:
-            existing_value = final_output_df[mask]['status'].values[0]
-            if row['value'] != existing_value:
-                if row['value'] != 'not started':
-                    db_updates.append((row['value'], True, row['id']))
-                    df_updates.append((mask, 'status', row['value']))
-
-                    if row['value'] == 'reviewed':
-                        db_updates.append(('addressed', False, row['id']))
-                        df_updates.append((mask, 'addressed', False))
-                    else:
-                        db_updates.append(('reviewed', True, row['id']))
-                        df_updates.append((mask, 'reviewed', True))
+        elif row['value'] != existing_values[row_id]:
+            if row['value'] != 'not started':
+                changes = {row['value']: True, 'status': row['value']}
 
+                if row['value'] == 'reviewed':
+                    changes['addressed'] = False
                 else:
-                    db_updates.append(('addressed', False, row['id']))
-                    db_updates.append(('reviewed', False, row['id']))
+                    changes['reviewed'] = True
 
-                    df_updates.append((mask, 'status', 'not started'))
-                    df_updates.append((mask, ['reviewed', 'addressed'], False))
+            else:
+                changes = {'addressed': False, 'reviewed': False, 'status': 'not started'}
+        else:
+            continue
 
-                db_updates.append(('lastSubmit', dt_string, row['id']))
-                df_updates.append((mask, 'lastSubmit', dt_string))
+        changes['lastSubmit'] = dt_string
+        # status is only a col of the dataframe, it is derived from the reviewed/addressed cols in the db
+        db_updates.append((row_id, {col: value for col, value in changes.items() if col != 'status'}))
+        df_updates.extend((row_id, col, value) for col, value in changes.items())
 
     return db_updates, df_updates
 
 
+def get_batch_update_query(table_name, db_updates):
+    """ returns a single parameterized sql batch applying all the db updates, so that they are sent to the db in one
+        round trip - the rows updating the same set of cols are joined to a table of values and updated by one
+        statement (split in chunks of constant.MAX_ROWS_PER_UPDATE rows, the limit of a table value constructor)
+
+    Args:
+        table_name (str): name of the table which is being updated
+        db_updates (list of tuples): (row id, dict of col name: value to be set), see update_status_on_submit
+
+    Returns:
+        str: sql batch
+        tuple: query parameters
+    """
+    # group the rows by the set of cols they update
+    updates_by_cols = {}
+    for row_id, changes in db_updates:
+        cols = tuple(changes.keys())
+        # col names can not be parameters, only the status cols of the table can be updated
+        unknown_cols = set(cols) - set(constant.STATUS_DB_COLS)
+        if unknown_cols:
+            raise ValueError(f"Can not update the cols {unknown_cols}")
+        updates_by_cols.setdefault(cols, []).append((row_id, *changes.values()))
+
+    statements = []
+    params = []
+    for cols, rows in updates_by_cols.items():
+        set_cols = ', '.join(f"t.[{col}] = v.[{col}]" for col in cols)
+        value_cols = ', '.join(f"[{col}]" for col in ('ID', ) + cols)
+        row_params = '(' + ', '.join(['%s'] * (len(cols) + 1)) + ')'
+
+        for chunk_start in range(0, len(rows), constant.MAX_ROWS_PER_UPDATE):
+            chunk = rows[chunk_start:chunk_start + constant.MAX_ROWS_PER_UPDATE]
+            statements.append(f"UPDATE t SET {set_cols} FROM [dbo].[{table_name}] AS t "
+                              f"INNER JOIN (VALUES {', '.join([row_params] * len(chunk))}) AS v ({value_cols}) "
+                              f"ON t.[ID] = v.[ID];")
+            params.extend(value for row in chunk for value in row)
+
+    return '\n'.join(statements), tuple(params)
+
+
+def apply_status_overlay(df, status_overlay):
+    """returns the rows of a dataframe with the status changes saved by the users applied, the input dataframe is
+       never modified as it can be shared by several requests
+
+    Args:
+        df (df): rows of the Detect Changes dataframe
+        status_overlay (dict): {row id: {col name: value}} status changes saved since the data was read from the sql db
+
+    Returns:
+        df: input dataframe if none of its rows have been changed, else a copy with the changes applied
+    """
+    if not status_overlay or df.empty:
+        return df
+
+    mask = df['ID'].isin(list(status_overlay.keys()))
+    if not mask.any():
+        return df
+
+    df = df.copy()
+    for index, row_id in df.loc[mask, 'ID'].items():
+        for col, value in status_overlay[row_id].items():
+            df.at[index, col] = value
+
+    return df
+
+
 def format_response_msg_on_submit(response):
     """returns a bool success status and a text message depending on if the update to sql db was a success or a failure
     
@@ -609,6 +1148,58 @@ def time_metric(time):
     return result
 
 
+def format_sl_doc_changes(changes_df):
+    """ formats the changes linked to an SL document (see DataSnapshot.get_sl_doc_changes) for the json response
+
+    Args:
+        changes_df: (dataframe) - page of changes of the SL document reverse index
+
+    Returns: (list) - list of dicts, one per change
+    """
+    link_rel_types = {value: key for key, value in constant.LINK_REL_MAP.items()}
+    rev_dates = changes_df['currentRevision'].dt.strftime(constant.DT_FORMAT)
+    return [{'ID': int(row_id), 'documentType': doc_type, 'documentName': doc_name,
+             'currentRevision': None if pd.isnull(rev_date) else rev_date, 'sectionTitle': section,
+             'pageNumber': None if pd.isnull(page) else int(page), 'link_relevancy': link_rel_types[link_relevancy]}
+            for row_id, doc_type, doc_name, rev_date, section, page, link_relevancy
+            in zip(changes_df['ID'], changes_df['documentType'], changes_df['documentName'], rev_dates,
+                   changes_df['sectionTitle'], changes_df['pageNumber'], changes_df['link_relevancy'])]
+
+
+def format_search_results(rows_df, scores):
+    """ formats the results of a full-text search (see DataSnapshot.search) for the json response
+
+    Args:
+        rows_df: (dataframe) - page of rows of final_output_df matching the search, with the status overlay applied
+        scores: (array) - BM25 score of each row
+
+    Returns: (list) - list of dicts, one per result
+    """
+    results_df = rows_df[['ID', 'documentType', 'documentName', 'currentRevision', 'sectionTitle', 'pageNumber',
+                          'changeText', 'rel_model_pred', 'status']].copy()
+    results_df['currentRevision'] = results_df['currentRevision'].dt.strftime(constant.DT_FORMAT)
+    results_df['Relevance'] = np.select([results_df['rel_model_pred'] == 0.5, results_df['rel_model_pred'] == 1],
+                                        [constant.REL_TYPES[2], constant.REL_TYPES[1]], constant.REL_TYPES[0])
+    results_df['score'] = np.round(scores, 4)
+    results_df = results_df.drop(columns='rel_model_pred').astype(object)
+    return results_df.where(results_df.notna(), None).to_dict('records')
+
+
+def get_latency_stats(latencies):
+    """ returns the count, median, 95th percentile and max of durations
+
+    Args:
+        latencies: (list) - durations in ms
+
+    Returns: (dict) - None values if there are no durations
+    """
+    if not latencies:
+        return {'count': 0, 'p50': None, 'p95': None, 'max': None}
+    p50, p95 = np.percentile(latencies, [50, 95])
+    return {'count': len(latencies), 'p50': round(float(p50), 2), 'p95': round(float(p95), 2),
+            'max': round(float(max(latencies)), 2)}
+
+
 def get_recency_date(recency):
     """ returns a date for a recency period
     
@@ -697,26 +1288,6 @@ def get_recency_historical(recency):
 
 # Functions for viz tabs
 # --------------------------------------------------
-def get_gov_or_nongov_df_copy(doc_type, gov_viz_df, nongov_viz_df):
-    """ returns a copy of the gov_viz_df or nongov_viz_df based on the document type selected by the user
-
-    Args:
-        doc_type (string): document type selected from the dropdown (Legislature/Guidance) on golden thread or document
-                           map tabs
-        gov_viz_df (df): dataframe in the format needed for visualisation filtered for of all gov docs
-        nongov_viz_df (df): dataframe in the format needed for visualisation filtered for of all gov docs
-
-    Returns:
-        df: copy of gov_viz_df or non_gov_viz_df
-    """
-    if doc_type.lower() == 'legislation':
-        plot_doc_df = gov_viz_df.copy()
-    else:
-        plot_doc_df = nongov_viz_df.copy()
-
-    return plot_doc_df
-
-
 def get_relevant_link_rows_for_viz(link_rel_type, plot_doc_df):
     """filters the dataframe according to the link relevancy selected on the golden thread and document map tabs
 
@@ -754,20 +1325,24 @@ def get_recent_rows_for_viz(recency, plot_doc_df):
         # get all rows starting from the recency period selected by the user
         # convert the recency period to a date (e.g: 1 month to a date 1 month from now)
         recency_date = get_recency_date(recency)
-        plot_doc_df['currentRevision'] = pd.to_datetime(plot_doc_df['currentRevision'], dayfirst=True)
         plot_doc_df = plot_doc_df.loc[(plot_doc_df.currentRevision > recency_date)]
 
     return plot_doc_df
 
 
 def plot_treemap(treemap_df):
-    """ returns plotly treemap fig converted to a json format
+    """ returns plotly treemap fig, see fig_to_json to convert it to a json format
     
     Args:
         treemap_df: (dataframe) - dataframe with details needed for the treemap
 
-    Returns: (json) - treemap fig converted to a json format
+    Returns: (plotly figure) - treemap fig
     """
+    # categorical columns are converted back to strings so that plotly only builds the observed sl documents and
+    # the revision dates are formatted for the hover data
+    treemap_df = treemap_df.astype({'sl_document': str, 'sectionTitle': str})
+    treemap_df['currentRevision'] = treemap_df['currentRevision'].dt.strftime(constant.DT_FORMAT)
+
     # use a constant parent as 'Sellafield Manuals and Practices' and child data from sellafieldDocument
     # (SL docs) and index (change #) columns
     fig = px.treemap(treemap_df, path=[px.Constant("Sellafield Manuals and Practices"), 'sl_document', 'ID'])
@@ -789,7 +1364,7 @@ def plot_treemap(treemap_df):
                                    '%{customdata[3]}<br><br><br><br>%{customdata[1]}')
 
     fig.update_layout(font_size=14, title_x=0.5, width=1000, height=900)
-    return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+    return fig
 
 
 def format_data_for_sankey(plot_doc_df):
@@ -802,7 +1377,12 @@ def format_data_for_sankey(plot_doc_df):
     """
     # count the number of changes from a source document to a target sl document by grouping by file_name
     # and SL_links cols and adding that as a new column
-    sankey_df = plot_doc_df.groupby(['documentName', 'sl_document'])['ID'].count().reset_index(name='no_of_changes')
+    # (observed=True as documentName and sl_document are categoricals so only the existing links are counted, the
+    # links are then sorted by name as they would be by a groupby on string columns)
+    sankey_df = plot_doc_df.groupby(['documentName', 'sl_document'], observed=True)['ID'].count()\
+        .reset_index(name='no_of_changes')
+    sankey_df = sankey_df.astype({'documentName': str, 'sl_document': str})\
+        .sort_values(['documentName', 'sl_document'], ignore_index=True)
 
     # add a new col source_id with unique sequential numbers for each document
     sankey_df['source_id'] = sankey_df.groupby('documentName').ngroup()
@@ -834,40 +1414,51 @@ def create_labels(sankey_df):
     return labels
 
 
-def color_fader(c1, c2, mix=0):
-    # for sankey diagram
-    # fade (linear interpolate) from color c1 (at mix=0) to c2 (mix=1)
-    c1 = np.array(mpl.colors.to_rgb(c1))
-    c2 = np.array(mpl.colors.to_rgb(c2))
-    return mpl.colors.to_hex((1-mix)*c1 + mix*c2)
+@lru_cache(maxsize=64)
+def get_sankey_palette(n_colours):
+    """ returns the colours of the sl document nodes of a sankey plot and the matching link colours, the palette
+        only depends on the number of sl documents so it is computed once per number of nodes
 
+    Args:
+        n_colours (int): number of sl document nodes
 
-def convert_rgba(x):
+    Returns:
+        tuple: node colours as hex strings (e.g: #483d8b)
+        tuple: link colours as rgba strings with an opacity of 0.6 (e.g: rgba(72, 61, 139, 0.6))
+    """
     # for sankey diagram
-    # convert to rgba to change opacity
-    rgba = ImageColor.getcolor(x.lower(), "RGB")+(0.6,)
-    rgba_text = f'rgba{rgba}'
-
-    return rgba_text
+    cnames = funcs_cnames.get_cnames()
+    start_rgb = np.array(mpl.colors.to_rgb(cnames['darkslateblue']))
+    end_rgb = np.array(mpl.colors.to_rgb(cnames['blanchedalmond']))
 
+    # fade (linear interpolate) from the start colour (at mix=0) to the end colour (mix=1) for all nodes at once
+    # (the mix of node ix is ix // n_colours, so every node currently gets the start colour)
+    mix = (np.arange(n_colours) // max(n_colours, 1))[:, None]
+    # round to 0-255 ints as matplotlib's to_hex does
+    rgb = np.round(((1 - mix) * start_rgb + mix * end_rgb) * 255).astype(int)
 
-def apply_colour(label, labels_list, colours_list):
-    # for sankey diagram
-    # function to apply colour
-    return colours_list[labels_list.index(label)]
+    node_colours = tuple('#{:02x}{:02x}{:02x}'.format(*colour) for colour in rgb)
+    link_colours = tuple('rgba({}, {}, {}, 0.6)'.format(*colour) for colour in rgb)
+    return node_colours, link_colours
 
 
 def gen_colour(sankey_df):
-    # for sankey diagram
-    cnames = funcs_cnames.get_cnames()
+    """ adds the link colours to a sankey dataframe, the links to a sl document get the colour of its node
 
-    sl_doc_names = sankey_df['sl_document'].unique().tolist()
-    sankey_cmaps = [color_fader(cnames['darkslateblue'], cnames['blanchedalmond'],
-                                int(ix / len(sl_doc_names))) for ix in range(len(sl_doc_names))]
+    Args:
+        sankey_df (df): dataframe formatted for a sankey plot
 
-    sankey_df['link_colours'] = sankey_df['sl_document'].apply(lambda x: apply_colour(x, sl_doc_names, sankey_cmaps))
-    sankey_df['link_colours'] = sankey_df['link_colours'].apply(lambda x: convert_rgba(x))
-    return sankey_df, sankey_cmaps
+    Returns:
+        df: sankey dataframe with a link_colours column
+        list: colours of the sl document nodes, in the order the sl documents first appear in the dataframe
+    """
+    # for sankey diagram
+    # number the sl documents in the order they first appear (the order of their nodes)
+    sl_doc_codes, sl_doc_names = pd.factorize(sankey_df['sl_document'])
+    node_colours, link_colours = get_sankey_palette(len(sl_doc_names))
+
+    sankey_df['link_colours'] = np.array(link_colours, dtype=object)[sl_doc_codes] if len(sl_doc_codes) else []
+    return sankey_df, list(node_colours)
 
 
 def sankey_plot(sankey_df, labels, sankey_cmaps):
@@ -876,9 +1467,9 @@ def sankey_plot(sankey_df, labels, sankey_cmaps):
     Args:
         sankey_df:      dataframe formatted for a sankey plot
         labels:         list of all source and target nodes
-        sankey_cmaps:   list of  color_fader, see gen_colour function
+        sankey_cmaps:   list of sl document node colours, see gen_colour function
     
-    Returns:   sankey plot converted to json format
+    Returns:   sankey plot fig, see fig_to_json to convert it to a json format
     """
     doc_names = sankey_df['documentName'].unique().tolist()
     sl_doc_names = sankey_df['sl_document'].unique().tolist()
@@ -898,6 +1489,8 @@ def sankey_plot(sankey_df, labels, sankey_cmaps):
     hoverlabel = dict(bgcolor='black',  font=dict(color='white'))
 
     # plot sankey diagram
+    # (the properties are set from constants and lists built above, so they are not validated by plotly, which
+    # would otherwise check every element of the node and link lists)
     fig = go.Figure(data=[go.Sankey(
                         valueformat=".0f",
                         node=OrderedDict(
@@ -919,10 +1512,50 @@ def sankey_plot(sankey_df, labels, sankey_cmaps):
                                     hoverlabel=hoverlabel,
                                     hovertemplate='Source:  %{source.label}<br>Target:  '
                                                   '%{target.label}<br>Changes: %{value}<extra></extra>'
-                        )
-    )])
+                        ),
+                        _validate=False
+    )], _validate=False)
 
     fig.update_layout(font_size=14, title_x=0.5, width=800, height=1000)
-    fig.update_traces(node_hoverinfo=None, selector=dict(type='sankey'))
+    # (node_hoverinfo is not set on the trace, setting it to None - unset - is not needed: on an unvalidated trace
+    # it would add a null hoverinfo to the json)
+
+    return fig
+
+
+def fig_to_json(fig):
+    """ converts a plotly figure to json
+
+    With orjson installed (and constant.FAST_PLOT_JSON set), the dict of the figure returned by plotly
+    (fig.to_plotly_json(), with the numeric arrays converted to plotly.js typed arrays) is encoded by orjson, which
+    serialises numpy arrays natively, so the parsed json is the same as with plotly's json encoder. The figures with a
+    value orjson cannot encode are serialised with plotly's json encoder.
+
+    Args:
+        fig: plotly figure
+
+    Returns: (str) - figure converted to a json format
+    """
+    if orjson is not None and constant.FAST_PLOT_JSON:
+        try:
+            return orjson.dumps(fig.to_plotly_json(), default=_encode_json_default,
+                                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            pass
 
     return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+
+
+def _encode_json_default(obj):
+    # values not natively serialised by orjson, encoded as plotly's json encoder does
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return obj.tolist()
+    if obj is pd.NaT:
+        return None
+    if isinstance(obj, (datetime, pd.Timestamp)):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")